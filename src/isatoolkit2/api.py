@@ -0,0 +1,50 @@
+"""
+Python API over integration site records.
+
+The functions take and return iterables of BedLine site records instead of
+file handles, so sites can be counted, sorted and merged in process without
+writing and parsing intermediate BED files. The CLI commands are thin
+wrappers around the same functions.
+"""
+
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Annotated, Literal
+
+from annotated_types import Ge
+
+from isatoolkit2.bed.bed_utils import BedLine, Strand, format_bed_line
+from isatoolkit2.bed.merge import iter_lines, merge_sites
+from isatoolkit2.bed.sort import sort_sites
+from isatoolkit2.bgzf import open_text_input, open_text_output
+from isatoolkit2.sam.count import PositionCounts, count_sites
+
+__all__ = [
+    "BedLine",
+    "PositionCounts",
+    "Strand",
+    "count_sites",
+    "merge_sites",
+    "read_sites",
+    "sort_sites",
+    "write_sites",
+]
+
+
+def read_sites(
+    path: Literal["-"] | Path,
+) -> Iterator[BedLine]:
+    """Lazily read the sites of a plain or compressed BED file (or stdin)."""
+    with open_text_input(path) as infile:
+        yield from iter_lines(infile)
+
+
+def write_sites(
+    sites: Iterable[BedLine],
+    path: Literal["-"] | Path,
+    threads: Annotated[int, Ge(1)] = 1,
+) -> None:
+    """Write sites to a BED file (or stdout), BGZF compressed for .gz/.bgz paths."""
+    with open_text_output(path, threads=threads) as outfile:
+        for site in sites:
+            outfile.write(format_bed_line(site))
@@ -0,0 +1,94 @@
+"""Combine position sorted count BED files, adding up the counts of each site."""
+
+import heapq
+from collections.abc import Iterator
+from typing import Annotated, TextIO
+
+from annotated_types import Ge
+
+from isatoolkit2.bed.bed_utils import STRAND_BITS, BedLine, format_bed_line, natural_key
+from isatoolkit2.bed.merge import iter_lines
+
+# A site with its sort key, chromosome key, start and strand, and the index
+# of its input, so sites with the same key are merged in input order
+SortedSite = tuple[list[str | int], int, int, int, BedLine]
+
+
+def sorted_sites(
+    infile: TextIO,
+    index: Annotated[int, Ge(0)],
+    name: str,
+) -> Iterator[SortedSite]:
+    """Read position sorted sites, checking the sort order."""
+    previous_key = None
+    chromosome_keys: dict[str, list[str | int]] = {}
+    for line in iter_lines(infile):
+        chromosome_key = chromosome_keys.get(line.seqname)
+        if chromosome_key is None:
+            chromosome_key = chromosome_keys[line.seqname] = natural_key(line.seqname)
+        key = (chromosome_key, line.start, STRAND_BITS[line.strand])
+        if previous_key is not None and key < previous_key:
+            error_msg = (
+                f"BED file {name} is not position sorted "
+                f"at {line.seqname}:{line.start}. Sort it with bed sort first."
+            )
+            raise ValueError(error_msg)
+        previous_key = key
+        yield *key, index, line
+
+
+def combine_sites(
+    streams: list[Iterator[SortedSite]],
+) -> Iterator[BedLine]:
+    """
+    Merge position sorted sites k-way, adding up the scores of identical sites.
+
+    Sites are identical if they have the same chromosome, start and strand,
+    and the combined site has the end and name of the first input with it.
+    Only one site per input is kept in memory.
+    """
+    site = None
+    score = 0
+    for *_, line in heapq.merge(*streams):
+        if (
+            site is not None
+            and line.start == site.start
+            and line.strand == site.strand
+            and line.seqname == site.seqname
+        ):
+            score += line.score
+            continue
+        if site is not None:
+            yield _with_score(site, score)
+        site = line
+        score = line.score
+    if site is not None:
+        yield _with_score(site, score)
+
+
+def _with_score(
+    site: BedLine,
+    score: Annotated[int, Ge(1)],
+) -> BedLine:
+    """Get a site with a score, only copying it if the score changed."""
+    return site if site.score == score else site.model_copy(update={"score": score})
+
+
+def combine_counts(
+    infiles: list[TextIO],
+    names: list[str],
+    outfile: TextIO,
+) -> None:
+    """
+    Combine position sorted count BED files into one, summing identical sites.
+
+    The output is position sorted, like the output of bed sort, and is the
+    same as concatenating the inputs, sorting them and adding up the scores
+    of identical sites.
+    """
+    streams = [
+        sorted_sites(infile, index, name)
+        for index, (infile, name) in enumerate(zip(infiles, names, strict=True))
+    ]
+    outfile.writelines(format_bed_line(site) for site in combine_sites(streams))
+    outfile.flush()
@@ -0,0 +1,187 @@
+"""Genomic intervals from regions and BED files, indexed for overlap queries."""
+
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Annotated, Literal
+
+from annotated_types import Ge
+
+from isatoolkit2.bed.bed_utils import BedLine
+from isatoolkit2.bgzf import open_text_input
+
+# End of a region without an end, past the end of any contig
+CONTIG_END = 1 << 62
+
+# Position range of a region, e.g. 1,000-2,000 or 1000
+REGION_RANGE = re.compile(r"(?P<start>[\d,]+)(?:-(?P<end>[\d,]*))?")
+
+# An interval as chromosome, 0-based start and exclusive end
+Interval = tuple[str, Annotated[int, Ge(0)], Annotated[int, Ge(0)]]
+
+
+def parse_region(
+    region: str,
+) -> Interval:
+    """
+    Parse a samtools style region, e.g. chr1, chr1:1000 or chr1:1,000-2,000.
+
+    Positions are 1-based and inclusive, as in samtools. A region without
+    an end extends to the end of the contig. Contig names with colons,
+    e.g. HLA alleles, can be put in braces, e.g. {HLA-A*01:01}:100-200.
+    """
+    if region.startswith("{") and "}" in region:
+        contig, _, rest = region[1:].partition("}")
+        if not rest:
+            return contig, 0, CONTIG_END
+        separator, positions = rest[:1], rest[1:]
+        match = REGION_RANGE.fullmatch(positions) if separator == ":" else None
+    else:
+        contig, _, positions = region.rpartition(":")
+        match = REGION_RANGE.fullmatch(positions) if contig else None
+        if match is None:
+            return region, 0, CONTIG_END
+
+    if match is None:
+        error_msg = f"Invalid region: {region}"
+        raise ValueError(error_msg)
+
+    start = int(match["start"].replace(",", ""))
+    end = int(match["end"].replace(",", "")) if match["end"] else CONTIG_END
+    if start < 1 or end < start:
+        error_msg = f"Invalid region: {region}"
+        raise ValueError(error_msg)
+    return contig, start - 1, end
+
+
+def read_bed_intervals(
+    path: Literal["-"] | Path,
+) -> Iterator[Interval]:
+    """Read the intervals of a plain or compressed BED file of at least 3 columns."""
+    with open_text_input(path) as infile:
+        for line_number, line in enumerate(infile, start=1):
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.split("\t", 3)
+            try:
+                chrom, start, end = fields[0], int(fields[1]), int(fields[2])
+            except (IndexError, ValueError):
+                error_msg = f"Invalid BED line {line_number} in {path}: {line!r}"
+                raise ValueError(error_msg) from None
+            if start < 0 or end < start:
+                error_msg = f"Invalid BED interval on line {line_number} in {path}"
+                raise ValueError(error_msg)
+            yield chrom, start, end
+
+
+class IntervalIndex:
+
+    """
+    Merged intervals per chromosome, for overlap queries by binary search.
+
+    Overlapping and adjacent intervals are merged, so the intervals of a
+    chromosome are sorted and disjoint, and a query only needs the last
+    interval starting before its end.
+    """
+
+    def __init__(
+        self,
+        intervals: Iterable[Interval],
+    ) -> None:
+        """Merge the intervals of each chromosome."""
+        by_chrom: defaultdict[str, list[tuple[int, int]]] = defaultdict(list)
+        for chrom, start, end in intervals:
+            by_chrom[chrom].append((start, end))
+
+        self.starts: dict[str, list[int]] = {}
+        self.ends: dict[str, list[int]] = {}
+        for chrom, chrom_intervals in by_chrom.items():
+            starts: list[int] = []
+            ends: list[int] = []
+            for start, end in sorted(chrom_intervals):
+                if ends and start <= ends[-1]:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[chrom] = starts
+            self.ends[chrom] = ends
+
+    def __len__(self) -> int:
+        """Get the number of merged intervals."""
+        return sum(len(starts) for starts in self.starts.values())
+
+    def chromosomes(self) -> list[str]:
+        """Get the chromosomes with intervals."""
+        return list(self.starts)
+
+    def intervals(
+        self,
+        chrom: str,
+    ) -> Iterator[tuple[int, int]]:
+        """Get the merged intervals of a chromosome, in order."""
+        return zip(self.starts.get(chrom, []), self.ends.get(chrom, []), strict=True)
+
+    def overlaps(
+        self,
+        chrom: str,
+        start: Annotated[int, Ge(0)],
+        end: Annotated[int, Ge(0)],
+    ) -> bool:
+        """Check if an interval overlaps any of the intervals."""
+        starts = self.starts.get(chrom)
+        if not starts:
+            return False
+        # The last interval starting before the end of the query
+        i = bisect_left(starts, end) - 1
+        return i >= 0 and self.ends[chrom][i] > start
+
+
+def region_index(
+    regions: Iterable[str] = (),
+    targets: None | Path = None,
+) -> None | IntervalIndex:
+    """Index samtools style regions and the intervals of a targets BED file."""
+    intervals = [parse_region(region) for region in regions]
+    if targets is not None:
+        intervals.extend(read_bed_intervals(targets))
+    elif not intervals:
+        return None
+    return IntervalIndex(intervals)
+
+
+@dataclass
+class ExcludedSites:
+
+    """Sites that overlapped excluded intervals, and their total count."""
+
+    sites: Annotated[int, Ge(0)] = 0
+    reads: Annotated[int, Ge(0)] = 0
+
+    def add(
+        self,
+        count: Annotated[int, Ge(0)],
+    ) -> None:
+        """Add an excluded site with its count."""
+        self.sites += 1
+        self.reads += count
+
+    def __str__(self) -> str:
+        """Describe the excluded sites for a report."""
+        return f"Excluded {self.sites:,} sites with {self.reads:,} reads"
+
+
+def exclude_sites(
+    lines: Iterable[BedLine],
+    exclude: IntervalIndex,
+    excluded: ExcludedSites,
+) -> Iterator[BedLine]:
+    """Skip the sites whose 5' position overlaps an excluded interval."""
+    for line in lines:
+        if exclude.overlaps(line.seqname, line.start, line.start + 1):
+            excluded.add(line.score)
+        else:
+            yield line
@@ -0,0 +1,219 @@
+"""Build a sites by samples count matrix from per-sample BED files."""
+
+import heapq
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from itertools import count
+from pathlib import Path
+from typing import Annotated, Literal, TextIO
+
+import click
+from annotated_types import Ge, Le
+
+from isatoolkit2.bed.bed_utils import STRAND_BITS, BedLine, natural_key
+from isatoolkit2.bed.merge import cluster_position, iter_lines
+from isatoolkit2.bgzf import COMPRESSED_SUFFIXES
+
+
+def sample_name(
+    path: Literal["-"] | Path,
+) -> str:
+    """Get a sample name from a BED file name, without BED or compression suffixes."""
+    if str(path) == "-":
+        return "stdin"
+    name = Path(path).name
+    for suffixes in (COMPRESSED_SUFFIXES, (".bed",)):
+        for suffix in suffixes:
+            if name.lower().endswith(suffix):
+                name = name[: -len(suffix)]
+                break
+    return name
+
+
+def sorted_sample_sites(
+    infile: click.utils.LazyFile | TextIO,
+    sample: Annotated[int, Ge(0)],
+    name: str,
+) -> Iterator[tuple[list[str | int], int, int, BedLine]]:
+    """Read position sorted sites of a sample, checking the sort order."""
+    previous_key = None
+    chromosome_keys: dict[str, list[str | int]] = {}
+    for line in iter_lines(infile):
+        chromosome_key = chromosome_keys.get(line.seqname)
+        if chromosome_key is None:
+            chromosome_key = chromosome_keys[line.seqname] = natural_key(line.seqname)
+        key = (chromosome_key, line.start)
+        if previous_key is not None and key < previous_key:
+            error_msg = (
+                f"BED file of sample {name} is not position sorted "
+                f"at {line.seqname}:{line.start}. Sort it with bed sort first."
+            )
+            raise ValueError(error_msg)
+        previous_key = key
+        yield key[0], line.start, sample, line
+
+
+@dataclass
+class SampleCluster:
+
+    """A cluster of proximal sites, with the sample of each site."""
+
+    members: list[BedLine] = field(default_factory=list)
+    samples: list[int] = field(default_factory=list)
+
+    def add(
+        self,
+        line: BedLine,
+        sample: int,
+    ) -> None:
+        """Add a site from a sample to the cluster."""
+        self.members.append(line)
+        self.samples.append(sample)
+
+    def counts(
+        self,
+        num_samples: Annotated[int, Ge(1)],
+    ) -> list[int]:
+        """Sum the scores of the sites in the cluster per sample."""
+        counts = [0] * num_samples
+        for line, sample in zip(self.members, self.samples, strict=True):
+            counts[sample] += line.score
+        return counts
+
+
+# A cluster with its merged position and the entry that names it
+MergedCluster = tuple[int, BedLine, SampleCluster]
+
+
+class ChromosomeClusters:
+
+    """
+    Clusters of proximal sites on one chromosome, in order of their position.
+
+    Sites are chained per chromosome name and strand as in
+    merge_integration_sites. A closed cluster waits for open clusters that
+    started before its merged position, so clusters on both strands come out
+    sorted by merged position.
+    """
+
+    def __init__(
+        self,
+        distance: Annotated[int, Ge(0), Le(100)] = 5,
+    ) -> None:
+        """Initialize without clusters."""
+        self.distance = distance
+        self.open: dict[tuple[str, str], SampleCluster] = {}
+        self.closed: list[tuple[int, int, int, MergedCluster]] = []
+        self.order = count()
+
+    def _close(
+        self,
+        group: tuple[str, str],
+    ) -> None:
+        """Close the open cluster of a chromosome name and strand."""
+        cluster = self.open.pop(group)
+        position, entry = cluster_position(cluster.members)
+        heapq.heappush(
+            self.closed,
+            (
+                position,
+                STRAND_BITS[group[1]],
+                next(self.order),
+                (position, entry, cluster),
+            ),
+        )
+
+    def add(
+        self,
+        line: BedLine,
+        sample: int,
+    ) -> None:
+        """Add a site, which must not start before previously added sites."""
+        group = (line.seqname, str(line.strand))
+        cluster = self.open.get(group)
+        last_start = cluster.members[-1].start if cluster is not None else None
+        if last_start is not None and line.start - last_start > self.distance:
+            # The site starts a new cluster, so the open cluster is complete
+            self._close(group)
+            cluster = None
+        if cluster is None:
+            cluster = self.open[group] = SampleCluster()
+        cluster.add(line, sample)
+
+    def ready(self) -> Iterator[MergedCluster]:
+        """Return the closed clusters positioned before all open clusters."""
+        first_open = min(cluster.members[0].start for cluster in self.open.values())
+        while self.closed and self.closed[0][0] < first_open:
+            yield heapq.heappop(self.closed)[-1]
+
+    def flush(self) -> Iterator[MergedCluster]:
+        """Close and return all clusters."""
+        for group in list(self.open):
+            self._close(group)
+        while self.closed:
+            yield heapq.heappop(self.closed)[-1]
+
+
+def cluster_samples(
+    streams: list[Iterator[tuple[list[str | int], int, int, BedLine]]],
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+) -> Iterator[MergedCluster]:
+    """
+    Merge position sorted sites of all samples into clusters of proximal sites.
+
+    The streams are merged k-way, so the clusters are the same as merging
+    the sites of all samples together, and only one site per sample and the
+    open clusters are kept in memory.
+    """
+    clusters = ChromosomeClusters(distance)
+    chromosome_key = None
+    for key, _, sample, line in heapq.merge(*streams, key=lambda site: site[:2]):
+        if key != chromosome_key:
+            # All clusters on the previous chromosome are complete
+            yield from clusters.flush()
+            chromosome_key = key
+        clusters.add(line, sample)
+        yield from clusters.ready()
+    yield from clusters.flush()
+
+
+def count_matrix(
+    infiles: list[click.utils.LazyFile | TextIO],
+    names: list[str],
+    outfile: click.utils.LazyFile | TextIO,
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+    output_format: Literal["dense", "coo"] = "dense",
+) -> None:
+    """
+    Write a sites by samples count matrix of position sorted per-sample BEDs.
+
+    Each row is a cluster of proximal sites across all samples, at the
+    position merge_integration_sites gives it, with the total score of
+    each sample. The dense format has a column per sample, the sparse COO
+    format has a line per site and sample with a non-zero count.
+    """
+    if len(set(names)) != len(names):
+        error_msg = "Sample names must be unique."
+        raise ValueError(error_msg)
+
+    streams = [
+        sorted_sample_sites(infile, sample, name)
+        for sample, (infile, name) in enumerate(zip(infiles, names, strict=True))
+    ]
+
+    if output_format == "dense":
+        outfile.write("#seqname\tstart\tend\tstrand\t" + "\t".join(names) + "\n")
+    else:
+        outfile.write("#seqname\tstart\tend\tstrand\tsample\tcount\n")
+
+    for position, entry, cluster in cluster_samples(streams, distance):
+        site = f"{entry.seqname}\t{position}\t{position}\t{entry.strand}"
+        counts = cluster.counts(len(names))
+        if output_format == "dense":
+            outfile.write(f"{site}\t" + "\t".join(map(str, counts)) + "\n")
+        else:
+            for name, sample_count in zip(names, counts, strict=True):
+                if sample_count:
+                    outfile.write(f"{site}\t{name}\t{sample_count}\n")
+
+    outfile.flush()
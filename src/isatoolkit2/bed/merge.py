@@ -1,23 +1,31 @@
 """Merge proximal integration sites."""
 
-from collections import deque
+import heapq
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
 from itertools import groupby
+from pathlib import Path
 from statistics import median
 from typing import Annotated, Literal, TextIO
 
 import click
 from annotated_types import Ge, Le
 
-from isatoolkit2.bed.bed_utils import BedLine, Strand, natural_key
+from isatoolkit2.bed.bed_utils import BedLine, Strand, natural_key, sort_by_position
+from isatoolkit2.bed.intervals import ExcludedSites, exclude_sites, region_index
+from isatoolkit2.memory import MemoryReport, stage
 
 MIN_BED_COLS = 6
 
+# Merged BED lines written with --keep-members have three extra columns:
+# the comma separated starts, scores and names of the merged sites.
+MEMBER_BED_COLS = 9
 
-def read_lines(
+
+def iter_lines(
     infile: click.utils.LazyFile | TextIO,
-) -> list[BedLine]:
-    """Read lines from a BED file."""
-    lines = []
+) -> Iterator[BedLine]:
+    """Lazily read lines from a BED file."""
     for line in infile:
         # Skip empty lines or comment lines
         stripped_line = line.strip()
@@ -27,117 +35,361 @@ def read_lines(
         split_line = stripped_line.split("\t")
         # Check if line has the expected format
         if len(split_line) >= MIN_BED_COLS:
-            lines.append(
-                BedLine(
-                    seqname=str(split_line[0]),
-                    start=int(split_line[1]),
-                    end=int(split_line[2]),
-                    name=str(split_line[3]),
-                    score=int(split_line[4]),
-                    strand=Strand(split_line[5]),
-                ),
+            yield BedLine(
+                seqname=str(split_line[0]),
+                start=int(split_line[1]),
+                end=int(split_line[2]),
+                name=str(split_line[3]),
+                score=int(split_line[4]),
+                strand=Strand(split_line[5]),
             )
-    return lines
 
 
-def merge_integration_sites(
+def read_lines(
     infile: click.utils.LazyFile | TextIO,
-    outfile: click.utils.LazyFile | TextIO,
+) -> list[BedLine]:
+    """Read lines from a BED file."""
+    return list(iter_lines(infile))
+
+
+def read_included_lines(
+    infile: click.utils.LazyFile | TextIO,
+    exclude: None | Path = None,
+) -> tuple[list[BedLine], ExcludedSites]:
+    """Read lines from a BED file, skipping the sites in excluded intervals."""
+    excluded = ExcludedSites()
+    exclude_index = region_index(targets=exclude)
+    if exclude_index is None:
+        return read_lines(infile), excluded
+    return list(exclude_sites(iter_lines(infile), exclude_index, excluded)), excluded
+
+
+def cluster_sites(
+    entries: Iterable[BedLine],
     distance: Annotated[int, Ge(0), Le(100)] = 5,
-    mode: Literal["median"] = "median",
+) -> Iterator[list[BedLine]]:
+    """
+    Chain position sorted sites into clusters of proximal sites.
+
+    All entries must be on the same chromosome and strand.
+    A site joins the current cluster if it is within distance of the
+    previous site in the cluster (chaining), otherwise it starts a new one.
+    """
+    members: list[BedLine] = []
+    for entry in entries:
+        if members and entry.start - members[-1].start > distance:
+            yield members
+            members = []
+        members.append(entry)
+    if members:
+        yield members
+
+
+def cluster_position(
+    members: list[BedLine],
+) -> tuple[int, BedLine]:
+    """Get the merged position of a cluster and the entry that names it."""
+    # The entries with the highest score
+    max_score = max(entry.score for entry in members)
+    highest_entries = [entry for entry in members if entry.score == max_score]
+
+    # Select the median position of the highest scoring entries
+    positions = sorted(entry.start for entry in highest_entries)
+    median_pos = round(median(positions)) if len(positions) > 1 else positions[0]
+    return median_pos, highest_entries[0]
+
+
+def format_cluster(
+    members: list[BedLine],
+    *,
+    keep_members: bool = False,
+) -> str:
+    """Format a cluster of proximal sites as a single merged BED line."""
+    total_score = sum(entry.score for entry in members)
+    median_pos, median_entry = cluster_position(members)
+
+    output_line = (
+        f"{median_entry.seqname}\t"
+        f"{median_pos}\t"
+        f"{median_pos}\t"
+        f"{median_entry.name}\t"
+        f"{total_score}\t"
+        f"{median_entry.strand}"
+    )
+    if keep_members:
+        output_line += (
+            f"\t{','.join(str(entry.start) for entry in members)}"
+            f"\t{','.join(str(entry.score) for entry in members)}"
+            f"\t{','.join(entry.name for entry in members)}"
+        )
+    return f"{output_line}\n"
+
+
+def group_lines(
+    lines: list[BedLine],
+) -> list[list[BedLine]]:
+    """Group lines sorted by chromosome, strand and position by chromosome/strand."""
+    return [
+        list(group)
+        for _, group in groupby(lines, key=lambda line: (line.seqname, line.strand))
+    ]
+
+
+def merged_site(
+    members: list[BedLine],
+) -> BedLine:
+    """Merge a cluster of proximal sites into a single site."""
+    median_pos, median_entry = cluster_position(members)
+    return BedLine(
+        seqname=median_entry.seqname,
+        start=median_pos,
+        end=median_pos,
+        name=median_entry.name,
+        score=sum(entry.score for entry in members),
+        strand=median_entry.strand,
+    )
+
+
+def check_mode(
+    mode: Literal["median"],
 ) -> None:
-    """Merge proximal integration sites."""
-    # Currently ony supports median mode.
-    # Will add a merge mode in the future.
+    """Check the merge mode, only median mode is supported for now."""
     if mode != "median":
         error_msg = "Only median mode is supported."
         raise ValueError(error_msg)
 
-    # Read the input file and position sort.
-    #   - The sorting is version/natural sorting of the chromosome and
-    #     and numeric sorting of the start position.
-    lines = read_lines(infile)
-
-    # Sort the lines by chromosome, strand, and then position
-    lines.sort(
-        key=lambda line: (
-            natural_key(line.seqname),
-            line.strand,  # Use strand directly without natural_key
-            int(line.start),
-        ),
-    )
 
-    # Group by chromosome and strand, but collect the groups into a dictionary
-    # to avoid iterator consumption issues
-    grouped_data = {}
-    for key, group in groupby(lines, key=lambda line: (line.seqname, line.strand)):
-        grouped_data[key] = list(group)  # Convert iterator to list to preserve items
-
-    # Process each group.
-    for entries_list in grouped_data.values():
-        entries = deque(entries_list)  # A deque of BedLine objects
-
-        # Iterate over all integration sites in the same chromosome and strand.
-        while entries:
-            current_entry = entries.popleft()  # The first entry in the deque
-
-            # Initialize variables for the current entry.
-            proximal_entries = [current_entry]  # List of proximal entries
-            total_score = current_entry.score  # Total score of proximal entries
-            max_score = current_entry.score  # Maximum score of proximal entries
-            highest_entries = [current_entry]  # List of highest scoring entries
-            current_start = current_entry.start  # Current start position
-
-            # Find all entries within distance - implement proper chaining
-            i = 0
-            while i < len(entries):
-                next_entry = entries[i]
-
-                # Check if the next entry is within the specified distance
-                # from CURRENT position
-                # This is the key fix
-                #   - we compare with current_start which is updated for each match
-                if abs(next_entry.start - current_start) <= distance:
-                    # Remove the entry from the queue and don't increment i
-                    entries.remove(next_entry)
-                    proximal_entries.append(next_entry)  # Add to proximal entries
-                    total_score += next_entry.score  # Update total score
-
-                    # Update current_start for chaining behavior - this is critical
-                    current_start = next_entry.start
-
-                    # Update max score if proximal entry has a higher score
-                    if next_entry.score > max_score:
-                        max_score = next_entry.score
-                        highest_entries = [next_entry]
-                    # If the score is equal to the max score,
-                    # add position to highest scores
-                    elif next_entry.score == max_score:
-                        highest_entries.append(next_entry)
-                else:
-                    # Only increment i if we don't find a match,
-                    # since removing entries changes indices
-                    i += 1
-
-            # Select the median entry
-            positions = sorted(entry.start for entry in highest_entries)
-            median_pos = (
-                round(median(positions)) if len(positions) > 1 else positions[0]
+def site_clusters(
+    lines: list[BedLine],
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+    *,
+    memory: None | MemoryReport = None,
+) -> Iterator[list[BedLine]]:
+    """
+    Sort sites in place and chain them into clusters of proximal sites.
+
+    Sites are sorted by chromosome, strand and position, and clustered per
+    chromosome and strand. With a memory report, sorting and grouping are
+    recorded as stages, clustering happens as the clusters are consumed.
+    """
+    # The sorting is version/natural sorting of the chromosome and
+    # numeric sorting of the start position.
+    with stage(memory, "sort"):
+        sort_by_position(lines, strand_first=True)
+
+    with stage(memory, "group"):
+        groups = group_lines(lines)
+
+    return (members for group in groups for members in cluster_sites(group, distance))
+
+
+def merge_sites(
+    lines: Iterable[BedLine],
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+    mode: Literal["median"] = "median",
+) -> Iterator[BedLine]:
+    """Merge proximal integration sites, as merge_integration_sites does."""
+    check_mode(mode)
+    return map(merged_site, site_clusters(list(lines), distance))
+
+
+def merge_integration_sites(
+    infile: click.utils.LazyFile | TextIO,
+    outfile: click.utils.LazyFile | TextIO,
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+    mode: Literal["median"] = "median",
+    *,
+    keep_members: bool = False,
+    memory: None | MemoryReport = None,
+    exclude: None | Path = None,
+) -> ExcludedSites:
+    """
+    Merge proximal integration sites.
+
+    With a memory report, the memory used to parse, sort and group the
+    sites, to cluster them, and to format and write the merged sites, is
+    recorded per stage. With an exclude BED file, sites overlapping its
+    intervals are skipped as they are parsed, before merging. Returns the
+    excluded sites.
+    """
+    check_mode(mode)
+
+    with stage(memory, "parse"):
+        lines, excluded = read_included_lines(infile, exclude)
+    clusters = site_clusters(lines, distance, memory=memory)
+
+    # Cluster the sites, the clusters only hold references to the sites
+    with stage(memory, "merge"):
+        merged = list(clusters)
+
+    # Write one merged entry per cluster
+    with stage(memory, "write"):
+        for members in merged:
+            outfile.write(format_cluster(members, keep_members=keep_members))
+        outfile.flush()
+
+    return excluded
+
+
+@dataclass
+class MergedSite:
+
+    """A merged BED line with the sites that were merged into it."""
+
+    fields: list[str]
+    first_start: int
+    last_start: int
+
+    def members(self) -> list[BedLine]:
+        """Parse the sites that were merged into this line."""
+        return [
+            BedLine(
+                seqname=self.fields[0],
+                start=int(start),
+                end=int(start),
+                name=name,
+                score=int(score),
+                strand=Strand(self.fields[5]),
             )
-            median_entry = highest_entries[0]
-            median_entry.score = total_score
-
-            output_line = (
-                f"{median_entry.seqname}\t"
-                f"{median_pos}\t"
-                f"{median_pos}\t"
-                f"{median_entry.name}\t"
-                f"{total_score}\t"
-                f"{median_entry.strand}\n"
+            for start, score, name in zip(
+                self.fields[6].split(","),
+                self.fields[7].split(","),
+                self.fields[8].split(","),
+                strict=True,
+            )
+        ]
+
+
+def read_merged_sites(
+    merged_infile: click.utils.LazyFile | TextIO,
+) -> dict[tuple[str, Strand | str], list[MergedSite]]:
+    """Read a merged BED file written with members, grouped by chromosome/strand."""
+    grouped_sites: dict[tuple[str, Strand | str], list[MergedSite]] = {}
+    for line in merged_infile:
+        stripped_line = line.strip()
+        if not stripped_line or stripped_line.startswith("#"):
+            continue
+
+        fields = stripped_line.split("\t")
+        if len(fields) < MEMBER_BED_COLS:
+            error_msg = (
+                "Merged BED lines need member columns. "
+                "Write the merged BED file with keep_members (--keep-members)."
             )
+            raise ValueError(error_msg)
 
-            # Write the merged entry to the output file
+        # Members are parsed lazily, only the first and last start are needed
+        # to find the merged sites that new sites are proximal to.
+        starts = fields[6]
+        grouped_sites.setdefault((fields[0], Strand(fields[5]).value), []).append(
+            MergedSite(
+                fields=fields,
+                first_start=int(starts.split(",", 1)[0]),
+                last_start=int(starts.rsplit(",", 1)[-1]),
+            ),
+        )
+    return grouped_sites
+
+
+def update_group(
+    merged_sites: list[MergedSite],
+    new_entries: list[BedLine],
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+    *,
+    keep_members: bool = False,
+) -> Iterator[str]:
+    """Fold new sites on one chromosome and strand into existing merged sites."""
+    # Walk the merged sites and new sites in start order. Merged sites go first
+    # at equal starts, the same order as re-merging the history then the batch.
+    items = heapq.merge(
+        ((site.first_start, 0, site.last_start, site) for site in merged_sites),
+        ((entry.start, 1, entry.start, entry) for entry in new_entries),
+        key=lambda item: (item[0], item[1]),
+    )
+
+    # Collect proximal items into components, a component is a merged site
+    # plus any sites chaining to it.
+    component: list[MergedSite | BedLine] = []
+    component_end = 0
+    for start, _, end, item in items:
+        if component and start - component_end > distance:
+            yield from format_component(component, keep_members=keep_members)
+            component = []
+        component_end = max(component_end, end) if component else end
+        component.append(item)
+    if component:
+        yield from format_component(component, keep_members=keep_members)
+
+
+def format_component(
+    component: list[MergedSite | BedLine],
+    *,
+    keep_members: bool = False,
+) -> Iterator[str]:
+    """Format a component, only recomputing it if new sites were added."""
+    # An untouched merged site is written back as it was read
+    if len(component) == 1 and isinstance(component[0], MergedSite):
+        fields = component[0].fields
+        yield "\t".join(fields if keep_members else fields[:MIN_BED_COLS]) + "\n"
+        return
+
+    members: list[BedLine] = []
+    for item in component:
+        if isinstance(item, MergedSite):
+            members.extend(item.members())
+        else:
+            members.append(item)
+
+    # Members of a merged site are already position sorted, and sorting is
+    # stable, so this matches the order of a full re-merge.
+    members.sort(key=lambda entry: entry.start)
+    yield format_cluster(members, keep_members=keep_members)
+
+
+def update_merged_sites(
+    merged_infile: click.utils.LazyFile | TextIO,
+    infile: click.utils.LazyFile | TextIO,
+    outfile: click.utils.LazyFile | TextIO,
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+    mode: Literal["median"] = "median",
+    *,
+    keep_members: bool = False,
+    exclude: None | Path = None,
+) -> ExcludedSites:
+    """
+    Incrementally merge new integration sites into existing merged sites.
+
+    The merged input must have been written with keep_members and the same
+    distance. Only merged sites that new sites are proximal to are recomputed,
+    and the output is the same as merging the full history of sites again.
+    With an exclude BED file, new sites overlapping its intervals are
+    skipped, and returned as excluded sites.
+    """
+    check_mode(mode)
+
+    grouped_sites = read_merged_sites(merged_infile)
+
+    # Read the new sites and group them by chromosome and strand
+    lines, excluded = read_included_lines(infile, exclude)
+    sort_by_position(lines, strand_first=True)
+    grouped_data: dict[tuple[str, Strand | str], list[BedLine]] = {}
+    for key, group in groupby(lines, key=lambda line: (line.seqname, line.strand)):
+        grouped_data.setdefault(key, []).extend(group)
+
+    # Process each group in the same order as a full merge.
+    for key in sorted(
+        grouped_sites.keys() | grouped_data.keys(),
+        key=lambda key: (natural_key(key[0]), key[1]),
+    ):
+        for output_line in update_group(
+            grouped_sites.get(key, []),
+            grouped_data.get(key, []),
+            distance,
+            keep_members=keep_members,
+        ):
             outfile.write(output_line)
 
     # Final flush to ensure all data is written
     outfile.flush()
+
+    return excluded
@@ -1,24 +1,43 @@
 """Sort BED file by position or score."""
 
-from typing import Literal, TextIO
+import heapq
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import Annotated, Any, Literal, TextIO
 
 import click
+from annotated_types import Ge
 
-from isatoolkit2.bed.bed_utils import BedLine, Strand, natural_key
+from isatoolkit2.bed.bed_utils import (
+    BedLine,
+    Strand,
+    format_bed_line,
+    natural_key,
+    sort_by_position,
+)
+from isatoolkit2.memory import MemoryReport, stage
 
 
-def sort_bed(
-    infile: click.utils.LazyFile | TextIO,
-    outfile: click.utils.LazyFile | TextIO,
-    sort_by: Literal["position", "score"] = "position",
-) -> None:
-    """Sort BED file by position or score."""
-    # Check if each line in the input file is a valid BED line
-    split_lines = [line.strip().split("\t") for line in infile]
+@dataclass(frozen=True, slots=True)
+class DescendingKey:
+
+    """Sort key that orders in reverse of the wrapped key."""
+
+    key: Any
 
-    try:
-        lines = [
-            BedLine(
+    def __lt__(self, other: "DescendingKey") -> bool:
+        """Compare in reverse order."""
+        return self.key > other.key
+
+
+def parse_lines(
+    infile: click.utils.LazyFile | TextIO | Iterable[str],
+) -> Iterator[BedLine]:
+    """Lazily parse lines from a BED file."""
+    for line in infile:
+        split_line = line.strip().split("\t")
+        try:
+            bed_line = BedLine(
                 seqname=str(split_line[0]),
                 start=int(split_line[1]),
                 end=int(split_line[2]),
@@ -26,32 +45,96 @@ def sort_bed(
                 score=int(split_line[4]),
                 strand=Strand(split_line[5]),
             )
-            for split_line in split_lines
-        ]
-    except IndexError as e:
-        error_msg = "Invalid BED line format. Ensure each line has 6 fields."
-        raise ValueError(error_msg) from e
+        except IndexError as e:
+            error_msg = "Invalid BED line format. Ensure each line has 6 fields."
+            raise ValueError(error_msg) from e
+        yield bed_line
+
+
+def top_by_score(
+    lines: Iterable[BedLine],
+    top: Annotated[int, Ge(1)],
+) -> list[BedLine]:
+    """
+    Select the highest scoring lines, sorted by descending score.
+
+    Ties are broken by position, so the result does not depend on input order.
+    Only a heap of 'top' lines is kept in memory.
+    """
+    # Min-heap of the best lines seen so far, the root is the worst one.
+    # Among equal scores the line with the highest position is the worst.
+    heap: list[tuple[int, DescendingKey, BedLine]] = []
+    for index, line in enumerate(lines):
+        # Most lines can be rejected on the score alone.
+        if len(heap) == top and line.score < heap[0][0]:
+            continue
+
+        # The input index makes the key unique for duplicate lines.
+        item = (
+            line.score,
+            DescendingKey((natural_key(line.seqname), line.start, line.strand, index)),
+            line,
+        )
+        if len(heap) < top:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+    return [line for *_, line in sorted(heap, reverse=True)]
 
+
+def sort_sites(
+    lines: Iterable[BedLine],
+    sort_by: Literal["position", "score"] = "position",
+    top: None | Annotated[int, Ge(1)] = None,
+) -> list[BedLine]:
+    """Sort sites by position or score."""
+    if top is not None and sort_by != "score":
+        error_msg = "Top selection is only supported when sorting by score."
+        raise ValueError(error_msg)
+
+    if top is not None:
+        # Stream the sites through a bounded heap
+        return top_by_score(lines, top)
+
+    sorted_lines = list(lines)
     if sort_by == "position":
         # Sort by chromosome (natural sort) and start position (numeric)
-        lines.sort(
-            key=lambda line: (
-                natural_key(line.seqname),
-                line.start,
-                line.strand,
-            ),
-        )
+        sort_by_position(sorted_lines)
     elif sort_by == "score":
-        # Sort by score (fifth column) in descending order
-        lines.sort(key=lambda line: line.score, reverse=True)
+        # Sort by score (fifth column) in descending order, breaking ties by
+        # position like top_by_score: the score sort is stable, so sites with
+        # equal scores stay in position order
+        sort_by_position(sorted_lines)
+        sorted_lines.sort(key=lambda line: line.score, reverse=True)
+    return sorted_lines
+
+
+def sort_bed(
+    infile: click.utils.LazyFile | TextIO,
+    outfile: click.utils.LazyFile | TextIO,
+    sort_by: Literal["position", "score"] = "position",
+    top: None | Annotated[int, Ge(1)] = None,
+    *,
+    memory: None | MemoryReport = None,
+) -> None:
+    """
+    Sort BED file by position or score.
+
+    With a memory report, the memory used to parse, sort and write the
+    sites is recorded per stage. With top, the sites are parsed while
+    they are selected, in the sort stage.
+    """
+    # Check if each line in the input file is a valid BED line
+    lines: Iterable[BedLine] = parse_lines(infile)
+    if top is None:
+        with stage(memory, "parse"):
+            lines = list(lines)
+
+    with stage(memory, "sort"):
+        sorted_lines = sort_sites(lines, sort_by, top)
 
     # Write sorted lines to output
-    for line in lines:
-        outfile.write(
-            f"{line.seqname}\t"
-            f"{line.start}\t"
-            f"{line.end}\t"
-            f"{line.name}\t"
-            f"{line.score}\t"
-            f"{line.strand}\n",
-        )
+    with stage(memory, "write"):
+        for line in sorted_lines:
+            outfile.write(format_bed_line(line))
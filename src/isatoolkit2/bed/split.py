@@ -0,0 +1,204 @@
+"""Split BED outputs into a file per contig, and optionally per strand."""
+
+import io
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager
+from pathlib import Path
+from typing import IO, Annotated, Literal, TextIO
+
+from annotated_types import Ge
+
+from isatoolkit2.bgzf import open_text_output
+
+# Maximum number of split files open at the same time
+MAX_OPEN_FILES = 64
+
+# Bytes of lines buffered across all split files before they are written
+SPLIT_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Index of the strand column of BED lines
+STRAND_COLUMN = 5
+
+# File name parts of the strands, other strands are written as unstranded
+STRAND_NAMES = {b"+": "plus", b"-": "minus"}
+
+
+def split_file_name(
+    contig: str,
+    strand: None | str = None,
+) -> str:
+    """Get the name of the split file of a contig, and strand if split by strand."""
+    # Contig names may contain slashes, which can't be in file names
+    name = contig.replace("%", "%25").replace("/", "%2F")
+    if name.startswith("."):
+        name = f"%2E{name[1:]}"
+    return f"{name}.{strand}.bed" if strand is not None else f"{name}.bed"
+
+
+class ContigSplitWriter(io.BufferedIOBase):
+
+    """
+    Binary writer that appends each BED line to the file of its contig.
+
+    Lines are buffered per split file, up to buffer_size bytes in total,
+    and then written with one write per file, so unsorted input doesn't
+    open and close a file per line. At most max_open split files are open
+    at a time, and the least recently used one is closed to open another,
+    then reopened for appending if the contig comes up again, so any number
+    of contigs is written in a single pass.
+    """
+
+    def __init__(
+        self,
+        outdir: Path,
+        *,
+        by_strand: bool = False,
+        max_open: Annotated[int, Ge(1)] = MAX_OPEN_FILES,
+        buffer_size: Annotated[int, Ge(0)] = SPLIT_BUFFER_SIZE,
+    ) -> None:
+        """Initialize the writer for an output directory."""
+        super().__init__()
+        self.outdir = outdir
+        self.by_strand = by_strand
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.paths: dict[tuple[bytes, bytes], Path] = {}
+        self._handles: OrderedDict[tuple[bytes, bytes], IO[bytes]] = OrderedDict()
+        self._buffers: defaultdict[tuple[bytes, bytes], list[bytes]] = defaultdict(
+            list,
+        )
+        self._buffered = 0
+        self._partial = b""
+
+    @property
+    def name(self) -> str:
+        """Return the output directory."""
+        return str(self.outdir)
+
+    def writable(self) -> bool:
+        """Return True, the writer is always writable."""
+        return True
+
+    def write(self, data: bytes | bytearray | memoryview) -> int:  # type: ignore[override]
+        """Route the complete lines of the data, keeping a partial last line."""
+        chunk = self._partial + bytes(data)
+        end = chunk.rfind(b"\n") + 1
+        self._partial = chunk[end:]
+        if end:
+            self._route(chunk[:end].splitlines(keepends=True))
+        return len(data)
+
+    def _route(
+        self,
+        lines: list[bytes],
+    ) -> None:
+        """Buffer lines for the files of their contigs, and strands."""
+        buffers = self._buffers
+        for line in lines:
+            fields = line.split(b"\t", STRAND_COLUMN + 1)
+            strand = (
+                fields[STRAND_COLUMN].rstrip()
+                if self.by_strand and len(fields) > STRAND_COLUMN
+                else b""
+            )
+            buffers[fields[0].rstrip(), strand].append(line)
+            self._buffered += len(line)
+        if self._buffered >= self.buffer_size:
+            self._write_buffers()
+
+    def _write_buffers(self) -> None:
+        """Write the buffered lines, to the files that are already open first."""
+        keys = sorted(self._buffers, key=lambda key: key not in self._handles)
+        for key in keys:
+            self._handle(key).write(b"".join(self._buffers[key]))
+        self._buffers.clear()
+        self._buffered = 0
+
+    def _handle(
+        self,
+        key: tuple[bytes, bytes],
+    ) -> IO[bytes]:
+        """Get the open file of a contig and strand, opening it if needed."""
+        handle = self._handles.get(key)
+        if handle is not None:
+            self._handles.move_to_end(key)
+            return handle
+
+        if len(self._handles) >= self.max_open:
+            _, evicted = self._handles.popitem(last=False)
+            evicted.close()
+
+        path = self.paths.get(key)
+        if path is None:
+            contig, strand = key
+            path = self.outdir / split_file_name(
+                contig.decode(),
+                STRAND_NAMES.get(strand, "unstranded") if self.by_strand else None,
+            )
+            self.paths[key] = path
+            handle = path.open("wb")
+        else:
+            handle = path.open("ab")
+        self._handles[key] = handle
+        return handle
+
+    def flush(self) -> None:
+        """Write the buffered lines and flush the open split files."""
+        if self.closed:
+            return
+        self._write_buffers()
+        for handle in self._handles.values():
+            handle.flush()
+
+    def close(self) -> None:
+        """Write a last line without a newline, and close the split files."""
+        if self.closed:
+            return
+        try:
+            if self._partial.strip():
+                self._route([self._partial])
+                self._partial = b""
+            self._write_buffers()
+        finally:
+            for handle in self._handles.values():
+                handle.close()
+            self._handles.clear()
+            super().close()
+
+
+@contextmanager
+def open_split_output(
+    outdir: Path,
+    *,
+    by_strand: bool = False,
+    max_open: Annotated[int, Ge(1)] = MAX_OPEN_FILES,
+) -> Iterator[TextIO]:
+    """
+    Open a text output that writes each BED line to the file of its contig.
+
+    Files are named after the contig, e.g. chr1.bed, or after the contig and
+    strand with by_strand, e.g. chr1.plus.bed and chr1.minus.bed. Existing
+    files of the same contigs are overwritten.
+    """
+    outdir.mkdir(parents=True, exist_ok=True)
+    with ContigSplitWriter(outdir, by_strand=by_strand, max_open=max_open) as writer:
+        handle = io.TextIOWrapper(writer, encoding="utf-8", newline="\n")
+        try:
+            yield handle
+        finally:
+            handle.flush()
+            handle.detach()
+
+
+def open_bed_output(
+    path: Literal["-"] | Path,
+    *,
+    threads: Annotated[int, Ge(1)] = 1,
+    split_by_contig: None | Path = None,
+    by_strand: bool = False,
+) -> AbstractContextManager[TextIO]:
+    """Open a BED output file, or split files per contig in a directory."""
+    if split_by_contig is not None:
+        return open_split_output(split_by_contig, by_strand=by_strand)
+    return open_text_output(path, threads=threads)
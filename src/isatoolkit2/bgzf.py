@@ -0,0 +1,201 @@
+"""Read and write gzip/BGZF compressed text files."""
+
+import io
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from gzip import GzipFile
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Annotated, Literal, TextIO
+
+from annotated_types import Ge, Le
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+GZIP_MAGIC = b"\x1f\x8b"
+COMPRESSED_SUFFIXES = (".gz", ".bgz")
+
+# Maximum uncompressed bytes per BGZF block (same as htslib).
+BGZF_BLOCK_SIZE = 0xFF00
+
+# The BGZF block header up to (but not including) the BSIZE field.
+BGZF_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+
+# The empty block that marks the end of a BGZF file.
+BGZF_EOF = (
+    b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+    b"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+)
+
+
+def compress_block(
+    data: bytes,
+    level: Annotated[int, Ge(-1), Le(9)] = -1,
+) -> bytes:
+    """Compress data into a single BGZF block."""
+    # Raw deflate stream, the gzip wrapper is written by hand below.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    # BSIZE is the total block size minus one.
+    block_size = len(BGZF_HEADER) + 2 + len(deflated) + 8
+    return (
+        BGZF_HEADER
+        + struct.pack("<H", block_size - 1)
+        + deflated
+        + struct.pack("<II", zlib.crc32(data), len(data))
+    )
+
+
+class BgzfWriter(io.BufferedIOBase):
+
+    """Binary BGZF writer with optional multi-threaded block compression."""
+
+    def __init__(
+        self,
+        raw: IO[bytes],
+        threads: Annotated[int, Ge(1)] = 1,
+        level: Annotated[int, Ge(-1), Le(9)] = -1,
+        *,
+        close_raw: bool = True,
+    ) -> None:
+        """Initialize the writer on top of an open binary handle."""
+        super().__init__()
+        self._raw = raw
+        self._level = level
+        self._close_raw = close_raw
+        self._buffer = bytearray()
+
+        # Blocks are compressed in a thread pool (zlib releases the GIL),
+        # and written back in submission order.
+        self._executor = (
+            ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        )
+        self._pending: deque[Future[bytes]] = deque()
+        self._max_pending = threads * 4
+
+    @property
+    def name(self) -> str:
+        """Return the name of the underlying handle."""
+        return getattr(self._raw, "name", "")
+
+    def writable(self) -> bool:
+        """Return True, the writer is always writable."""
+        return True
+
+    def write(self, data: bytes | bytearray | memoryview) -> int:  # type: ignore[override]
+        """Buffer data and compress every full block."""
+        self._buffer.extend(data)
+        while len(self._buffer) >= BGZF_BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:BGZF_BLOCK_SIZE]))
+            del self._buffer[:BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        """Compress a block, in the thread pool if there is one."""
+        if self._executor is None:
+            self._raw.write(compress_block(block, self._level))
+            return
+
+        self._pending.append(self._executor.submit(compress_block, block, self._level))
+        # Bound the number of in-flight blocks to bound memory.
+        while len(self._pending) > self._max_pending:
+            self._raw.write(self._pending.popleft().result())
+
+    def _drain(self) -> None:
+        """Write all compressed blocks that are still in flight."""
+        while self._pending:
+            self._raw.write(self._pending.popleft().result())
+
+    def flush(self) -> None:
+        """Compress buffered data and flush the underlying handle."""
+        if self.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        self._drain()
+        self._raw.flush()
+
+    def close(self) -> None:
+        """Flush, write the EOF block and close the underlying handle."""
+        if self.closed:
+            return
+        try:
+            self.flush()
+            self._raw.write(BGZF_EOF)
+            self._raw.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            if self._close_raw:
+                self._raw.close()
+            super().close()
+
+
+def is_compressed_path(
+    path: Literal["-"] | Path,
+) -> bool:
+    """Check if a path should be written with BGZF compression."""
+    return str(path).lower().endswith(COMPRESSED_SUFFIXES)
+
+
+@contextmanager
+def open_text_input(
+    path: Literal["-"] | Path,
+) -> "Iterator[TextIO]":
+    """Open a plain or gzip/BGZF compressed text file (or stdin) for reading."""
+    with ExitStack() as stack:
+        raw: io.BufferedReader = (
+            sys.stdin.buffer  # pyright: ignore[reportAssignmentType]
+            if str(path) == "-"
+            else stack.enter_context(Path(path).open("rb"))
+        )
+
+        # Detect compression from the magic bytes, which also works for stdin.
+        compressed = raw.peek(len(GZIP_MAGIC))[: len(GZIP_MAGIC)] == GZIP_MAGIC
+        binary: io.BufferedIOBase = (
+            stack.enter_context(GzipFile(fileobj=raw, mode="rb")) if compressed else raw
+        )
+
+        handle = io.TextIOWrapper(binary, encoding="utf-8")
+        try:
+            yield handle
+        finally:
+            # Detach so stdin (or the handles in the stack) are not closed twice.
+            handle.detach()
+
+
+@contextmanager
+def open_text_output(
+    path: Literal["-"] | Path,
+    threads: Annotated[int, Ge(1)] = 1,
+) -> "Iterator[TextIO]":
+    """
+    Open a text file (or stdout) for writing.
+
+    Paths ending in '.gz' or '.bgz' are written as BGZF,
+    compressing blocks with the given number of threads.
+    """
+    with ExitStack() as stack:
+        raw: IO[bytes] = (
+            sys.stdout.buffer
+            if str(path) == "-"
+            else stack.enter_context(Path(path).open("wb"))
+        )
+        binary: IO[bytes] | BgzfWriter = (
+            stack.enter_context(BgzfWriter(raw, threads=threads, close_raw=False))
+            if is_compressed_path(path)
+            else raw
+        )
+
+        handle = io.TextIOWrapper(binary, encoding="utf-8", newline="\n")
+        try:
+            yield handle
+        finally:
+            handle.flush()
+            handle.detach()
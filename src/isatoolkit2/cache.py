@@ -0,0 +1,267 @@
+"""Content-addressed cache of command outputs."""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from string import Template
+from typing import IO, Annotated, Any, Literal
+
+from annotated_types import Ge
+
+# Chunk size for hashing and copying files
+CHUNK_SIZE = 1 << 20
+
+# Temporary files older than this are left over from crashed processes
+STALE_TMP_SECONDS = 24 * 60 * 60
+
+# Default maximum cache size in bytes
+DEFAULT_MAX_SIZE = 10 * 1024**3
+
+LOCK_NAME = ".lock"
+TMP_PREFIX = ".tmp-"
+
+# Suffix of the stderr report stored with an output, if it has one
+REPORT_SUFFIX = ".report"
+
+
+def toolkit_version() -> str:
+    """Get the installed toolkit version."""
+    try:
+        return version("isatoolkit2")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class ResultCache:
+
+    """
+    Size-bounded LRU cache of command outputs on the local filesystem.
+
+    Entries are stored under the hash of the command, its parameters, the
+    toolkit version and the content of its inputs. Entries are written to a
+    temporary file and renamed into place, so readers never see partial
+    outputs, and eviction is serialized between processes with a file lock.
+    The stderr report of a command, if any, is stored next to its output and
+    replayed on a cache hit, so a cached run reports the same as the original.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_size: Annotated[int, Ge(0)],
+    ) -> None:
+        """Initialize the cache, creating the cache directory if needed."""
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(
+        self,
+        command: str,
+        params: dict[str, Any],
+        inputs: list[Path],
+    ) -> str:
+        """Hash the command, parameters, toolkit version and input content."""
+        digest = hashlib.sha256()
+        digest.update(
+            json.dumps(
+                {
+                    "version": toolkit_version(),
+                    "command": command,
+                    "params": params,
+                },
+                sort_keys=True,
+                default=str,
+            ).encode(),
+        )
+        for input_path in inputs:
+            input_digest = hashlib.sha256()
+            with input_path.open("rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    input_digest.update(chunk)
+            digest.update(input_digest.digest())
+        return digest.hexdigest()
+
+    @contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Hold an exclusive lock on the cache between processes."""
+        with (self.cache_dir / LOCK_NAME).open("a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(
+        self,
+        key: str,
+        outfile: Literal["-"] | Path,
+    ) -> None | str:
+        """
+        Copy a cached output to the output file, returning its report.
+
+        Returns None if the output isn't cached. The report is stored before
+        the output and evicted after it, so it is read first: if the output
+        is still there, the report that was read is its report.
+        """
+        entry = self.cache_dir / key
+        try:
+            report = (self.cache_dir / f"{key}{REPORT_SUFFIX}").read_text()
+        except FileNotFoundError:
+            report = ""
+        try:
+            # The open handle stays valid even if the entry is evicted meanwhile
+            with entry.open("rb") as f:
+                # Mark the entry as recently used
+                os.utime(f.fileno())
+                copy_to_output(f, outfile)
+        except FileNotFoundError:
+            return None
+        return report
+
+    def temporary_path(
+        self,
+        suffix: str = "",
+    ) -> Path:
+        """Create a temporary file in the cache directory."""
+        fd, name = tempfile.mkstemp(
+            prefix=TMP_PREFIX,
+            suffix=suffix,
+            dir=self.cache_dir,
+        )
+        os.close(fd)
+        return Path(name)
+
+    def store(
+        self,
+        key: str,
+        path: Path,
+        report: str = "",
+    ) -> None:
+        """Atomically move an output and its report into the cache, then evict."""
+        with self._lock():
+            if report:
+                report_path = self.temporary_path(REPORT_SUFFIX)
+                report_path.write_text(report)
+                report_path.replace(self.cache_dir / f"{key}{REPORT_SUFFIX}")
+            path.replace(self.cache_dir / key)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits."""
+        with self._lock():
+            entries = []
+            reports: dict[str, int] = {}
+            now = time.time()
+            for path in self.cache_dir.iterdir():
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if path.name.startswith(TMP_PREFIX):
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        path.unlink(missing_ok=True)
+                    continue
+                if path.name.startswith("."):
+                    continue
+                if path.name.endswith(REPORT_SUFFIX):
+                    reports[path.name.removesuffix(REPORT_SUFFIX)] = stat.st_size
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            # Remove the reports of outputs that are gone
+            for key in reports.keys() - {path.name for *_, path in entries}:
+                (self.cache_dir / f"{key}{REPORT_SUFFIX}").unlink(missing_ok=True)
+
+            # Remove the oldest entries first, each output before its report
+            entries = sorted(
+                (mtime, size + reports.get(path.name, 0), path)
+                for mtime, size, path in entries
+            )
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                path.unlink(missing_ok=True)
+                (self.cache_dir / f"{path.name}{REPORT_SUFFIX}").unlink(missing_ok=True)
+                total_size -= size
+
+
+def copy_to_output(
+    source: IO[bytes],
+    outfile: Literal["-"] | Path,
+) -> None:
+    """Copy an open binary file to the output file or stdout."""
+    if str(outfile) == "-":
+        shutil.copyfileobj(source, sys.stdout.buffer, CHUNK_SIZE)
+        sys.stdout.buffer.flush()
+    else:
+        with Path(outfile).open("wb") as f:
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+
+
+def write_report(
+    report: None | str,
+) -> None:
+    """Write the report of a command to stderr, if it has one."""
+    if report:
+        sys.stderr.write(report)
+        sys.stderr.flush()
+
+
+def run_cached(
+    compute: Callable[[Literal["-"] | Path], None | str],
+    outfile: Literal["-"] | Path,
+    *,
+    cache_dir: None | Path,
+    command: str,
+    params: dict[str, Any],
+    inputs: list[Literal["-"] | Path],
+    max_size: Annotated[int, Ge(0)] = DEFAULT_MAX_SIZE,
+    report_values: None | dict[str, str] = None,
+) -> None:
+    """
+    Run a command that writes to an output file, reusing cached outputs.
+
+    The command may return a report, which is written to stderr and cached
+    with the output, so a cache hit writes the same report. Values that
+    aren't part of the key, like input paths, are kept out of the cached
+    report as $name placeholders, filled in from report_values when the
+    report is written.
+    The cache is skipped if there is no cache directory
+    or if any input is stdin, since stdin can't be hashed up front.
+    """
+    values = report_values or {}
+    input_paths = [Path(input_path) for input_path in inputs if str(input_path) != "-"]
+    if cache_dir is None or len(input_paths) != len(inputs):
+        write_report(Template(compute(outfile) or "").safe_substitute(values))
+        return
+
+    # The output suffix decides the output compression, so it is part of the key
+    suffix = Path(outfile).suffix.lower() if str(outfile) != "-" else ""
+    cache = ResultCache(cache_dir, max_size)
+    key = cache.key(command, {**params, "suffix": suffix}, input_paths)
+    report = cache.fetch(key, outfile)
+    if report is not None:
+        write_report(Template(report).safe_substitute(values))
+        return
+
+    # Compute the output into the cache, then copy it to the output file
+    temporary_path = cache.temporary_path(suffix)
+    try:
+        report = compute(temporary_path) or ""
+        with temporary_path.open("rb") as f:
+            copy_to_output(f, outfile)
+        cache.store(key, temporary_path, report)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+    write_report(Template(report).safe_substitute(values))
@@ -1,7 +1,8 @@
 """CLI for ISAToolkit2."""
 
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Annotated, Literal, TextIO
+from typing import Annotated, Literal
 
 import click
 from annotated_types import Ge, Le
@@ -10,10 +11,89 @@ from isatoolkit2.utils import SamBamInputType, SamBamOutputType
 
 # Custom click types
 SAMBAM_INPUT = SamBamInputType()
+BED_INPUT = click.Path(exists=True, dir_okay=False, allow_dash=True, path_type=Path)
+BED_OUTPUT = click.Path(dir_okay=False, writable=True, allow_dash=True, path_type=Path)
 SAMBAM_OUTPUT = SamBamOutputType()
 DISCARDED_SAMBAM_OUTPUT = SamBamOutputType()
 
 
+def check_split_options(
+    outfile: Literal["-"] | Path,
+    cache_dir: None | Path,
+    split_by_contig: None | Path,
+    *,
+    split_by_strand: bool,
+) -> None:
+    """Check that --split-by-contig isn't combined with options it replaces."""
+    if split_by_contig is not None and str(outfile) != "-":
+        error_msg = "--split-by-contig can't be combined with --outfile"
+        raise click.UsageError(error_msg)
+    if split_by_contig is not None and cache_dir is not None:
+        error_msg = "--split-by-contig can't be combined with --cache-dir"
+        raise click.UsageError(error_msg)
+    if split_by_strand and split_by_contig is None:
+        error_msg = "--split-by-strand requires --split-by-contig"
+        raise click.UsageError(error_msg)
+
+
+def check_cache_options(
+    cache_dir: None | Path,
+    mem_report: None | Path,
+) -> None:
+    """Check that --cache-dir isn't combined with reports of the computation."""
+    if cache_dir is not None and mem_report is not None:
+        error_msg = "--mem-report can't be combined with --cache-dir"
+        raise click.UsageError(error_msg)
+
+
+def check_umi_options(
+    umi_tag: None | str,
+    *,
+    umi_from_name: bool,
+    collapse_umis: bool,
+) -> None:
+    """Check that the UMI options of sam count are consistent."""
+    if umi_tag is not None and umi_from_name:
+        error_msg = "--umi-tag can't be combined with --umi-from-name"
+        raise click.UsageError(error_msg)
+    if collapse_umis and umi_tag is None and not umi_from_name:
+        error_msg = "--collapse-umis requires --umi-tag or --umi-from-name"
+        raise click.UsageError(error_msg)
+
+
+def check_checkpoint_options(
+    infile: Literal["-"] | Path,
+    checkpoint: None | Path,
+    *,
+    resume: bool,
+    saturation: bool,
+    regions: bool,
+    umis: bool,
+    shear_sites: bool,
+) -> None:
+    """Check that --checkpoint isn't combined with options it can't save."""
+    if resume and checkpoint is None:
+        error_msg = "--resume requires --checkpoint"
+        raise click.UsageError(error_msg)
+    if checkpoint is None:
+        return
+    if str(infile) == "-":
+        error_msg = "--checkpoint can't be combined with stdin input"
+        raise click.UsageError(error_msg)
+    if saturation:
+        error_msg = "--saturation can't be combined with --checkpoint"
+        raise click.UsageError(error_msg)
+    if regions:
+        error_msg = "--region and --targets can't be combined with --checkpoint"
+        raise click.UsageError(error_msg)
+    if umis:
+        error_msg = "UMI counting can't be combined with --checkpoint"
+        raise click.UsageError(error_msg)
+    if shear_sites:
+        error_msg = "--shear-sites can't be combined with --checkpoint"
+        raise click.UsageError(error_msg)
+
+
 # The bed subcommand group
 @click.group()
 def bed() -> None:
@@ -25,19 +105,28 @@ def bed() -> None:
     "-i",
     "--infile",
     "infile",
-    type=click.File("r"),
+    type=BED_INPUT,
     default="-",
     show_default=True,
-    help="Input BED file or stdin (use '-' for stdin)",
+    help="Input BED file (plain or gzip/BGZF) or stdin (use '-' for stdin)",
 )
 @click.option(
     "-o",
     "--outfile",
     "outfile",
-    type=click.File("w"),
+    type=BED_OUTPUT,
     default="-",
     show_default=True,
-    help="Output BED file or stdout (use '-' for stdout)",
+    help="Output BED file or stdout (use '-' for stdout), BGZF if ending in .gz",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for BGZF output compression",
 )
 @click.option(
     "-s",
@@ -48,19 +137,114 @@ def bed() -> None:
     show_default=True,
     help="Sort by position or score",
 )
+@click.option(
+    "-n",
+    "--top",
+    "top",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Only output the N highest scoring sites (requires --sort-by score)",
+)
+@click.option(
+    "--split-by-contig",
+    "split_by_contig",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Write a BED file per contig to this directory, instead of --outfile",
+)
+@click.option(
+    "--split-by-strand",
+    "split_by_strand",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="With --split-by-contig, write a BED file per contig and strand",
+)
+@click.option(
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Reuse outputs of previous runs with the same inputs and parameters",
+)
+@click.option(
+    "--cache-max-size",
+    "cache_max_size",
+    type=click.IntRange(min=0),
+    default=10240,
+    show_default=True,
+    help="Maximum cache size in MiB, least recently used outputs are evicted",
+)
+@click.option(
+    "--mem-report",
+    "mem_report",
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True, path_type=Path),
+    default=None,
+    help="Write peak RSS and per-stage allocations as JSON (use '-' for stderr)",
+)
 def sort_cmd(
-    infile: click.utils.LazyFile | TextIO,
-    outfile: click.utils.LazyFile | TextIO,
+    infile: Literal["-"] | Path,
+    outfile: Literal["-"] | Path,
     sort_by: Literal["position", "score"],
+    top: None | int = None,
+    threads: int = 1,
+    *,
+    cache_dir: None | Path = None,
+    cache_max_size: int = 10240,
+    mem_report: None | Path = None,
+    split_by_contig: None | Path = None,
+    split_by_strand: bool = False,
 ) -> None:
     """Sort BED file by position or score."""
+    if top is not None and sort_by != "score":
+        error_msg = "--top requires --sort-by score"
+        raise click.UsageError(error_msg)
+    check_cache_options(cache_dir, mem_report)
+    check_split_options(
+        outfile,
+        cache_dir,
+        split_by_contig,
+        split_by_strand=split_by_strand,
+    )
+
     from isatoolkit2.bed.sort import sort_bed
+    from isatoolkit2.bed.split import open_bed_output
+    from isatoolkit2.bgzf import open_text_input
+    from isatoolkit2.cache import run_cached
+    from isatoolkit2.memory import MemoryReport
 
-    sort_bed(
-        infile=infile,
+    memory = MemoryReport("bed sort") if mem_report is not None else None
+
+    def compute(output: Literal["-"] | Path) -> None:
+        with (
+            open_text_input(infile) as infile_handle,
+            open_bed_output(
+                output,
+                threads=threads,
+                split_by_contig=split_by_contig,
+                by_strand=split_by_strand,
+            ) as outfile_handle,
+        ):
+            sort_bed(
+                infile=infile_handle,
+                outfile=outfile_handle,
+                sort_by=sort_by,
+                top=top,
+                memory=memory,
+            )
+
+    run_cached(
+        compute,
         outfile=outfile,
-        sort_by=sort_by,
+        cache_dir=cache_dir,
+        command="bed sort",
+        params={"sort_by": sort_by, "top": top},
+        inputs=[infile],
+        max_size=cache_max_size * 1024**2,
     )
+    if memory is not None and mem_report is not None:
+        memory.write(mem_report)
 
 
 @bed.command("merge")
@@ -68,19 +252,28 @@ def sort_cmd(
     "-i",
     "--infile",
     "infile",
-    type=click.File("r"),
+    type=BED_INPUT,
     default="-",
     show_default=True,
-    help="Input BED file or stdin (use '-' for stdin)",
+    help="Input BED file (plain or gzip/BGZF) or stdin (use '-' for stdin)",
 )
 @click.option(
     "-o",
     "--outfile",
     "outfile",
-    type=click.File("w"),
+    type=BED_OUTPUT,
     default="-",
     show_default=True,
-    help="Output BED file or stdout (use '-' for stdout)",
+    help="Output BED file or stdout (use '-' for stdout), BGZF if ending in .gz",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for BGZF output compression",
 )
 @click.option(
     "-d",
@@ -100,20 +293,349 @@ def sort_cmd(
     show_default=True,
     help=("Mode for merging integration sites (currently only median supported)"),
 )
+@click.option(
+    "-k",
+    "--keep-members",
+    "keep_members",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Add the starts, scores and names of the merged sites as extra columns",
+)
+@click.option(
+    "-u",
+    "--update",
+    "update",
+    type=BED_INPUT,
+    help="Merged BED file written with --keep-members to fold the input sites into",
+)
+@click.option(
+    "--exclude",
+    "exclude",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Drop sites overlapping the intervals of a BED file, e.g. a blacklist",
+)
+@click.option(
+    "--split-by-contig",
+    "split_by_contig",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Write a BED file per contig to this directory, instead of --outfile",
+)
+@click.option(
+    "--split-by-strand",
+    "split_by_strand",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="With --split-by-contig, write a BED file per contig and strand",
+)
+@click.option(
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Reuse outputs of previous runs with the same inputs and parameters",
+)
+@click.option(
+    "--cache-max-size",
+    "cache_max_size",
+    type=click.IntRange(min=0),
+    default=10240,
+    show_default=True,
+    help="Maximum cache size in MiB, least recently used outputs are evicted",
+)
+@click.option(
+    "--mem-report",
+    "mem_report",
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True, path_type=Path),
+    default=None,
+    help="Write peak RSS and per-stage allocations as JSON (use '-' for stderr)",
+)
 def merge_cmd(
-    infile: click.utils.LazyFile | TextIO,
-    outfile: click.utils.LazyFile | TextIO,
+    infile: Literal["-"] | Path,
+    outfile: Literal["-"] | Path,
     distance: Annotated[int, Ge(0), Le(100)] = 5,
     mode: Literal["median"] = "median",
+    update: None | Path = None,
+    *,
+    threads: int = 1,
+    keep_members: bool = False,
+    exclude: None | Path = None,
+    cache_dir: None | Path = None,
+    cache_max_size: int = 10240,
+    mem_report: None | Path = None,
+    split_by_contig: None | Path = None,
+    split_by_strand: bool = False,
 ) -> None:
     """Merge proximal integration sites in a BED file."""
-    from isatoolkit2.bed.merge import merge_integration_sites
+    check_cache_options(cache_dir, mem_report)
+    check_split_options(
+        outfile,
+        cache_dir,
+        split_by_contig,
+        split_by_strand=split_by_strand,
+    )
 
-    merge_integration_sites(
-        infile=infile,
+    from isatoolkit2.bed.merge import merge_integration_sites, update_merged_sites
+    from isatoolkit2.bed.split import open_bed_output
+    from isatoolkit2.bgzf import open_text_input
+    from isatoolkit2.cache import run_cached
+    from isatoolkit2.memory import MemoryReport, stage
+
+    memory = MemoryReport("bed merge") if mem_report is not None else None
+
+    def compute(output: Literal["-"] | Path) -> str:
+        with ExitStack() as stack:
+            infile_handle = stack.enter_context(open_text_input(infile))
+            outfile_handle = stack.enter_context(
+                open_bed_output(
+                    output,
+                    threads=threads,
+                    split_by_contig=split_by_contig,
+                    by_strand=split_by_strand,
+                ),
+            )
+
+            if update is None:
+                excluded = merge_integration_sites(
+                    infile=infile_handle,
+                    outfile=outfile_handle,
+                    distance=distance,
+                    mode=mode,
+                    keep_members=keep_members,
+                    memory=memory,
+                    exclude=exclude,
+                )
+            else:
+                # Only recompute the merged sites that new sites are proximal to
+                with stage(memory, "update"):
+                    excluded = update_merged_sites(
+                        merged_infile=stack.enter_context(open_text_input(update)),
+                        infile=infile_handle,
+                        outfile=outfile_handle,
+                        distance=distance,
+                        mode=mode,
+                        keep_members=keep_members,
+                        exclude=exclude,
+                    )
+        # The exclude path is filled in when the report is written
+        return f"{excluded} overlapping $exclude\n" if exclude is not None else ""
+
+    run_cached(
+        compute,
+        outfile=outfile,
+        cache_dir=cache_dir,
+        command="bed merge",
+        params={
+            "distance": distance,
+            "mode": mode,
+            "keep_members": keep_members,
+            "update": update is not None,
+            "exclude": exclude is not None,
+        },
+        inputs=[
+            infile,
+            *([update] if update is not None else []),
+            *([exclude] if exclude is not None else []),
+        ],
+        max_size=cache_max_size * 1024**2,
+        report_values={"exclude": str(exclude)},
+    )
+    if memory is not None and mem_report is not None:
+        memory.write(mem_report)
+
+
+@bed.command("matrix")
+@click.argument(
+    "infiles",
+    nargs=-1,
+    required=True,
+    type=BED_INPUT,
+)
+@click.option(
+    "-o",
+    "--outfile",
+    "outfile",
+    type=BED_OUTPUT,
+    default="-",
+    show_default=True,
+    help="Output matrix file or stdout (use '-' for stdout), BGZF if ending in .gz",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for BGZF output compression",
+)
+@click.option(
+    "-d",
+    "--distance",
+    "distance",
+    type=int,
+    default=5,
+    show_default=True,
+    help="Distance to merge proximal integration sites",
+)
+@click.option(
+    "-f",
+    "--format",
+    "output_format",
+    type=click.Choice(["dense", "coo"], case_sensitive=False),
+    default="dense",
+    show_default=True,
+    help="Dense TSV with a column per sample, or sparse COO with a line per count",
+)
+@click.option(
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Reuse outputs of previous runs with the same inputs and parameters",
+)
+@click.option(
+    "--cache-max-size",
+    "cache_max_size",
+    type=click.IntRange(min=0),
+    default=10240,
+    show_default=True,
+    help="Maximum cache size in MiB, least recently used outputs are evicted",
+)
+def matrix_cmd(
+    infiles: tuple[Literal["-"] | Path, ...],
+    outfile: Literal["-"] | Path,
+    distance: Annotated[int, Ge(0), Le(100)] = 5,
+    output_format: Literal["dense", "coo"] = "dense",
+    *,
+    threads: int = 1,
+    cache_dir: None | Path = None,
+    cache_max_size: int = 10240,
+) -> None:
+    """
+    Count merged sites per sample in position sorted per-sample BED files.
+
+    Sample names are the input file names without BED and compression suffixes.
+    """
+    from isatoolkit2.bed.matrix import count_matrix, sample_name
+    from isatoolkit2.bgzf import open_text_input, open_text_output
+    from isatoolkit2.cache import run_cached
+
+    def compute(output: Literal["-"] | Path) -> None:
+        with ExitStack() as stack:
+            infile_handles = [
+                stack.enter_context(open_text_input(infile)) for infile in infiles
+            ]
+            outfile_handle = stack.enter_context(
+                open_text_output(output, threads=threads),
+            )
+            count_matrix(
+                infiles=infile_handles,
+                names=[sample_name(infile) for infile in infiles],
+                outfile=outfile_handle,
+                distance=distance,
+                output_format=output_format,
+            )
+
+    run_cached(
+        compute,
+        outfile=outfile,
+        cache_dir=cache_dir,
+        command="bed matrix",
+        params={
+            "distance": distance,
+            "format": output_format,
+            "names": [sample_name(infile) for infile in infiles],
+        },
+        inputs=list(infiles),
+        max_size=cache_max_size * 1024**2,
+    )
+
+
+@bed.command("combine")
+@click.argument(
+    "infiles",
+    nargs=-1,
+    required=True,
+    type=BED_INPUT,
+)
+@click.option(
+    "-o",
+    "--outfile",
+    "outfile",
+    type=BED_OUTPUT,
+    default="-",
+    show_default=True,
+    help="Output BED file or stdout (use '-' for stdout), BGZF if ending in .gz",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for BGZF output compression",
+)
+@click.option(
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Reuse outputs of previous runs with the same inputs and parameters",
+)
+@click.option(
+    "--cache-max-size",
+    "cache_max_size",
+    type=click.IntRange(min=0),
+    default=10240,
+    show_default=True,
+    help="Maximum cache size in MiB, least recently used outputs are evicted",
+)
+def combine_cmd(
+    infiles: tuple[Literal["-"] | Path, ...],
+    outfile: Literal["-"] | Path,
+    *,
+    threads: int = 1,
+    cache_dir: None | Path = None,
+    cache_max_size: int = 10240,
+) -> None:
+    """
+    Combine position sorted count BED files, adding up the counts of each site.
+
+    The inputs are merged k-way, so memory is bounded by the number of inputs.
+    """
+    from isatoolkit2.bed.combine import combine_counts
+    from isatoolkit2.bgzf import open_text_input, open_text_output
+    from isatoolkit2.cache import run_cached
+
+    def compute(output: Literal["-"] | Path) -> None:
+        with ExitStack() as stack:
+            infile_handles = [
+                stack.enter_context(open_text_input(infile)) for infile in infiles
+            ]
+            outfile_handle = stack.enter_context(
+                open_text_output(output, threads=threads),
+            )
+            combine_counts(
+                infiles=infile_handles,
+                names=[str(infile) for infile in infiles],
+                outfile=outfile_handle,
+            )
+
+    run_cached(
+        compute,
         outfile=outfile,
-        distance=distance,
-        mode=mode,
+        cache_dir=cache_dir,
+        command="bed combine",
+        params={},
+        inputs=list(infiles),
+        max_size=cache_max_size * 1024**2,
     )
 
 
@@ -131,7 +653,7 @@ def sam() -> None:
     type=SAMBAM_INPUT,
     default="-",
     show_default=True,
-    help="Input SAM/BAM file or stdin (use '-' for stdin)",
+    help="Input SAM/BAM/CRAM file or stdin (use '-' for stdin)",
 )
 @click.option(
     "-o",
@@ -140,7 +662,7 @@ def sam() -> None:
     type=SAMBAM_OUTPUT,
     default="-",
     show_default=True,
-    help="Output SAM/BAM file or stdout (use '-' for stdout)",
+    help="Output SAM/BAM/CRAM file or stdout (use '-' for stdout)",
 )
 @click.option(
     "--no-alt-filtering",
@@ -164,9 +686,9 @@ def sam() -> None:
     "-f",
     "--outfile-format",
     "outfile_format",
-    type=click.Choice(["sam", "bam"], case_sensitive=False),
+    type=click.Choice(["sam", "bam", "cram"], case_sensitive=False),
     required=True,
-    help="Output format (sam or bam)",
+    help="Output format (sam, bam or cram)",
 )
 @click.option(
     "-u",
@@ -185,18 +707,131 @@ def sam() -> None:
     type=DISCARDED_SAMBAM_OUTPUT,
     help="Output discarded reads to a separate file",
 )
+@click.option(
+    "--drop-mates",
+    "drop_mates",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Apply the decision for a discarded or dropped mate to both mates",
+)
+@click.option(
+    "--mate-buffer-size",
+    "mate_buffer_size",
+    type=click.IntRange(min=1),
+    default=100_000,
+    show_default=True,
+    help=(
+        "Number of reads (and read pairs) held in memory while waiting for mates, "
+        "before spilling"
+    ),
+)
+@click.option(
+    "-r",
+    "--reference",
+    "reference",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Reference FASTA for decoding and encoding CRAM files",
+)
+@click.option(
+    "--ref-cache",
+    "ref_cache",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Local reference cache directory, filled from the reference FASTA",
+)
+@click.option(
+    "-w",
+    "--workers",
+    "workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes (output records are the same for any number)",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for pipelined reading, filtering and writing",
+)
+@click.option(
+    "--progress",
+    "progress",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Report reads processed, throughput and an ETA on stderr",
+)
+@click.option(
+    "--subsample",
+    "subsample",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=None,
+    help="Only process this fraction of the read pairs, chosen by query name",
+)
+@click.option(
+    "--seed",
+    "seed",
+    type=click.IntRange(min=0, max=(1 << 128) - 1),
+    default=0,
+    show_default=True,
+    help="Seed of the query name hash for --subsample",
+)
+@click.option(
+    "--region",
+    "regions",
+    type=str,
+    multiple=True,
+    help="Only process reads overlapping a region, e.g. chr1:1,000-2,000 (repeatable)",
+)
+@click.option(
+    "--targets",
+    "targets",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Only process reads overlapping the intervals of a BED file",
+)
 def mapping_filter_cmd(
     infile: Literal["-"] | Path,
     outfile: Literal["-"] | Path,
-    outfile_format: Literal["sam", "bam"],
+    outfile_format: Literal["sam", "bam", "cram"],
     discarded_outfile: None | Path = None,
     *,
     no_alt_filtering: bool = False,
     no_sup_filtering: bool = False,
     uncompressed: bool = False,
+    workers: int = 1,
+    threads: int = 1,
+    reference: None | Path = None,
+    ref_cache: None | Path = None,
+    drop_mates: bool = False,
+    mate_buffer_size: int = 100_000,
+    progress: bool = False,
+    subsample: None | float = None,
+    seed: int = 0,
+    regions: tuple[str, ...] = (),
+    targets: None | Path = None,
 ) -> None:
-    """Filter SAM/BAM file."""
+    """Filter SAM/BAM/CRAM file."""
+    if workers > 1 and outfile_format == "cram":
+        error_msg = "--workers can't be combined with CRAM output"
+        raise click.UsageError(error_msg)
+    if workers > 1 and drop_mates:
+        error_msg = "--workers can't be combined with --drop-mates"
+        raise click.UsageError(error_msg)
+
     from isatoolkit2.sam.mapping_filter import alt_sup_filtering
+    from isatoolkit2.sam.sam_utils import configure_reference_cache
+
+    if ref_cache is not None:
+        configure_reference_cache(ref_cache, reference)
 
     alt_sup_filtering(
         infile=infile,
@@ -206,7 +841,230 @@ def mapping_filter_cmd(
         output_format=outfile_format,
         uncompressed=uncompressed,
         discarded_outfile=discarded_outfile,
+        workers=workers,
+        threads=threads,
+        reference=reference,
+        drop_mates=drop_mates,
+        mate_buffer_size=mate_buffer_size,
+        progress=progress,
+        subsample=subsample,
+        seed=seed,
+        regions=regions,
+        targets=targets,
+    )
+
+
+@sam.command("filter")
+@click.option(
+    "-i",
+    "--infile",
+    "infile",
+    type=SAMBAM_INPUT,
+    default="-",
+    show_default=True,
+    help="Input SAM/BAM/CRAM file or stdin (use '-' for stdin)",
+)
+@click.option(
+    "-o",
+    "--outfile",
+    "outfile",
+    type=SAMBAM_OUTPUT,
+    default="-",
+    show_default=True,
+    help="Output SAM/BAM/CRAM file or stdout (use '-' for stdout)",
+)
+@click.option(
+    "-e",
+    "--expr",
+    "expression",
+    type=str,
+    required=True,
+    help="Keep reads matching an expression, e.g. 'mapq >= 20 and not tag(XA)'",
+)
+@click.option(
+    "-f",
+    "--outfile-format",
+    "outfile_format",
+    type=click.Choice(["sam", "bam", "cram"], case_sensitive=False),
+    required=True,
+    help="Output format (sam, bam or cram)",
+)
+@click.option(
+    "-u",
+    "--uncompressed",
+    "uncompressed",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Output uncompressed BAM file",
+)
+@click.option(
+    "-d",
+    "--discarded-outfile",
+    "discarded_outfile",
+    type=DISCARDED_SAMBAM_OUTPUT,
+    help="Output discarded reads to a separate file",
+)
+@click.option(
+    "--drop-mates",
+    "drop_mates",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Apply the decision for a discarded or dropped mate to both mates",
+)
+@click.option(
+    "--mate-buffer-size",
+    "mate_buffer_size",
+    type=click.IntRange(min=1),
+    default=100_000,
+    show_default=True,
+    help=(
+        "Number of reads (and read pairs) held in memory while waiting for mates, "
+        "before spilling"
+    ),
+)
+@click.option(
+    "-r",
+    "--reference",
+    "reference",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Reference FASTA for decoding and encoding CRAM files",
+)
+@click.option(
+    "--ref-cache",
+    "ref_cache",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Local reference cache directory, filled from the reference FASTA",
+)
+@click.option(
+    "-w",
+    "--workers",
+    "workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes (output records are the same for any number)",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for pipelined reading, filtering and writing",
+)
+@click.option(
+    "--progress",
+    "progress",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Report reads processed, throughput and an ETA on stderr",
+)
+@click.option(
+    "--subsample",
+    "subsample",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=None,
+    help="Only process this fraction of the read pairs, chosen by query name",
+)
+@click.option(
+    "--seed",
+    "seed",
+    type=click.IntRange(min=0, max=(1 << 128) - 1),
+    default=0,
+    show_default=True,
+    help="Seed of the query name hash for --subsample",
+)
+@click.option(
+    "--region",
+    "regions",
+    type=str,
+    multiple=True,
+    help="Only process reads overlapping a region, e.g. chr1:1,000-2,000 (repeatable)",
+)
+@click.option(
+    "--targets",
+    "targets",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Only process reads overlapping the intervals of a BED file",
+)
+def expression_filter_cmd(
+    infile: Literal["-"] | Path,
+    outfile: Literal["-"] | Path,
+    outfile_format: Literal["sam", "bam", "cram"],
+    expression: str,
+    discarded_outfile: None | Path = None,
+    *,
+    uncompressed: bool = False,
+    workers: int = 1,
+    threads: int = 1,
+    reference: None | Path = None,
+    ref_cache: None | Path = None,
+    drop_mates: bool = False,
+    mate_buffer_size: int = 100_000,
+    progress: bool = False,
+    subsample: None | float = None,
+    seed: int = 0,
+    regions: tuple[str, ...] = (),
+    targets: None | Path = None,
+) -> None:
+    """
+    Filter SAM/BAM/CRAM file by a read expression.
+
+    Expressions compare the numeric fields mapq, flag, pos, tlen (absolute
+    template length), length, nm and softclip5, check the FLAG fields
+    paired, proper_pair, unmapped, mate_unmapped, reverse, mate_reverse,
+    read1, read2, secondary, qcfail, duplicate and supplementary, and check
+    tags with tag(XX), combined with and, or, not and parentheses.
+    The number of discarded reads per clause is reported on stderr.
+    """
+    if workers > 1 and outfile_format == "cram":
+        error_msg = "--workers can't be combined with CRAM output"
+        raise click.UsageError(error_msg)
+    if workers > 1 and drop_mates:
+        error_msg = "--workers can't be combined with --drop-mates"
+        raise click.UsageError(error_msg)
+
+    from isatoolkit2.sam.expression_filter import ReadExpression, expression_filtering
+    from isatoolkit2.sam.sam_utils import configure_reference_cache
+
+    # Check the expression before reading any input
+    try:
+        ReadExpression(expression)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--expr") from None
+
+    if ref_cache is not None:
+        configure_reference_cache(ref_cache, reference)
+
+    counts = expression_filtering(
+        infile=infile,
+        outfile=outfile,
+        expression=expression,
+        output_format=outfile_format,
+        uncompressed=uncompressed,
+        discarded_outfile=discarded_outfile,
+        workers=workers,
+        threads=threads,
+        reference=reference,
+        drop_mates=drop_mates,
+        mate_buffer_size=mate_buffer_size,
+        progress=progress,
+        subsample=subsample,
+        seed=seed,
+        regions=regions,
+        targets=targets,
     )
+    click.echo(counts, err=True, nl=False)
 
 
 @sam.command("fiveprime-filter")
@@ -217,7 +1075,7 @@ def mapping_filter_cmd(
     type=SAMBAM_INPUT,
     default="-",
     show_default=True,
-    help="Input SAM/BAM file or stdin (use '-' for stdin)",
+    help="Input SAM/BAM/CRAM file or stdin (use '-' for stdin)",
 )
 @click.option(
     "-o",
@@ -226,15 +1084,15 @@ def mapping_filter_cmd(
     type=SAMBAM_OUTPUT,
     default="-",
     show_default=True,
-    help="Output SAM/BAM file or stdout (use '-' for stdout)",
+    help="Output SAM/BAM/CRAM file or stdout (use '-' for stdout)",
 )
 @click.option(
     "-f",
     "--outfile-format",
     "outfile_format",
-    type=click.Choice(["sam", "bam"], case_sensitive=False),
+    type=click.Choice(["sam", "bam", "cram"], case_sensitive=False),
     required=True,
-    help="Output format (sam or bam)",
+    help="Output format (sam, bam or cram)",
 )
 @click.option(
     "-u",
@@ -262,17 +1120,130 @@ def mapping_filter_cmd(
     show_default=True,
     help="Maximum softclip length",
 )
+@click.option(
+    "--drop-mates",
+    "drop_mates",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Apply the decision for a discarded or dropped mate to both mates",
+)
+@click.option(
+    "--mate-buffer-size",
+    "mate_buffer_size",
+    type=click.IntRange(min=1),
+    default=100_000,
+    show_default=True,
+    help=(
+        "Number of reads (and read pairs) held in memory while waiting for mates, "
+        "before spilling"
+    ),
+)
+@click.option(
+    "-r",
+    "--reference",
+    "reference",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Reference FASTA for decoding and encoding CRAM files",
+)
+@click.option(
+    "--ref-cache",
+    "ref_cache",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Local reference cache directory, filled from the reference FASTA",
+)
+@click.option(
+    "-w",
+    "--workers",
+    "workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of worker processes (output records are the same for any number)",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for pipelined reading, filtering and writing",
+)
+@click.option(
+    "--progress",
+    "progress",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Report reads processed, throughput and an ETA on stderr",
+)
+@click.option(
+    "--subsample",
+    "subsample",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=None,
+    help="Only process this fraction of the read pairs, chosen by query name",
+)
+@click.option(
+    "--seed",
+    "seed",
+    type=click.IntRange(min=0, max=(1 << 128) - 1),
+    default=0,
+    show_default=True,
+    help="Seed of the query name hash for --subsample",
+)
+@click.option(
+    "--region",
+    "regions",
+    type=str,
+    multiple=True,
+    help="Only process reads overlapping a region, e.g. chr1:1,000-2,000 (repeatable)",
+)
+@click.option(
+    "--targets",
+    "targets",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Only process reads overlapping the intervals of a BED file",
+)
 def fiveprime_filter_cmd(
     infile: Literal["-"] | Path,
     outfile: Literal["-"] | Path,
-    outfile_format: Literal["sam", "bam"],
+    outfile_format: Literal["sam", "bam", "cram"],
     max_softclip: Annotated[int, Ge(1), Le(100)] = 5,
     discarded_outfile: None | Path = None,
     *,
     uncompressed: bool = False,
+    workers: int = 1,
+    threads: int = 1,
+    reference: None | Path = None,
+    ref_cache: None | Path = None,
+    drop_mates: bool = False,
+    mate_buffer_size: int = 100_000,
+    progress: bool = False,
+    subsample: None | float = None,
+    seed: int = 0,
+    regions: tuple[str, ...] = (),
+    targets: None | Path = None,
 ) -> None:
-    """Filter SAM/BAM file based on 5' softclipping."""
+    """Filter SAM/BAM/CRAM file based on 5' softclipping."""
+    if workers > 1 and outfile_format == "cram":
+        error_msg = "--workers can't be combined with CRAM output"
+        raise click.UsageError(error_msg)
+    if workers > 1 and drop_mates:
+        error_msg = "--workers can't be combined with --drop-mates"
+        raise click.UsageError(error_msg)
+
     from isatoolkit2.sam.fiveprime_filter import fiveprime_filter
+    from isatoolkit2.sam.sam_utils import configure_reference_cache
+
+    if ref_cache is not None:
+        configure_reference_cache(ref_cache, reference)
 
     fiveprime_filter(
         infile=infile,
@@ -281,6 +1252,16 @@ def fiveprime_filter_cmd(
         outfile_format=outfile_format,
         uncompressed=uncompressed,
         discarded_outfile=discarded_outfile,
+        workers=workers,
+        threads=threads,
+        reference=reference,
+        drop_mates=drop_mates,
+        mate_buffer_size=mate_buffer_size,
+        progress=progress,
+        subsample=subsample,
+        seed=seed,
+        regions=regions,
+        targets=targets,
     )
 
 
@@ -292,28 +1273,372 @@ def fiveprime_filter_cmd(
     type=SAMBAM_INPUT,
     default="-",
     show_default=True,
-    help="Input SAM/BAM file or stdin (use '-' for stdin)",
+    help="Input SAM/BAM/CRAM file or stdin (use '-' for stdin)",
 )
 @click.option(
     "-o",
     "--outfile",
     "outfile",
-    type=click.File("w"),
+    type=BED_OUTPUT,
     default="-",
     show_default=True,
-    help="Output BED file or stdout (use '-' for stdout)",
+    help="Output BED file or stdout (use '-' for stdout), BGZF if ending in .gz",
+)
+@click.option(
+    "-t",
+    "--threads",
+    "threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads for reading, BGZF output compression and counting",
+)
+@click.option(
+    "-r",
+    "--reference",
+    "reference",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Reference FASTA for decoding and encoding CRAM files",
+)
+@click.option(
+    "--ref-cache",
+    "ref_cache",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Local reference cache directory, filled from the reference FASTA",
+)
+@click.option(
+    "--split-by-contig",
+    "split_by_contig",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Write a BED file per contig to this directory, instead of --outfile",
+)
+@click.option(
+    "--split-by-strand",
+    "split_by_strand",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="With --split-by-contig, write a BED file per contig and strand",
+)
+@click.option(
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Reuse outputs of previous runs with the same inputs and parameters",
+)
+@click.option(
+    "--cache-max-size",
+    "cache_max_size",
+    type=click.IntRange(min=0),
+    default=10240,
+    show_default=True,
+    help="Maximum cache size in MiB, least recently used outputs are evicted",
+)
+@click.option(
+    "--progress",
+    "progress",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Report reads processed, throughput and an ETA on stderr",
+)
+@click.option(
+    "--subsample",
+    "subsample",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+    default=None,
+    help="Only process this fraction of the read pairs, chosen by query name",
+)
+@click.option(
+    "--seed",
+    "seed",
+    type=click.IntRange(min=0, max=(1 << 128) - 1),
+    default=0,
+    show_default=True,
+    help="Seed of the query name hash for --subsample",
+)
+@click.option(
+    "--region",
+    "regions",
+    type=str,
+    multiple=True,
+    help="Only process reads overlapping a region, e.g. chr1:1,000-2,000 (repeatable)",
+)
+@click.option(
+    "--targets",
+    "targets",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Only process reads overlapping the intervals of a BED file",
+)
+@click.option(
+    "--mem-report",
+    "mem_report",
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True, path_type=Path),
+    default=None,
+    help="Write peak RSS and per-stage allocations as JSON (use '-' for stderr)",
+)
+@click.option(
+    "--checkpoint",
+    "checkpoint",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="Periodically save the partial counts to this file, for --resume",
+)
+@click.option(
+    "--checkpoint-interval",
+    "checkpoint_interval",
+    type=click.FloatRange(min=0),
+    default=300.0,
+    show_default=True,
+    help="Seconds between checkpoints",
+)
+@click.option(
+    "--resume",
+    "resume",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Continue counting from the checkpoint, if there is one",
+)
+@click.option(
+    "--saturation",
+    "saturation",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="Write a saturation curve of unique sites against R1 reads as TSV",
+)
+@click.option(
+    "--saturation-points",
+    "saturation_points",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="Number of depths on the saturation curve",
+)
+@click.option(
+    "--exclude",
+    "exclude",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Drop sites overlapping the intervals of a BED file, e.g. a blacklist",
+)
+@click.option(
+    "--umi-tag",
+    "umi_tag",
+    type=str,
+    default=None,
+    help="Count distinct UMIs of this tag per site instead of reads, e.g. RX",
+)
+@click.option(
+    "--umi-from-name",
+    "umi_from_name",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Count distinct UMIs at the end of query names per site instead of reads",
+)
+@click.option(
+    "--umi-separator",
+    "umi_separator",
+    type=str,
+    default="_",
+    show_default=True,
+    help="Separator before the UMI in query names, for --umi-from-name",
+)
+@click.option(
+    "--collapse-umis",
+    "collapse_umis",
+    is_flag=True,
+    type=bool,
+    default=False,
+    show_default=True,
+    help="Count UMIs one base apart at a site as one, like umi_tools cluster",
+)
+@click.option(
+    "--shear-sites",
+    "shear_sites",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="Write the distinct shear sites of each site as BED, from R1 mate fields",
 )
 def count_cmd(
     infile: Literal["-"] | Path,
-    outfile: click.utils.LazyFile | TextIO,
+    outfile: Literal["-"] | Path,
+    threads: int = 1,
+    *,
+    reference: None | Path = None,
+    ref_cache: None | Path = None,
+    cache_dir: None | Path = None,
+    cache_max_size: int = 10240,
+    progress: bool = False,
+    subsample: None | float = None,
+    seed: int = 0,
+    regions: tuple[str, ...] = (),
+    targets: None | Path = None,
+    mem_report: None | Path = None,
+    checkpoint: None | Path = None,
+    checkpoint_interval: float = 300.0,
+    resume: bool = False,
+    saturation: None | Path = None,
+    saturation_points: int = 20,
+    exclude: None | Path = None,
+    split_by_contig: None | Path = None,
+    split_by_strand: bool = False,
+    umi_tag: None | str = None,
+    umi_from_name: bool = False,
+    umi_separator: str = "_",
+    collapse_umis: bool = False,
+    shear_sites: None | Path = None,
 ) -> None:
-    """Count integration sites in a SAM/BAM file."""
+    """Count integration sites in a SAM/BAM/CRAM file."""
+    check_umi_options(
+        umi_tag,
+        umi_from_name=umi_from_name,
+        collapse_umis=collapse_umis,
+    )
+    check_checkpoint_options(
+        infile,
+        checkpoint,
+        resume=resume,
+        saturation=saturation is not None,
+        regions=bool(regions) or targets is not None,
+        umis=umi_tag is not None or umi_from_name,
+        shear_sites=shear_sites is not None,
+    )
+    if saturation is not None and cache_dir is not None:
+        error_msg = "--saturation can't be combined with --cache-dir"
+        raise click.UsageError(error_msg)
+    if shear_sites is not None and cache_dir is not None:
+        error_msg = "--shear-sites can't be combined with --cache-dir"
+        raise click.UsageError(error_msg)
+    check_cache_options(cache_dir, mem_report)
+    check_split_options(
+        outfile,
+        cache_dir,
+        split_by_contig,
+        split_by_strand=split_by_strand,
+    )
+
+    from isatoolkit2.bed.split import open_bed_output
+    from isatoolkit2.cache import run_cached
+    from isatoolkit2.memory import MemoryReport
     from isatoolkit2.sam.count import count_integration_sites
+    from isatoolkit2.sam.sam_utils import configure_reference_cache
 
-    count_integration_sites(
-        infile=infile,
+    memory = MemoryReport("sam count") if mem_report is not None else None
+
+    if ref_cache is not None:
+        configure_reference_cache(ref_cache, reference)
+
+    def compute(output: Literal["-"] | Path) -> str:
+        with open_bed_output(
+            output,
+            threads=threads,
+            split_by_contig=split_by_contig,
+            by_strand=split_by_strand,
+        ) as outfile_handle:
+            counts = count_integration_sites(
+                infile=infile,
+                outfile=outfile_handle,
+                threads=threads,
+                reference=reference,
+                progress=progress,
+                memory=memory,
+                checkpoint=checkpoint,
+                resume=resume,
+                checkpoint_interval=checkpoint_interval,
+                subsample=subsample,
+                seed=seed,
+                regions=regions,
+                targets=targets,
+                saturation=saturation,
+                saturation_points=saturation_points,
+                exclude=exclude,
+                umi_tag=umi_tag,
+                umi_from_name=umi_from_name,
+                umi_separator=umi_separator,
+                collapse_umis=collapse_umis,
+                shear_sites=shear_sites,
+            )
+        # Reports for stderr, cached with the output
+        reports = []
+        if exclude is not None:
+            # The exclude path is filled in when the report is written
+            reports.append(f"{counts.excluded} overlapping $exclude")
+        if counts.umis is not None:
+            reports.append(str(counts.umis))
+        if counts.shear_sites is not None:
+            reports.append(str(counts.shear_sites))
+        return "".join(f"{report}\n" for report in reports)
+
+    run_cached(
+        compute,
         outfile=outfile,
+        cache_dir=cache_dir,
+        command="sam count",
+        params={
+            "subsample": subsample,
+            "seed": seed,
+            "regions": list(regions),
+            "targets": targets is not None,
+            "exclude": exclude is not None,
+            "umi_tag": umi_tag,
+            "umi_from_name": umi_from_name,
+            "umi_separator": umi_separator,
+            "collapse_umis": collapse_umis,
+        },
+        inputs=[
+            infile,
+            *([targets] if targets is not None else []),
+            *([exclude] if exclude is not None else []),
+        ],
+        max_size=cache_max_size * 1024**2,
+        report_values={"exclude": str(exclude)},
     )
+    if memory is not None and mem_report is not None:
+        memory.write(mem_report)
+
+
+@click.command("serve")
+@click.option(
+    "-s",
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Unix socket to listen on [default: $TRACE_SOCKET or a per-user socket]",
+)
+@click.option(
+    "-w",
+    "--workers",
+    "workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of commands run at the same time",
+)
+def serve_cmd(
+    socket_path: None | Path,
+    workers: int = 4,
+) -> None:
+    """Serve trace commands submitted with trace-submit, with warm imports."""
+    from isatoolkit2.serve import default_socket_path, serve
+
+    socket_path = socket_path or default_socket_path()
+    click.echo(f"Serving trace commands on {socket_path}", err=True)
+    try:
+        serve(socket_path, workers=workers)
+    except ValueError as e:
+        raise click.UsageError(str(e)) from e
 
 
 # The CLI entry point
@@ -325,6 +1650,7 @@ def cli() -> None:
 # Add the subcommands to the main CLI group
 cli.add_command(sam)
 cli.add_command(bed)
+cli.add_command(serve_cmd)
 
 if __name__ == "__main__":
     # Run the CLI
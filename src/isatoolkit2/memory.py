@@ -0,0 +1,139 @@
+"""Report peak memory and allocations per stage of a command."""
+
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import Annotated, Any, Literal
+
+from annotated_types import Ge
+
+# Number of allocation sites listed per stage
+TOP_ALLOCATIONS = 10
+
+# Allocations of the import machinery and tracemalloc itself are not reported
+IGNORED_FILES = ["<frozen importlib._bootstrap>", tracemalloc.__file__]
+
+
+def peak_rss() -> int:
+    """Get the peak resident set size of this process in bytes."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def allocation_sites(
+    snapshot: tracemalloc.Snapshot,
+    top: Annotated[int, Ge(0)] = TOP_ALLOCATIONS,
+) -> list[dict[str, Any]]:
+    """Get the source lines with the most memory allocated in a snapshot."""
+    sites = []
+    for stat in snapshot.statistics("lineno"):
+        frame = stat.traceback[0]
+        if len(sites) == top:
+            break
+        if frame.filename in IGNORED_FILES:
+            continue
+        sites.append(
+            {
+                "site": f"{frame.filename}:{frame.lineno}",
+                "size_bytes": stat.size,
+                "count": stat.count,
+            },
+        )
+    return sites
+
+
+class MemoryReport:
+
+    """
+    Peak memory and allocation sites of the stages of a command.
+
+    Tracing starts when the report is created and slows down allocations,
+    so it's only enabled on request. For each stage, the report records
+    the time taken, the memory traced at the end and at its peak, the
+    peak RSS of the process so far, the memory used by tracing, and the
+    sites with the most memory allocated at the end of the stage.
+    """
+
+    def __init__(
+        self,
+        command: str,
+        top: Annotated[int, Ge(0)] = TOP_ALLOCATIONS,
+    ) -> None:
+        """Start tracing allocations."""
+        self.command = command
+        self.top = top
+        self.stages: list[dict[str, Any]] = []
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(
+        self,
+        name: str,
+    ) -> Iterator[None]:
+        """Record the memory used by a stage."""
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        self.stages.append(
+            {
+                "name": name,
+                "seconds": round(seconds, 3),
+                "traced_bytes": current,
+                "traced_peak_bytes": peak,
+                "peak_rss_bytes": peak_rss(),
+                "tracing_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+                "top_allocations": self._top_allocations(),
+            },
+        )
+
+    def _top_allocations(self) -> list[dict[str, Any]]:
+        """
+        Get the source lines with the most memory currently allocated.
+
+        The snapshot is taken and grouped in this process, which is safe
+        with reading and writing threads running. It is taken after the time
+        and traced memory of the stage are read, and freed before the next
+        stage, but grouping it is slow, since its allocations are traced too.
+        """
+        snapshot = tracemalloc.take_snapshot()
+        return allocation_sites(snapshot, self.top)
+
+    def write(
+        self,
+        path: Literal["-"] | Path,
+    ) -> None:
+        """Stop tracing and write the report as JSON."""
+        if self.started_tracing:
+            tracemalloc.stop()
+        report = {
+            "command": self.command,
+            "peak_rss_bytes": peak_rss(),
+            "traced_peak_bytes": max(
+                (stage["traced_peak_bytes"] for stage in self.stages),
+                default=0,
+            ),
+            "stages": self.stages,
+        }
+        text = json.dumps(report, indent=2) + "\n"
+        if str(path) == "-":
+            sys.stderr.write(text)
+        else:
+            Path(path).write_text(text)
+
+
+def stage(
+    report: None | MemoryReport,
+    name: str,
+) -> AbstractContextManager[None]:
+    """Record a stage in a memory report, if there is one."""
+    return report.stage(name) if report is not None else nullcontext()
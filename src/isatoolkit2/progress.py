@@ -0,0 +1,138 @@
+"""Report the progress of long running commands on stderr."""
+
+import sys
+import time
+from collections.abc import Callable
+from datetime import timedelta
+from typing import Annotated, TextIO
+
+from annotated_types import Ge, Gt
+
+# Default number of seconds between progress reports
+PROGRESS_INTERVAL = 5.0
+
+
+def format_bytes(
+    size: Annotated[float, Ge(0)],
+) -> str:
+    """Format a number of bytes with a binary unit."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:  # noqa: PLR2004
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+class ProgressReporter:
+
+    """
+    Throttled report of records processed, throughput, bytes consumed and ETA.
+
+    Callers update the reporter once per batch of records. Only the time is
+    checked on each update, the position in the input is read when a report
+    is due, so reporting doesn't slow down processing. The ETA is based on
+    the total number of records if it's known, e.g. from an index, otherwise
+    on the bytes consumed out of the input size.
+    """
+
+    def __init__(
+        self,
+        *,
+        total_records: None | Annotated[int, Ge(0)] = None,
+        total_bytes: None | Annotated[int, Ge(0)] = None,
+        tell: None | Callable[[], int] = None,
+        interval: Annotated[float, Gt(0)] = PROGRESS_INTERVAL,
+        stream: None | TextIO = None,
+    ) -> None:
+        """Start timing, without reporting yet."""
+        self.total_records = total_records
+        self.total_bytes = total_bytes
+        self.tell = tell
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        # On a terminal, reports overwrite each other on one line
+        self.overwrite = self.stream.isatty()
+        self.records = 0
+        self.start = time.monotonic()
+        self.next_report = self.start + interval
+
+    def update(
+        self,
+        records: Annotated[int, Ge(0)],
+    ) -> None:
+        """Count processed records, reporting if the interval has passed."""
+        self.records += records
+        now = time.monotonic()
+        if now >= self.next_report:
+            self.next_report = now + self.interval
+            self._report(now)
+
+    def finish(self) -> None:
+        """Report the totals."""
+        now = time.monotonic()
+        elapsed = now - self.start
+        rate = self.records / elapsed if elapsed > 0 else 0
+        self._write(
+            f"Processed {self.records:,} records in "
+            f"{timedelta(seconds=round(elapsed))} ({rate:,.0f} records/s)",
+        )
+        if self.overwrite:
+            self.stream.write("\n")
+        self.stream.flush()
+
+    def _consumed_bytes(self) -> None | int:
+        """Get the number of input bytes consumed, if the position is known."""
+        if self.tell is None:
+            return None
+        try:
+            return self.tell()
+        except (OSError, ValueError, NotImplementedError):
+            # Some inputs, like pipes, have no position
+            self.tell = None
+            return None
+
+    def _fraction(
+        self,
+        consumed: None | int,
+    ) -> None | float:
+        """Get the fraction of the input processed, if it can be estimated."""
+        if self.total_records:
+            return min(self.records / self.total_records, 1.0)
+        if consumed is not None and self.total_bytes:
+            return min(consumed / self.total_bytes, 1.0)
+        return None
+
+    def _report(
+        self,
+        now: float,
+    ) -> None:
+        """Write a progress report."""
+        elapsed = now - self.start
+        parts = [
+            f"{self.records:,} records",
+            f"{self.records / elapsed:,.0f} records/s",
+        ]
+
+        consumed = self._consumed_bytes()
+        if consumed is not None:
+            size = f" of {format_bytes(self.total_bytes)}" if self.total_bytes else ""
+            parts.append(f"{format_bytes(consumed)}{size} read")
+
+        fraction = self._fraction(consumed)
+        if fraction:
+            remaining = elapsed * (1 - fraction) / fraction
+            parts.append(
+                f"{fraction:.1%} done, ETA {timedelta(seconds=round(remaining))}",
+            )
+        self._write(", ".join(parts))
+
+    def _write(
+        self,
+        message: str,
+    ) -> None:
+        """Write a report line, overwriting the previous one on a terminal."""
+        if self.overwrite:
+            self.stream.write(f"\r\x1b[K{message}")
+        else:
+            self.stream.write(f"{message}\n")
+        self.stream.flush()
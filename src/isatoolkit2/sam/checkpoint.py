@@ -0,0 +1,161 @@
+"""Checkpoint and resume counting integration sites."""
+
+import struct
+import time
+import zlib
+from array import array
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Annotated, Literal
+
+import pysam
+from annotated_types import Ge, Gt, Le
+
+from isatoolkit2.sam.subsample import SUBSAMPLE_SEED
+
+# Default number of seconds between checkpoints
+CHECKPOINT_INTERVAL = 300.0
+
+# Identifies checkpoint files, and their format version
+CHECKPOINT_MAGIC = b"TRACECK2"
+
+# Magic, input size and modification time, subsample fraction and seed,
+# offset, R1 total and number of sites
+CHECKPOINT_HEADER = struct.Struct("<8sQqdQQQQ")
+
+# Integration site keys and counts
+Sites = Iterable[tuple[tuple[str, int, Literal["+", "-"]], int]]
+
+
+class CountCheckpoint:
+
+    """
+    Periodic snapshots of partial integration site counts.
+
+    A snapshot has the position in the input after the last counted read,
+    the R1 total, and the counted sites in the order they were first seen,
+    so a resumed count writes exactly the same output as an uninterrupted
+    one. Sites are stored as compressed columns of reference IDs,
+    positions, strands and counts. The input file size and modification
+    time are stored too, so a snapshot isn't resumed on a different input,
+    and so are the subsample fraction and seed, so a snapshot isn't resumed
+    with a different subsample of the reads.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        infile: Literal["-"] | Path,
+        infile_handle: pysam.AlignmentFile,
+        interval: Annotated[float, Ge(0)] = CHECKPOINT_INTERVAL,
+        *,
+        subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+        seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    ) -> None:
+        """Prepare checkpoints of counting an input file."""
+        if str(infile) == "-" or infile_handle.is_cram:
+            error_msg = "Checkpoints are only supported for SAM and BAM input files."
+            raise ValueError(error_msg)
+
+        self.path = path
+        self.infile_handle = infile_handle
+        self.interval = interval
+        stat = Path(infile).stat()
+        self.fingerprint = (stat.st_size, stat.st_mtime_ns)
+        # The seed only changes the counts of a subsample
+        self.options = (1.0, 0) if subsample is None else (subsample, seed)
+        self.next_save = time.monotonic() + interval
+
+    def restore(self) -> None | tuple[int, Sites]:
+        """
+        Seek the input to the last checkpoint, if there is one.
+
+        Returns the R1 total and the counted sites of the checkpoint.
+        """
+        if not self.path.exists():
+            return None
+
+        data = self.path.read_bytes()
+        magic, size, mtime_ns, fraction, seed, offset, r1_total, num_sites = (
+            CHECKPOINT_HEADER.unpack_from(data)
+        )
+        if magic != CHECKPOINT_MAGIC:
+            error_msg = f"{self.path} is not a sam count checkpoint."
+            raise ValueError(error_msg)
+        if (size, mtime_ns) != self.fingerprint:
+            error_msg = (
+                f"Checkpoint {self.path} was written for a different input file. "
+                "Remove it to start over."
+            )
+            raise ValueError(error_msg)
+        if (fraction, seed) != self.options:
+            error_msg = (
+                f"Checkpoint {self.path} was written with different --subsample "
+                "or --seed options. Resume with the same options, or remove it "
+                "to start over."
+            )
+            raise ValueError(error_msg)
+
+        # Columns of reference IDs, positions, strands and counts
+        columns = zlib.decompress(data[CHECKPOINT_HEADER.size :])
+        tids, positions, counts = array("I"), array("Q"), array("Q")
+        tids_end = num_sites * tids.itemsize
+        positions_end = tids_end + num_sites * positions.itemsize
+        tids.frombytes(columns[:tids_end])
+        positions.frombytes(columns[tids_end:positions_end])
+        strands = columns[positions_end : positions_end + num_sites].decode()
+        counts.frombytes(columns[positions_end + num_sites :])
+
+        self.infile_handle.seek(offset)
+        references = self.infile_handle.references
+        sites = (
+            ((references[tid], position, strand), count)
+            for tid, position, strand, count in zip(
+                tids,
+                positions,
+                strands,
+                counts,
+                strict=True,
+            )
+        )
+        return r1_total, sites  # pyright: ignore[reportReturnType]
+
+    def update(
+        self,
+        r1_total: Annotated[int, Ge(0)],
+        sites: dict[tuple[str, int, Literal["+", "-"]], int],
+    ) -> None:
+        """Save a checkpoint if the interval has passed."""
+        now = time.monotonic()
+        if now >= self.next_save:
+            self.save(r1_total, sites)
+            self.next_save = time.monotonic() + self.interval
+
+    def save(
+        self,
+        r1_total: Annotated[int, Ge(0)],
+        sites: dict[tuple[str, int, Literal["+", "-"]], int],
+    ) -> None:
+        """Save a checkpoint at the current position in the input."""
+        tid_of = {
+            name: tid for tid, name in enumerate(self.infile_handle.references)
+        }
+        columns = (
+            array("I", [tid_of[name] for name, _, _ in sites]).tobytes()
+            + array("Q", [position for _, position, _ in sites]).tobytes()
+            + "".join(strand for _, _, strand in sites).encode()
+            + array("Q", sites.values()).tobytes()
+        )
+        header = CHECKPOINT_HEADER.pack(
+            CHECKPOINT_MAGIC,
+            *self.fingerprint,
+            *self.options,
+            self.infile_handle.tell(),
+            r1_total,
+            len(sites),
+        )
+
+        # Replace the previous checkpoint atomically
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_bytes(header + zlib.compress(columns, 1))
+        tmp_path.replace(self.path)
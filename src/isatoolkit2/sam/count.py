@@ -1,6 +1,7 @@
 """Count integration sites."""
 
 from collections import defaultdict
+from collections.abc import Iterator, Sequence
 from contextlib import ExitStack
 from dataclasses import dataclass, field
 from pathlib import Path
@@ -8,7 +9,22 @@ from typing import Annotated, Literal, TextIO
 
 import click
 import pysam
-from annotated_types import Ge, MinLen
+from annotated_types import Ge, Gt, Le, MinLen
+
+from isatoolkit2.bed.bed_utils import BedLine, Strand
+from isatoolkit2.bed.intervals import ExcludedSites, IntervalIndex, region_index
+from isatoolkit2.memory import MemoryReport, stage
+from isatoolkit2.sam.checkpoint import CHECKPOINT_INTERVAL, CountCheckpoint
+from isatoolkit2.sam.pipeline import read_batches
+from isatoolkit2.sam.sam_utils import alignment_progress, open_alignment_file
+from isatoolkit2.sam.saturation import (
+    SATURATION_POINTS,
+    SaturationCurve,
+    SiteKey,
+)
+from isatoolkit2.sam.shear import ShearSites
+from isatoolkit2.sam.subsample import SUBSAMPLE_SEED, ReadSubsampler, read_subsampler
+from isatoolkit2.sam.umi import UMI_SEPARATOR, UmiCounts
 
 
 @dataclass
@@ -27,49 +43,381 @@ class PositionCounts:
     ] = field(
         default_factory=lambda: defaultdict(int),
     )
+    saturation: None | SaturationCurve = None
+    excluded: ExcludedSites = field(default_factory=ExcludedSites)
+    umis: None | UmiCounts = None
+    shear_sites: None | ShearSites = None
 
+    def exclude(
+        self,
+        exclude: IntervalIndex,
+    ) -> None:
+        """Remove the sites overlapping excluded intervals, counting them."""
+        excluded_sites = [
+            site
+            for site in self.integration_sites
+            if exclude.overlaps(site[0], site[1], site[1] + 1)
+        ]
+        for site in excluded_sites:
+            self.excluded.add(self.integration_sites.pop(site))
+            if self.saturation is not None:
+                self.saturation.first_bucket.pop(site, None)
+            if self.shear_sites is not None:
+                self.shear_sites.sites.pop(site, None)
 
-def count_integration_sites(
-    infile: Literal["-"] | Path,
-    outfile: click.utils.LazyFile | TextIO,
+    def sites(self) -> Iterator[BedLine]:
+        """Return the counted integration sites as BED lines."""
+        for (seqname, start, strand), count in self.integration_sites.items():
+            yield BedLine(
+                seqname=seqname,
+                start=start,
+                end=start,
+                name=".",
+                score=count,
+                strand=Strand(strand),
+            )
+
+
+def _count_batch(
+    batch: list[pysam.AlignedSegment],
+    counts: PositionCounts,
+    saturation: None | SaturationCurve = None,
+) -> None:
+    """Count the integration sites of the R1 reads in a batch."""
+    # R1 reads and their sites, added to the saturation curve, if any
+    counted: list[pysam.AlignedSegment] = []
+    sites: list[None | SiteKey] = []
+    umis = counts.umis
+    shear_sites = counts.shear_sites
+    for read in batch:
+        # Skip unmapped reads and R2 reads
+        if read.is_unmapped or read.is_read2:
+            continue
+        counts.r1_total += 1
+
+        # Get the 5' most position of the R1 read
+        if read.is_reverse:
+            strand = "-"
+            # For reverse reads, the 5' end is the rightmost position,
+            # reference_end - 1
+            # reference_end is one past the last aligned base
+            pos = read.reference_end - 1 if read.reference_end else None
+        else:
+            strand = "+"
+            # For forward reads, the 5' end is the leftmost position,
+            # reference_start
+            pos = read.reference_start if read.reference_start else None
+
+        # Increment the count for this integration site, or add the UMI
+        site = None
+        if pos and read.reference_name:
+            site = (read.reference_name, pos, strand)
+            if umis is None:
+                counts.integration_sites[site] += 1
+            elif not umis.add(site, read):
+                site = None
+        if site is not None and shear_sites is not None:
+            shear_sites.add(site, read)
+        if saturation is not None:
+            counted.append(read)
+            sites.append(site)
+
+    if saturation is not None:
+        saturation.add(counted, sites)
+
+
+def _resume_checkpoint(
+    saver: CountCheckpoint,
+    counts: PositionCounts,
+    *,
+    resume: bool,
+) -> CountCheckpoint:
+    """Restore the counts from the checkpoint, if resuming and there is one."""
+    if resume and (restored := saver.restore()) is not None:
+        counts.r1_total, sites = restored
+        counts.integration_sites.update(sites)
+    return saver
+
+
+def _check_checkpointable(
+    *,
+    saturation: bool,
+    regions: bool,
+    umis: bool,
+    shear_sites: bool,
 ) -> None:
-    """Count integration sites in a SAM/BAM file."""
-    # Open the input and output files
+    """Reject counting options whose state checkpoints don't save."""
+    if saturation:
+        error_msg = "Saturation curves are not supported with checkpoints."
+        raise ValueError(error_msg)
+    if regions:
+        error_msg = "Regions are not supported with checkpoints."
+        raise ValueError(error_msg)
+    if umis:
+        error_msg = "UMI counting is not supported with checkpoints."
+        raise ValueError(error_msg)
+    if shear_sites:
+        error_msg = "Shear site counting is not supported with checkpoints."
+        raise ValueError(error_msg)
+
+
+def _reading_threads(
+    infile: Literal["-"] | Path,
+    threads: Annotated[int, Ge(1)],
+    reference: None | Path,
+    *,
+    checkpoint: None | Path,
+) -> int:
+    """
+    Get the number of htslib threads to read the input with.
+
+    Checkpoints record the offset of the input after the last counted read,
+    but the multithreaded SAM reader of htslib reads ahead of it, so SAM
+    inputs are read on one thread when checkpointing. BAM offsets are exact.
+    """
+    if checkpoint is None or threads == 1 or str(infile) == "-":
+        return threads
+    with open_alignment_file(infile, reference=reference) as probe:
+        return threads if probe.is_bam else 1
+
+
+def _umi_counts(
+    tag: None | str,
+    separator: str,
+    *,
+    from_name: bool,
+) -> None | UmiCounts:
+    """Create the UMI counts, if sites are counted by UMI."""
+    if tag is not None and from_name:
+        error_msg = "UMIs can be read from a tag or from query names, not both."
+        raise ValueError(error_msg)
+    if tag is not None:
+        return UmiCounts(tag=tag)
+    if from_name:
+        return UmiCounts(separator=separator)
+    return None
+
+
+def count_sites(
+    infile: Literal["-"] | Path,
+    threads: Annotated[int, Ge(1)] = 1,
+    reference: None | Path = None,
+    *,
+    progress: bool = False,
+    checkpoint: None | Path = None,
+    resume: bool = False,
+    checkpoint_interval: Annotated[float, Ge(0)] = CHECKPOINT_INTERVAL,
+    subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    saturation_points: None | Annotated[int, Gt(0)] = None,
+    regions: Sequence[str] = (),
+    targets: None | Path = None,
+    exclude: None | Path = None,
+    umi_tag: None | str = None,
+    umi_from_name: bool = False,
+    umi_separator: str = UMI_SEPARATOR,
+    collapse_umis: bool = False,
+    shear_sites: bool = False,
+) -> PositionCounts:
+    """
+    Count integration sites in a SAM/BAM/CRAM file.
+
+    With more than one thread, reads are decoded in a reader thread while
+    they are counted, and htslib uses the threads for decompression.
+    CRAM files are decoded with the reference FASTA, if any.
+    With progress, the reads processed, throughput and an ETA are
+    reported on stderr.
+
+    With a checkpoint path, the partial counts and the position in the
+    input are saved every checkpoint_interval seconds, and at the end of
+    the input. Reads are then read on the calling thread, and SAM inputs
+    without htslib threads, so the position is at the end of the last
+    counted batch. With resume, counting
+    continues from the checkpoint, if there is one.
+
+    With subsample, only that fraction of the reads is counted, chosen by
+    a hash of the query name with the seed.
+
+    With saturation points, a saturation curve of the unique sites at that
+    many depths is counted in the same pass, with the same hash and seed,
+    as if the counted reads were subsampled at each depth.
+
+    With samtools style regions or a targets BED file, only the reads
+    overlapping them are counted, fetched from the index if there is one.
+
+    With an exclude BED file, sites whose position overlaps its intervals
+    are removed after counting, and counted in the excluded sites. Each
+    distinct site is looked up once, by binary search.
+
+    With a UMI tag, or UMIs at the end of query names after the separator,
+    each site is counted as the number of distinct UMIs of its R1 reads,
+    and R1 reads without a valid UMI aren't counted at any site. With
+    collapse_umis, UMIs one base apart are counted once.
+
+    With shear_sites, the distinct shear sites of each site are counted in
+    the same pass, from the mate position and TLEN of the R1 reads.
+    """
+    index = region_index(regions, targets)
+    umis = _umi_counts(umi_tag, umi_separator, from_name=umi_from_name)
+    if checkpoint is not None:
+        _check_checkpointable(
+            saturation=saturation_points is not None,
+            regions=index is not None,
+            umis=umis is not None,
+            shear_sites=shear_sites,
+        )
+
+    exclude_index = region_index(targets=exclude)
+    subsampler = read_subsampler(subsample, seed)
     with ExitStack() as stack:
         infile_handle = stack.enter_context(
-            pysam.AlignmentFile(str(infile)),
+            open_alignment_file(
+                infile,
+                reference=reference,
+                threads=_reading_threads(
+                    infile,
+                    threads,
+                    reference,
+                    checkpoint=checkpoint,
+                ),
+            ),
+        )
+        reporter = (
+            alignment_progress(infile_handle, infile, whole_file=index is None)
+            if progress
+            else None
         )
 
         # Initialize counts
-        counts = PositionCounts()
-
-        # Iterate through each read in the input file
-        for read in infile_handle:
-            # Skip unmapped reads and R2 reads
-            if read.is_unmapped or read.is_read2:
-                continue
-            counts.r1_total += 1
-
-            # Get the 5' most position of the R1 read
-            if read.is_reverse:
-                strand = "-"
-                # For reverse reads, the 5' end is the rightmost position,
-                # reference_end - 1
-                # reference_end is one past the last aligned base
-                pos = read.reference_end - 1 if read.reference_end else None
-            else:
-                strand = "+"
-                # For forward reads, the 5' end is the leftmost position,
-                # reference_start
-                pos = read.reference_start if read.reference_start else None
-
-            # Increment the count for this integration site
-            if pos and read.reference_name:
-                counts.integration_sites[(read.reference_name, pos, strand)] += 1
-
-        # Write the counts to the output file
+        counts = PositionCounts(
+            umis=umis,
+            shear_sites=ShearSites() if shear_sites else None,
+        )
+        if saturation_points is not None:
+            counts.saturation = SaturationCurve(
+                subsampler or ReadSubsampler(1.0, seed),
+                points=saturation_points,
+            )
+
+        saver = (
+            _resume_checkpoint(
+                CountCheckpoint(
+                    checkpoint,
+                    infile,
+                    infile_handle,
+                    interval=checkpoint_interval,
+                    subsample=subsample,
+                    seed=seed,
+                ),
+                counts,
+                resume=resume,
+            )
+            if checkpoint is not None
+            else None
+        )
+
+        # Iterate through each read in the input file, in batches
+        batches = stack.enter_context(
+            read_batches(
+                infile_handle,
+                threaded=threads > 1 and saver is None,
+                progress=reporter,
+                subsampler=subsampler,
+                regions=index,
+            ),
+        )
+        for batch in batches:
+            _count_batch(batch, counts, counts.saturation)
+            if saver is not None:
+                saver.update(counts.r1_total, counts.integration_sites)
+
+        if saver is not None:
+            saver.save(counts.r1_total, counts.integration_sites)
+
+    if umis is not None:
+        counts.integration_sites.update(umis.counts(collapse=collapse_umis))
+
+    if exclude_index is not None:
+        counts.exclude(exclude_index)
+
+    if reporter is not None:
+        reporter.finish()
+    return counts
+
+
+def count_integration_sites(
+    infile: Literal["-"] | Path,
+    outfile: click.utils.LazyFile | TextIO,
+    threads: Annotated[int, Ge(1)] = 1,
+    reference: None | Path = None,
+    *,
+    progress: bool = False,
+    memory: None | MemoryReport = None,
+    checkpoint: None | Path = None,
+    resume: bool = False,
+    checkpoint_interval: Annotated[float, Ge(0)] = CHECKPOINT_INTERVAL,
+    subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    saturation: None | Path = None,
+    saturation_points: Annotated[int, Gt(0)] = SATURATION_POINTS,
+    regions: Sequence[str] = (),
+    targets: None | Path = None,
+    exclude: None | Path = None,
+    umi_tag: None | str = None,
+    umi_from_name: bool = False,
+    umi_separator: str = UMI_SEPARATOR,
+    collapse_umis: bool = False,
+    shear_sites: None | Path = None,
+) -> PositionCounts:
+    """
+    Count integration sites in a SAM/BAM/CRAM file, writing them as BED.
+
+    With a memory report, the memory used to count and write the sites is
+    recorded per stage. The checkpoint, if any, is removed once the sites
+    are written. With a saturation path, the saturation curve is written
+    there as TSV. With a shear sites path, the distinct shear sites of each
+    site are written there as BED, in the same order. Returns the counts,
+    with the sites excluded by the exclude BED file, the UMIs and the shear
+    sites, if any.
+    """
+    with stage(memory, "count"):
+        counts = count_sites(
+            infile,
+            threads=threads,
+            reference=reference,
+            progress=progress,
+            checkpoint=checkpoint,
+            resume=resume,
+            checkpoint_interval=checkpoint_interval,
+            subsample=subsample,
+            seed=seed,
+            saturation_points=saturation_points if saturation is not None else None,
+            regions=regions,
+            targets=targets,
+            exclude=exclude,
+            umi_tag=umi_tag,
+            umi_from_name=umi_from_name,
+            umi_separator=umi_separator,
+            collapse_umis=collapse_umis,
+            shear_sites=shear_sites is not None,
+        )
+
+    # Write the counts to the output file
+    with stage(memory, "write"):
         for coords, count in counts.integration_sites.items():
             seqname, start, strand = coords
             outfile.write(
                 f"{seqname}\t{start}\t{start}\t.\t{count}\t{strand}\n",
             )
+
+    if saturation is not None and counts.saturation is not None:
+        counts.saturation.write(saturation)
+
+    if shear_sites is not None and counts.shear_sites is not None:
+        counts.shear_sites.write(shear_sites, counts.integration_sites)
+
+    if checkpoint is not None:
+        outfile.flush()
+        checkpoint.unlink(missing_ok=True)
+
+    return counts
@@ -0,0 +1,58 @@
+"""Distinct integer values per integration site, stored compactly."""
+
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterator
+
+from isatoolkit2.sam.saturation import SiteKey
+
+# Distinct values of a site kept in a sorted array, before switching to a set
+DISTINCT_ARRAY_SIZE = 1024
+
+# Values of a site: one value, a sorted array of them, or a set of them
+SiteValues = int | array | set[int]
+
+
+def add_distinct(
+    sites: dict[SiteKey, SiteValues],
+    site: SiteKey,
+    value: int,
+    typecode: str = "Q",
+) -> None:
+    """
+    Add a value to the distinct values of a site.
+
+    Most sites have a single value, which is kept as an integer. Sites with
+    more values keep them in a sorted array of the typecode, and only sites
+    with more than DISTINCT_ARRAY_SIZE values switch to a set.
+    """
+    values = sites.get(site)
+    if values is None:
+        sites[site] = value
+    elif isinstance(values, int):
+        if values != value:
+            sites[site] = array(typecode, sorted((values, value)))
+    elif isinstance(values, array):
+        i = bisect_left(values, value)
+        if i == len(values) or values[i] != value:
+            if len(values) < DISTINCT_ARRAY_SIZE:
+                values.insert(i, value)
+            else:
+                sites[site] = {*values, value}
+    else:
+        values.add(value)
+
+
+def distinct_count(
+    values: SiteValues,
+) -> int:
+    """Get the number of distinct values of a site."""
+    return 1 if isinstance(values, int) else len(values)
+
+
+def distinct_counts(
+    sites: dict[SiteKey, SiteValues],
+) -> Iterator[tuple[SiteKey, int]]:
+    """Get the number of distinct values of each site."""
+    for site, values in sites.items():
+        yield site, distinct_count(values)
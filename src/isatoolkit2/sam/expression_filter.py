@@ -0,0 +1,314 @@
+"""Filter reads by a declarative expression, compiled once to a predicate."""
+
+import ast
+import math
+import re
+from collections import Counter
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Annotated, Literal, NoReturn
+
+import pysam
+from annotated_types import Ge, Gt, Le
+
+from isatoolkit2.sam.fiveprime_filter import softclipped_bases
+from isatoolkit2.sam.mates import MATE_BUFFER_SIZE
+from isatoolkit2.sam.read_filter import filter_reads
+from isatoolkit2.sam.sam_utils import ReadDecision, get_output_mode
+from isatoolkit2.sam.subsample import SUBSAMPLE_SEED
+
+# Boolean fields, true if their FLAG bit is set
+FLAG_FIELDS = {
+    "paired": pysam.FPAIRED,
+    "proper_pair": pysam.FPROPER_PAIR,
+    "unmapped": pysam.FUNMAP,
+    "mate_unmapped": pysam.FMUNMAP,
+    "reverse": pysam.FREVERSE,
+    "mate_reverse": pysam.FMREVERSE,
+    "read1": pysam.FREAD1,
+    "read2": pysam.FREAD2,
+    "secondary": pysam.FSECONDARY,
+    "qcfail": pysam.FQCFAIL,
+    "duplicate": pysam.FDUP,
+    "supplementary": pysam.FSUPPLEMENTARY,
+}
+
+# Numeric fields, as Python source over the read and its FLAG,
+# with the cost of evaluating them
+NUMERIC_FIELDS = {
+    "flag": ("flag", 0),
+    "mapq": ("read.mapping_quality", 1),
+    "pos": ("(read.reference_start + 1)", 1),
+    "tlen": ("abs(read.template_length)", 1),
+    "length": ("read.query_length", 1),
+    "nm": ("_tag_value(read, 'NM')", 2),
+    "softclip5": ("_softclip5(read)", 2),
+}
+
+# Cost of checking the presence of a tag
+TAG_COST = 2
+
+# Name of a SAM tag
+TAG_NAME = re.compile(r"[A-Za-z][A-Za-z0-9]")
+
+# Comparison operators, as Python source
+COMPARISONS: dict[type[ast.cmpop], str] = {
+    ast.Lt: "<",
+    ast.LtE: "<=",
+    ast.Gt: ">",
+    ast.GtE: ">=",
+    ast.Eq: "==",
+    ast.NotEq: "!=",
+}
+
+
+def _tag_value(
+    read: pysam.AlignedSegment,
+    tag: str,
+) -> float:
+    """Get a numeric tag, or infinity if the read doesn't have it."""
+    if not read.has_tag(tag):
+        return math.inf
+    return float(read.get_tag(tag))  # pyright: ignore[reportArgumentType]
+
+
+def _softclip5(
+    read: pysam.AlignedSegment,
+) -> int:
+    """Get the number of softclipped bases on the 5' end, 0 without a CIGAR."""
+    return softclipped_bases(read) or 0
+
+
+class ReadExpression:
+
+    """
+    A read filter expression, compiled to a single Python function.
+
+    Expressions combine comparisons of numeric fields (e.g. mapq >= 20),
+    FLAG fields (e.g. proper_pair) and tag presence checks (e.g. tag(XA))
+    with and, or, not and parentheses. The expression is parsed once,
+    checked against this grammar, and compiled to a function that reads
+    the FLAG once and evaluates the cheapest operands first, so FLAG-only
+    checks short-circuit before any tag or CIGAR is decoded.
+
+    Reads that fail are counted by the first failing clause of the top
+    level and, in evaluation order.
+    """
+
+    def __init__(
+        self,
+        expression: str,
+    ) -> None:
+        """Parse, check and compile an expression."""
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode="eval")
+        except SyntaxError as error:
+            error_msg = f"Invalid read expression {expression!r}: {error.msg}"
+            raise ValueError(error_msg) from None
+
+        clauses = _clauses(tree.body)
+        self.clauses = [ast.unparse(clause) for clause in clauses]
+        self.reasons: Counter[str] = Counter()
+
+        # Each clause returns its index if it fails, cheapest clause first
+        lines = ["def check(read):", "    flag = read.flag"]
+        for i in sorted(range(len(clauses)), key=lambda i: _cost(clauses[i])):
+            lines.append(f"    if not {self._source(clauses[i])}:")
+            lines.append(f"        return {i}")
+        lines.append("    return -1")
+
+        namespace: dict[str, object] = {
+            "_tag_value": _tag_value,
+            "_softclip5": _softclip5,
+        }
+        exec(compile("\n".join(lines), "<read expression>", "exec"), namespace)  # noqa: S102
+        self._check: Callable[[pysam.AlignedSegment], int] = namespace["check"]  # pyright: ignore[reportAttributeAccessIssue]
+
+    def __reduce__(self) -> tuple[type["ReadExpression"], tuple[str]]:
+        """Pickle the expression text, to be compiled again in workers."""
+        return ReadExpression, (self.expression,)
+
+    def __call__(
+        self,
+        read: pysam.AlignedSegment,
+    ) -> ReadDecision:
+        """Keep a read if it matches the expression, counting why it doesn't."""
+        failed = self._check(read)
+        if failed < 0:
+            return ReadDecision.KEEP
+        self.reasons[self.clauses[failed]] += 1
+        return ReadDecision.DISCARD
+
+    def _source(
+        self,
+        node: ast.expr,
+    ) -> str:
+        """Get the Python source of a checked node, cheapest operands first."""
+        if isinstance(node, ast.BoolOp):
+            operator = " and " if isinstance(node.op, ast.And) else " or "
+            values = sorted(node.values, key=_cost)
+            return f"({operator.join(self._source(value) for value in values)})"
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return f"(not {self._source(node.operand)})"
+        if isinstance(node, ast.Compare):
+            parts = [self._operand(node.left)]
+            for operator, comparator in zip(node.ops, node.comparators, strict=True):
+                if type(operator) not in COMPARISONS:
+                    self._invalid(node)
+                parts.extend([COMPARISONS[type(operator)], self._operand(comparator)])
+            return f"({' '.join(parts)})"
+        if isinstance(node, ast.Name) and node.id in FLAG_FIELDS:
+            return f"(flag & {FLAG_FIELDS[node.id]})"
+        if isinstance(node, ast.Name) and node.id in NUMERIC_FIELDS:
+            error_msg = (
+                f"Invalid read expression {self.expression!r}: "
+                f"{node.id} must be compared, e.g. {node.id} >= 1"
+            )
+            raise ValueError(error_msg)
+        if isinstance(node, ast.Call):
+            return f"read.has_tag({self._tag_name(node)!r})"
+        return self._invalid(node)
+
+    def _operand(
+        self,
+        node: ast.expr,
+    ) -> str:
+        """Get the Python source of a numeric field or number in a comparison."""
+        if isinstance(node, ast.Name) and node.id in NUMERIC_FIELDS:
+            return NUMERIC_FIELDS[node.id][0]
+        number = (
+            node.operand
+            if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub)
+            else node
+        )
+        if isinstance(number, ast.Constant) and type(number.value) in {int, float}:
+            return ast.unparse(node)
+        return self._invalid(node)
+
+    def _tag_name(
+        self,
+        node: ast.Call,
+    ) -> str:
+        """Get the tag name of a tag(XX) call."""
+        if (
+            isinstance(node.func, ast.Name)
+            and node.func.id == "tag"
+            and len(node.args) == 1
+            and not node.keywords
+            and isinstance(node.args[0], ast.Name)
+            and TAG_NAME.fullmatch(node.args[0].id)
+        ):
+            return node.args[0].id
+        return self._invalid(node)
+
+    def _invalid(
+        self,
+        node: ast.expr,
+    ) -> NoReturn:
+        """Reject a node that isn't part of the expression grammar."""
+        error_msg = (
+            f"Invalid read expression {self.expression!r}: "
+            f"unsupported {ast.unparse(node)!r}"
+        )
+        raise ValueError(error_msg)
+
+
+def _clauses(
+    node: ast.expr,
+) -> list[ast.expr]:
+    """Split an expression into the clauses of its top level and."""
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        return [clause for value in node.values for clause in _clauses(value)]
+    return [node]
+
+
+def _cost(
+    node: ast.expr,
+) -> int:
+    """Get the cost of evaluating a node, the cost of its costliest field."""
+    if isinstance(node, ast.Name):
+        return NUMERIC_FIELDS[node.id][1] if node.id in NUMERIC_FIELDS else 0
+    if isinstance(node, ast.Call):
+        return TAG_COST
+    return max(
+        (
+            _cost(child)
+            for child in ast.iter_child_nodes(node)
+            if isinstance(child, ast.expr)
+        ),
+        default=0,
+    )
+
+
+@dataclass
+class ExpressionCounts:
+
+    """Counts for expression filtering, with the discarded reads by clause."""
+
+    total: int = 0
+    passing: int = 0
+    failed: dict[str, int] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        """Print the counts in a readable format."""
+        lines = [f"Total: {self.total}", f"Passing: {self.passing}"]
+        lines.extend(
+            f"Failed {clause}: {count}" for clause, count in self.failed.items()
+        )
+        return "\n".join(lines) + "\n"
+
+
+def expression_filtering(
+    infile: Literal["-"] | Path,
+    outfile: Literal["-"] | Path,
+    output_format: Literal["sam", "bam", "cram"],
+    expression: str,
+    discarded_outfile: None | Path = None,
+    *,
+    uncompressed: bool = False,
+    workers: Annotated[int, Ge(1)] = 1,
+    threads: Annotated[int, Ge(1)] = 1,
+    reference: None | Path = None,
+    drop_mates: bool = False,
+    mate_buffer_size: Annotated[int, Ge(1)] = MATE_BUFFER_SIZE,
+    progress: bool = False,
+    subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    regions: Sequence[str] = (),
+    targets: None | Path = None,
+) -> ExpressionCounts:
+    """Filter SAM/BAM file, keeping the reads that match an expression."""
+    # Compile the expression before opening any file
+    decide = ReadExpression(expression)
+
+    # Set the output mode based on the output format and compression options
+    output_mode = get_output_mode(
+        output_format,
+        uncompressed=uncompressed,
+    )
+
+    decisions = filter_reads(
+        infile,
+        outfile,
+        output_mode,
+        decide,
+        discarded_outfile=discarded_outfile,
+        workers=workers,
+        threads=threads,
+        reference=reference,
+        drop_mates=drop_mates,
+        mate_buffer_size=mate_buffer_size,
+        progress=progress,
+        subsample=subsample,
+        seed=seed,
+        regions=regions,
+        targets=targets,
+    )
+
+    return ExpressionCounts(
+        total=decisions.total(),
+        passing=decisions[ReadDecision.KEEP],
+        failed={clause: decide.reasons[clause] for clause in decide.clauses},
+    )
@@ -1,13 +1,17 @@
 """Filter R1 reads with too many softclipped bases on the 5' end."""
 
-from contextlib import ExitStack
+from collections.abc import Sequence
+from functools import partial
 from pathlib import Path
 from typing import Annotated, Literal
 
 import pysam
-from annotated_types import Ge, Le
+from annotated_types import Ge, Gt, Le
 
-from isatoolkit2.sam.sam_utils import get_output_mode
+from isatoolkit2.sam.mates import MATE_BUFFER_SIZE
+from isatoolkit2.sam.read_filter import filter_reads
+from isatoolkit2.sam.sam_utils import ReadDecision, get_output_mode
+from isatoolkit2.sam.subsample import SUBSAMPLE_SEED
 
 SOFTCLIP_INDEX = 4
 
@@ -16,24 +20,61 @@ def softclipped_bases(
     read: pysam.AlignedSegment,
 ) -> int | None:
     """Get the number of softclipped bases from the R1 5' end."""
-    if not read.cigartuples:
+    # Only the terminal CIGAR operation at the 5' end is needed,
+    # so the CIGAR tuples are only built once.
+    cigartuples = read.cigartuples
+    if not cigartuples:
         return None
-    if read.is_reverse:
-        if read.cigartuples[-1][0] == SOFTCLIP_INDEX:  # Soft clip at end
-            return read.cigartuples[-1][1]
-    elif read.cigartuples[0][0] == SOFTCLIP_INDEX:  # Soft clip at start
-        return read.cigartuples[0][1]
-    return 0
+    operation, length = (
+        cigartuples[-1] if read.flag & pysam.FREVERSE else cigartuples[0]
+    )
+    return length if operation == SOFTCLIP_INDEX else 0
+
+
+def fiveprime_decision(
+    read: pysam.AlignedSegment,
+    max_softclip: Annotated[int, Ge(1), Le(100)] = 5,
+) -> ReadDecision:
+    """Decide whether a read passes the 5' softclip filter."""
+    # Route reads on the FLAG alone where possible
+    flag = read.flag
+
+    # Keep the read if it's not R1
+    if not flag & pysam.FREAD1:
+        return ReadDecision.KEEP
+
+    # Drop the read if it's not mapped
+    if flag & pysam.FUNMAP:
+        return ReadDecision.DROP
+
+    # If the read is R1, check if there are too many softclipped bases.
+    # Needs to be strand-aware.
+    softclipped = softclipped_bases(read)
+    if softclipped is not None and softclipped <= max_softclip:
+        return ReadDecision.KEEP
+
+    # If the R1 read is mapped and has too many softclipped bases, discard it.
+    return ReadDecision.DISCARD
 
 
 def fiveprime_filter(
     infile: Literal["-"] | Path,
     outfile: Literal["-"] | Path,
-    outfile_format: Literal["sam", "bam"],
+    outfile_format: Literal["sam", "bam", "cram"],
     discarded_outfile: None | Path = None,
     max_softclip: Annotated[int, Ge(1), Le(100)] = 5,
     *,
     uncompressed: bool = False,
+    workers: Annotated[int, Ge(1)] = 1,
+    threads: Annotated[int, Ge(1)] = 1,
+    reference: None | Path = None,
+    drop_mates: bool = False,
+    mate_buffer_size: Annotated[int, Ge(1)] = MATE_BUFFER_SIZE,
+    progress: bool = False,
+    subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    regions: Sequence[str] = (),
+    targets: None | Path = None,
 ) -> None:
     """Filter R1 reads with too many softclipped bases on the 5' end."""
     # Set the output mode based on the output format and compression options
@@ -42,48 +83,20 @@ def fiveprime_filter(
         uncompressed=uncompressed,
     )
 
-    with ExitStack() as stack:
-        infile_handle = stack.enter_context(
-            pysam.AlignmentFile(str(infile)),
-        )
-        outfile_handle = stack.enter_context(
-            pysam.AlignmentFile(
-                str(outfile),
-                mode=output_mode,
-                template=infile_handle,
-            ),
-        )
-        discarded_handle = (
-            stack.enter_context(
-                pysam.AlignmentFile(
-                    str(discarded_outfile),
-                    mode=output_mode,
-                    template=infile_handle,
-                ),
-            )
-            if discarded_outfile is not None
-            else None
-        )
-
-        # Iterate over each read in the input file
-        for read in infile_handle:
-            # Move to the next read if it's not R1
-            if not read.is_read1:
-                outfile_handle.write(read)
-                continue
-
-            # Move onto the next read if it's not mapped
-            if read.is_unmapped:
-                continue
-
-            # If the read is R1, check if there are too many softclipped bases.
-            # Needs to be strand-aware.
-            softclipped = softclipped_bases(read)
-            if softclipped is not None and softclipped <= max_softclip:
-                outfile_handle.write(read)
-                continue
-
-            # If the R1 read is mapped and has too many softclipped bases,
-            # write it to the discard file.
-            if discarded_handle:
-                discarded_handle.write(read)
+    filter_reads(
+        infile,
+        outfile,
+        output_mode,
+        partial(fiveprime_decision, max_softclip=max_softclip),
+        discarded_outfile=discarded_outfile,
+        workers=workers,
+        threads=threads,
+        reference=reference,
+        drop_mates=drop_mates,
+        mate_buffer_size=mate_buffer_size,
+        progress=progress,
+        subsample=subsample,
+        seed=seed,
+        regions=regions,
+        targets=targets,
+    )
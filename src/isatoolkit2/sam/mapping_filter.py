@@ -1,13 +1,18 @@
 """Filter SAM/BAM files based on ALT and SUP filtering options."""
 
-from contextlib import ExitStack
+from collections.abc import Sequence
 from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Literal
+from typing import Annotated, Literal
 
 import pysam
+from annotated_types import Ge, Gt, Le
 
-from isatoolkit2.sam.sam_utils import get_output_mode
+from isatoolkit2.sam.mates import MATE_BUFFER_SIZE
+from isatoolkit2.sam.read_filter import filter_reads
+from isatoolkit2.sam.sam_utils import ReadDecision, get_output_mode
+from isatoolkit2.sam.subsample import SUBSAMPLE_SEED
 
 
 @dataclass
@@ -28,16 +33,40 @@ class AltSupCounts:
         )
 
 
+def alt_sup_decision(
+    read: pysam.AlignedSegment,
+    *,
+    filter_alt: bool = True,
+    filter_sup: bool = True,
+) -> ReadDecision:
+    """Decide whether a read passes ALT and SUP filtering."""
+    if filter_alt and read.has_tag("XA"):
+        return ReadDecision.DISCARD
+    if filter_sup and read.has_tag("SA"):
+        return ReadDecision.DISCARD
+    return ReadDecision.KEEP
+
+
 def alt_sup_filtering(
     infile: Literal["-"] | Path,
     outfile: Literal["-"] | Path,
-    output_format: Literal["sam", "bam"],
+    output_format: Literal["sam", "bam", "cram"],
     discarded_outfile: None | Path = None,
     *,
     filter_alt: bool = True,
     filter_sup: bool = True,
     uncompressed: bool = False,
-) -> None:
+    workers: Annotated[int, Ge(1)] = 1,
+    threads: Annotated[int, Ge(1)] = 1,
+    reference: None | Path = None,
+    drop_mates: bool = False,
+    mate_buffer_size: Annotated[int, Ge(1)] = MATE_BUFFER_SIZE,
+    progress: bool = False,
+    subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    regions: Sequence[str] = (),
+    targets: None | Path = None,
+) -> AltSupCounts:
     """Filter SAM/BAM file based on ALT and SUP filtering options."""
     # Set the output mode based on the output format and compression options
     output_mode = get_output_mode(
@@ -45,43 +74,27 @@ def alt_sup_filtering(
         uncompressed=uncompressed,
     )
 
-    # Open the input and output files
-    counts = AltSupCounts()
-
-    with ExitStack() as stack:
-        infile_handle = stack.enter_context(
-            pysam.AlignmentFile(str(infile)),
-        )
-        outfile_handle = stack.enter_context(
-            pysam.AlignmentFile(str(outfile), mode=output_mode, template=infile_handle),
-        )
-        discarded_handle = (
-            stack.enter_context(
-                pysam.AlignmentFile(
-                    str(discarded_outfile),
-                    mode=output_mode,
-                    template=infile_handle,
-                ),
-            )
-            if discarded_outfile is not None
-            else None
-        )
-
-        # Iterate over each read in the input file
-        for read in infile_handle:
-            counts.total = counts.total + 1
-            # Filter based on ALT and SUP filtering options
-            if filter_alt and read.has_tag("XA"):
-                counts.alt_or_sup = counts.alt_or_sup + 1
-                if discarded_handle:
-                    discarded_handle.write(read)
-                continue
-            if filter_sup and read.has_tag("SA"):
-                counts.alt_or_sup = counts.alt_or_sup + 1
-                if discarded_handle:
-                    discarded_handle.write(read)
-                continue
+    # Filter the reads, writing ALT or SUP reads to the discarded file
+    decisions = filter_reads(
+        infile,
+        outfile,
+        output_mode,
+        partial(alt_sup_decision, filter_alt=filter_alt, filter_sup=filter_sup),
+        discarded_outfile=discarded_outfile,
+        workers=workers,
+        threads=threads,
+        reference=reference,
+        drop_mates=drop_mates,
+        mate_buffer_size=mate_buffer_size,
+        progress=progress,
+        subsample=subsample,
+        seed=seed,
+        regions=regions,
+        targets=targets,
+    )
 
-            # Write the read to the output file
-            counts.passing = counts.passing + 1
-            outfile_handle.write(read)
+    return AltSupCounts(
+        alt_or_sup=decisions[ReadDecision.DISCARD],
+        total=decisions.total(),
+        passing=decisions[ReadDecision.KEEP],
+    )
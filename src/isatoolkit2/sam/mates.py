@@ -0,0 +1,442 @@
+"""Apply read filter decisions to both mates of read pairs."""
+
+import sqlite3
+import tempfile
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from itertools import count, islice
+from pathlib import Path
+from typing import IO, Annotated
+
+import pysam
+from annotated_types import Ge
+
+from isatoolkit2.sam.sam_utils import ReadDecision
+
+# Default number of reads held in memory while waiting for mates
+MATE_BUFFER_SIZE = 100_000
+
+# Decisions of spilled reads are spilled too, as one byte per read
+DECISIONS = list(ReadDecision)
+DECISION_CODES = {decision: bytes([code]) for code, decision in enumerate(DECISIONS)}
+
+# Position of unplaced reads, which are at the end of coordinate sorted input
+UNPLACED = (1 << 31, 0)
+
+Decide = Callable[[pysam.AlignedSegment], ReadDecision]
+
+# A read, its own decision and its pair name if it's the primary record of a mate
+QueuedRead = tuple[pysam.AlignedSegment, ReadDecision, None | str]
+
+
+def pair_name(
+    read: pysam.AlignedSegment,
+) -> None | str:
+    """Get the name of the read pair, if the read is the primary record of a mate."""
+    flag = read.flag
+    if flag & pysam.FPAIRED and not flag & (pysam.FSECONDARY | pysam.FSUPPLEMENTARY):
+        return read.query_name
+    return None
+
+
+@dataclass(slots=True)
+class MatePair:
+
+    """Decisions for the primary records of the two mates of a read pair."""
+
+    decisions: list[None | ReadDecision] = field(default_factory=lambda: [None, None])
+    seen: int = 0
+    emitted: int = 0
+
+    def add(
+        self,
+        read: pysam.AlignedSegment,
+        decision: ReadDecision,
+    ) -> None:
+        """Add the decision for a mate."""
+        self.decisions[1 if read.flag & pysam.FREAD2 else 0] = decision
+        self.seen += 1
+
+    def decide(
+        self,
+        read: pysam.AlignedSegment,
+        decision: ReadDecision,
+    ) -> ReadDecision:
+        """Apply the decision for the other mate to a kept mate."""
+        other = self.decisions[0 if read.flag & pysam.FREAD2 else 1]
+        if decision is ReadDecision.KEEP and other is not None:
+            return other
+        return decision
+
+
+class SpillQueue:
+
+    """
+    First-in first-out queue of reads, their decisions and pair names.
+
+    Up to max_size reads are held in memory, further reads are spilled to
+    temporary BAM files in order and read back as the queue drains. Their
+    decisions are spilled to a file of one byte per read next to each BAM
+    file, so reads are never decided twice, which would count them twice.
+    """
+
+    def __init__(
+        self,
+        header: pysam.AlignmentHeader,
+        spill_dir: Path,
+        max_size: Annotated[int, Ge(1)] = MATE_BUFFER_SIZE,
+    ) -> None:
+        """Initialize an empty queue."""
+        self.header = header
+        self.spill_dir = spill_dir
+        self.max_size = max_size
+        self.memory: deque[QueuedRead] = deque()
+        self.spill_paths: deque[Path] = deque()
+        self.spill_indices = count()
+        self.writer: None | pysam.AlignmentFile = None
+        self.decision_writer: None | IO[bytes] = None
+        self.reader: None | pysam.AlignmentFile = None
+        self.decision_reader: None | IO[bytes] = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        """Get the number of reads in the queue."""
+        return self.size
+
+    def append(
+        self,
+        read: pysam.AlignedSegment,
+        decision: ReadDecision,
+        name: None | str,
+    ) -> None:
+        """Add a read at the end of the queue."""
+        self.size += 1
+
+        # Reads go to disk once the memory is full, or while any reads are
+        # on disk, to keep them in order.
+        if not self.spill_paths and len(self.memory) < self.max_size:
+            self.memory.append((read, decision, name))
+            return
+
+        if self.writer is None or self.decision_writer is None:
+            path = self.spill_dir / f"{next(self.spill_indices)}.bam"
+            self.writer = pysam.AlignmentFile(str(path), "wbu", header=self.header)
+            self.decision_writer = path.with_suffix(".decisions").open("wb")
+            self.spill_paths.append(path)
+        self.writer.write(read)
+        self.decision_writer.write(DECISION_CODES[decision])
+
+    def peek(self) -> QueuedRead:
+        """Get the first read in the queue."""
+        if not self.memory:
+            self._refill()
+        return self.memory[0]
+
+    def popleft(self) -> QueuedRead:
+        """Remove and return the first read in the queue."""
+        if not self.memory:
+            self._refill()
+        self.size -= 1
+        return self.memory.popleft()
+
+    def _refill(self) -> None:
+        """Read the next spilled reads back into memory."""
+        while not self.memory:
+            if self.reader is None or self.decision_reader is None:
+                # Finish the spill file that is being written if it's the oldest
+                if len(self.spill_paths) == 1:
+                    self._close_writers()
+                self.reader = pysam.AlignmentFile(
+                    str(self.spill_paths[0]),
+                    check_sq=False,
+                )
+                self.decision_reader = (
+                    self.spill_paths[0].with_suffix(".decisions").open("rb")
+                )
+
+            reads = list(islice(self.reader, self.max_size))
+            codes = self.decision_reader.read(len(reads))
+            self.memory.extend(
+                (read, DECISIONS[code], pair_name(read))
+                for read, code in zip(reads, codes, strict=True)
+            )
+            if len(reads) < self.max_size:
+                # The spill file is exhausted
+                self._close_readers()
+                path = self.spill_paths.popleft()
+                path.unlink()
+                path.with_suffix(".decisions").unlink()
+
+    def _close_writers(self) -> None:
+        """Close the spill files being written, if any."""
+        if self.writer is not None:
+            self.writer.close()
+        if self.decision_writer is not None:
+            self.decision_writer.close()
+        self.writer = None
+        self.decision_writer = None
+
+    def _close_readers(self) -> None:
+        """Close the spill files being read, if any."""
+        if self.reader is not None:
+            self.reader.close()
+        if self.decision_reader is not None:
+            self.decision_reader.close()
+        self.reader = None
+        self.decision_reader = None
+
+    def close(self) -> None:
+        """Close any open spill files."""
+        self._close_writers()
+        self._close_readers()
+
+
+class PendingPairs:
+
+    """
+    Read pairs with a primary record in the queue, by pair name.
+
+    In coordinate sorted input, a mate follows at the position of the mate
+    fields, so a read stops waiting for its mate once the input is past that
+    position, and doesn't wait for a mate that is unmapped and unplaced.
+    Up to max_size pairs are held in memory, the pairs that have waited
+    longest are spilled to a temporary SQLite database beyond that, like
+    the reads of the queue, and read back when they are needed, so memory
+    stays bounded without leaving any mate undecided.
+    """
+
+    def __init__(
+        self,
+        spill_dir: Path,
+        max_size: Annotated[int, Ge(1)] = MATE_BUFFER_SIZE,
+        *,
+        coordinate_sorted: bool = False,
+    ) -> None:
+        """Initialize without pairs."""
+        self.spill_dir = spill_dir
+        self.max_size = max_size
+        self.coordinate_sorted = coordinate_sorted
+        self.pairs: OrderedDict[str, MatePair] = OrderedDict()
+        self.database: None | sqlite3.Connection = None
+        self.spilled = 0
+        self.position = (-1, -1)
+
+    def __len__(self) -> int:
+        """Get the number of pairs, in memory and spilled."""
+        return len(self.pairs) + self.spilled
+
+    def add(
+        self,
+        read: pysam.AlignedSegment,
+        decision: ReadDecision,
+    ) -> None | str:
+        """Add the next read of the input, returning its pair name if it's a mate."""
+        reference_id = read.reference_id
+        self.position = (
+            (reference_id, read.reference_start) if reference_id >= 0 else UNPLACED
+        )
+        name = pair_name(read)
+        if name is None:
+            return None
+
+        pair = self._get(name)
+        if pair is None:
+            pair = MatePair()
+            self._put(name, pair)
+        pair.add(read, decision)
+        return name
+
+    def release(
+        self,
+        read: pysam.AlignedSegment,
+        decision: ReadDecision,
+        name: str,
+        *,
+        final: bool = False,
+    ) -> None | ReadDecision:
+        """
+        Get the decision of a mate at the start of the queue, once it is final.
+
+        Returns None while the other mate may still follow in the input.
+        """
+        pair = self._get(name)
+        if pair is None:
+            error_msg = f"No pending pair for the queued read {name}"
+            raise RuntimeError(error_msg)
+        if pair.seen < 2 and not final and self._mate_may_follow(read):  # noqa: PLR2004
+            return None
+
+        decision = pair.decide(read, decision)
+        pair.emitted += 1
+        if pair.emitted >= pair.seen:
+            del self.pairs[name]
+        return decision
+
+    def close(self) -> None:
+        """Close the spilled pairs database, if any."""
+        if self.database is not None:
+            self.database.close()
+            self.database = None
+
+    def _mate_may_follow(
+        self,
+        read: pysam.AlignedSegment,
+    ) -> bool:
+        """Check if the mate of a read may still follow in the input."""
+        if not self.coordinate_sorted:
+            return True
+        if read.next_reference_id < 0:
+            # Other mates without a position may be anywhere
+            return not read.flag & pysam.FMUNMAP
+        return self.position <= (read.next_reference_id, read.next_reference_start)
+
+    def _get(
+        self,
+        name: str,
+    ) -> None | MatePair:
+        """Get a pair, moving it back into memory if it was spilled."""
+        pair = self.pairs.get(name)
+        if pair is None and self.database is not None and self.spilled:
+            row = self.database.execute(
+                "SELECT first, second, seen, emitted FROM pairs WHERE name = ?",
+                (name,),
+            ).fetchone()
+            if row is not None:
+                self.database.execute("DELETE FROM pairs WHERE name = ?", (name,))
+                self.spilled -= 1
+                first, second, seen, emitted = row
+                pair = MatePair(
+                    decisions=[
+                        None if code is None else DECISIONS[code]
+                        for code in (first, second)
+                    ],
+                    seen=seen,
+                    emitted=emitted,
+                )
+                self._put(name, pair)
+        return pair
+
+    def _put(
+        self,
+        name: str,
+        pair: MatePair,
+    ) -> None:
+        """Add a pair to memory, spilling the oldest pair if memory is full."""
+        if len(self.pairs) >= self.max_size:
+            self._spill(*self.pairs.popitem(last=False))
+        self.pairs[name] = pair
+
+    def _spill(
+        self,
+        name: str,
+        pair: MatePair,
+    ) -> None:
+        """Write a pair to the spilled pairs database."""
+        if self.database is None:
+            # The database is temporary, so it doesn't need to survive crashes
+            self.database = sqlite3.connect(self.spill_dir / "pairs.sqlite")
+            self.database.execute("PRAGMA journal_mode = OFF")
+            self.database.execute("PRAGMA synchronous = OFF")
+            self.database.execute(
+                "CREATE TABLE pairs (name TEXT PRIMARY KEY, first INTEGER, "
+                "second INTEGER, seen INTEGER, emitted INTEGER) WITHOUT ROWID",
+            )
+        self.database.execute(
+            "INSERT INTO pairs VALUES (?, ?, ?, ?, ?)",
+            (
+                name,
+                *(
+                    None if decision is None else DECISIONS.index(decision)
+                    for decision in pair.decisions
+                ),
+                pair.seen,
+                pair.emitted,
+            ),
+        )
+        self.spilled += 1
+
+
+def is_coordinate_sorted(
+    header: pysam.AlignmentHeader,
+) -> bool:
+    """Check if the header marks the input as coordinate sorted."""
+    return header.to_dict().get("HD", {}).get("SO") == "coordinate"
+
+
+def decide_mates(
+    reads: Iterable[pysam.AlignedSegment],
+    decide: Decide,
+    header: pysam.AlignmentHeader,
+    *,
+    buffer_size: Annotated[int, Ge(1)] = MATE_BUFFER_SIZE,
+) -> Iterator[tuple[pysam.AlignedSegment, ReadDecision]]:
+    """
+    Decide reads so that both mates of a read pair get the same decision.
+
+    A mate that would be kept gets the decision of its discarded or dropped
+    mate. Reads are returned in input order, so primary records wait in a
+    queue until their mate is seen. The queue holds buffer_size reads in
+    memory and spills the rest to disk, so mates can be far apart in
+    coordinate sorted input. Secondary and supplementary records are decided
+    on their own, and mates missing from the input don't hold their mate.
+    Each read is decided once. The pairs waiting for a mate are held in
+    memory and spilled to disk like the reads, see PendingPairs.
+    """
+    ready: list[tuple[pysam.AlignedSegment, ReadDecision]] = []
+    with tempfile.TemporaryDirectory() as spill_dir:
+        queue = SpillQueue(header, Path(spill_dir), buffer_size)
+        pending = PendingPairs(
+            Path(spill_dir),
+            buffer_size,
+            coordinate_sorted=is_coordinate_sorted(header),
+        )
+        try:
+            # The pair name of the read at the start of the queue waiting for
+            # its mate, reads can only be emitted once it is seen or, in
+            # coordinate sorted input, can no longer be seen.
+            blocking_name = None
+            for read in reads:
+                decision = decide(read)
+                name = pending.add(read, decision)
+                queue.append(read, decision, name)
+
+                if (
+                    blocking_name is None
+                    or name == blocking_name
+                    or pending.coordinate_sorted
+                ):
+                    blocking_name = _emit_ready(queue, pending, ready)
+                    yield from ready
+                    ready.clear()
+
+            # Mates that are still waiting are missing from the input
+            _emit_ready(queue, pending, ready, final=True)
+            yield from ready
+        finally:
+            queue.close()
+            pending.close()
+
+
+def _emit_ready(
+    queue: SpillQueue,
+    pending: PendingPairs,
+    ready: list[tuple[pysam.AlignedSegment, ReadDecision]],
+    *,
+    final: bool = False,
+) -> None | str:
+    """
+    Move reads from the start of the queue while their decisions are final.
+
+    Returns the pair name of the read waiting for its mate, if any.
+    """
+    while queue:
+        read, decision, name = queue.peek()
+        if name is not None:
+            released = pending.release(read, decision, name, final=final)
+            if released is None:
+                return name
+            decision = released
+        queue.popleft()
+        ready.append((read, decision))
+    return None
@@ -0,0 +1,225 @@
+"""Staged pipeline of threads for reading and writing SAM/BAM records."""
+
+import queue
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from itertools import islice
+from types import TracebackType
+from typing import Annotated, Any, Self
+
+import pysam
+from annotated_types import Ge
+
+from isatoolkit2.bed.intervals import IntervalIndex
+from isatoolkit2.progress import ProgressReporter
+from isatoolkit2.sam.sam_utils import region_reads
+from isatoolkit2.sam.subsample import ReadSubsampler
+
+# Number of records passed between stages at a time
+BATCH_SIZE = 1000
+
+# Number of batches each queue holds before the producing stage blocks
+QUEUE_SIZE = 4
+
+# How often (in seconds) a blocked stage checks if the pipeline was stopped
+POLL_INTERVAL = 0.1
+
+# Marks the end of the batches in a queue
+_END = object()
+
+
+def _put(
+    batches: queue.Queue[Any],
+    item: object,
+    stop: threading.Event,
+) -> bool:
+    """Put an item on a bounded queue, giving up if the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=POLL_INTERVAL)
+        except queue.Full:
+            continue
+        return True
+    return False
+
+
+def _read(
+    infile_handle: pysam.AlignmentFile,
+    batch_size: Annotated[int, Ge(1)],
+    progress: None | ProgressReporter,
+    subsampler: None | ReadSubsampler = None,
+    regions: None | IntervalIndex = None,
+) -> Iterator[list[pysam.AlignedSegment]]:
+    """
+    Read batches of records, updating the progress after each batch.
+
+    With regions, only the records overlapping them are read. With a
+    subsampler, only the records in the subsample are passed on, so the
+    other records skip all further processing.
+    """
+    records = (
+        region_reads(infile_handle, regions) if regions is not None else infile_handle
+    )
+    while batch := list(islice(records, batch_size)):
+        if progress is not None:
+            progress.update(len(batch))
+        yield subsampler.sample(batch) if subsampler is not None else batch
+
+
+def _reader(
+    batches_read: Iterator[list[pysam.AlignedSegment]],
+    batches: queue.Queue[Any],
+    stop: threading.Event,
+    errors: list[BaseException],
+) -> None:
+    """Put batches of records on the queue, then the end marker."""
+    try:
+        for batch in batches_read:
+            if not _put(batches, batch, stop):
+                return
+    except BaseException as e:  # noqa: BLE001
+        errors.append(e)
+    _put(batches, _END, stop)
+
+
+@contextmanager
+def read_batches(
+    infile_handle: pysam.AlignmentFile,
+    batch_size: Annotated[int, Ge(1)] = BATCH_SIZE,
+    *,
+    threaded: bool = True,
+    progress: None | ProgressReporter = None,
+    subsampler: None | ReadSubsampler = None,
+    regions: None | IntervalIndex = None,
+) -> Iterator[Iterator[list[pysam.AlignedSegment]]]:
+    """
+    Read batches of records in a reader thread.
+
+    Decoding and decompression in htslib release the GIL, so they overlap
+    with processing the previous batches. The queue is bounded, so the
+    reader only runs a few batches ahead of the processing stage.
+    Without threading, the batches are read on the calling thread.
+    The progress is updated by the thread that reads the input, so it can
+    safely read the position in the input.
+    With regions and a subsampler, batches only have the records in the
+    regions and the subsample.
+    """
+    batches_read = _read(infile_handle, batch_size, progress, subsampler, regions)
+    if not threaded:
+        yield batches_read
+        return
+
+    batches: queue.Queue[Any] = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    errors: list[BaseException] = []
+
+    def iterate() -> Iterator[list[pysam.AlignedSegment]]:
+        while (batch := batches.get()) is not _END:
+            yield batch
+        if errors:
+            raise errors[0]
+
+    thread = threading.Thread(
+        target=_reader,
+        args=(batches_read, batches, stop, errors),
+        name="sam-reader",
+        daemon=True,
+    )
+    thread.start()
+    try:
+        yield iterate()
+    finally:
+        # Unblock the reader if processing stopped early
+        stop.set()
+        thread.join()
+
+
+class BatchWriter:
+
+    """
+    Write batches of records to an output file in a writer thread.
+
+    Encoding and compression in htslib release the GIL, so they overlap
+    with processing the next batches. Writing blocks when the queue is full.
+    Without threading, the batches are written on the calling thread.
+    """
+
+    def __init__(
+        self,
+        outfile_handle: pysam.AlignmentFile,
+        *,
+        threaded: bool = True,
+    ) -> None:
+        """Start the writer thread for an open output file."""
+        self.outfile_handle = outfile_handle
+        self.batches: queue.Queue[Any] = queue.Queue(maxsize=QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.errors: list[BaseException] = []
+        self.thread = (
+            threading.Thread(target=self._writer, name="sam-writer", daemon=True)
+            if threaded
+            else None
+        )
+        if self.thread:
+            self.thread.start()
+
+    def _writer(self) -> None:
+        """Write batches from the queue until the end of the batches."""
+        while True:
+            try:
+                batch = self.batches.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return
+                continue
+            if batch is _END:
+                return
+            try:
+                for read in batch:
+                    self.outfile_handle.write(read)
+            except BaseException as e:  # noqa: BLE001
+                self.errors.append(e)
+                self.stop.set()
+                return
+
+    def _raise_error(self) -> None:
+        """Raise the error of the writer thread, if any."""
+        if self.errors:
+            raise self.errors[0]
+
+    def write(
+        self,
+        batch: list[pysam.AlignedSegment],
+    ) -> None:
+        """Queue a batch of records to be written."""
+        if self.thread is None:
+            for read in batch:
+                self.outfile_handle.write(read)
+        elif batch and not _put(self.batches, batch, self.stop):
+            self._raise_error()
+
+    def close(self) -> None:
+        """Wait for all queued batches to be written."""
+        if self.thread is None:
+            return
+        _put(self.batches, _END, self.stop)
+        self.thread.join()
+        self._raise_error()
+
+    def __enter__(self) -> Self:
+        """Return the writer."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: None | type[BaseException],
+        exc_value: None | BaseException,
+        traceback: None | TracebackType,
+    ) -> None:
+        """Finish writing, or stop the writer thread if processing failed."""
+        if exc_type is None:
+            self.close()
+        elif self.thread:
+            self.stop.set()
+            self.thread.join()
@@ -0,0 +1,538 @@
+"""Run per-read filters over SAM/BAM files, serially or with worker processes."""
+
+import sys
+import tempfile
+from collections import Counter, deque
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from itertools import count, islice
+from pathlib import Path
+from typing import IO, Annotated, Any, Literal, Protocol, runtime_checkable
+
+import pysam
+from annotated_types import Ge, Gt, Le
+
+from isatoolkit2.bed.intervals import region_index
+from isatoolkit2.bgzf import BGZF_EOF
+from isatoolkit2.sam.mates import MATE_BUFFER_SIZE, decide_mates
+from isatoolkit2.sam.pipeline import BATCH_SIZE as PIPELINE_BATCH_SIZE
+from isatoolkit2.sam.pipeline import BatchWriter, read_batches
+from isatoolkit2.sam.sam_utils import (
+    OutputMode,
+    ReadDecision,
+    alignment_progress,
+    open_alignment_file,
+)
+from isatoolkit2.sam.subsample import SUBSAMPLE_SEED, read_subsampler
+
+# Number of reads sent to a worker at a time
+BATCH_SIZE = 20000
+
+# Per-process state of the workers, set by the pool initializer
+_worker_state: dict[str, Any] = {}
+
+
+@runtime_checkable
+class CountingDecision(Protocol):
+
+    """A decision function that counts the reasons it discards reads for."""
+
+    reasons: Counter[str]
+
+    def __call__(
+        self,
+        read: pysam.AlignedSegment,
+    ) -> ReadDecision:
+        """Decide what to do with a read."""
+        ...
+
+
+def filter_reads(
+    infile: Literal["-"] | Path,
+    outfile: Literal["-"] | Path,
+    output_mode: OutputMode,
+    decide: Callable[[pysam.AlignedSegment], ReadDecision],
+    *,
+    discarded_outfile: None | Path = None,
+    workers: Annotated[int, Ge(1)] = 1,
+    threads: Annotated[int, Ge(1)] = 1,
+    reference: None | Path = None,
+    drop_mates: bool = False,
+    mate_buffer_size: Annotated[int, Ge(1)] = MATE_BUFFER_SIZE,
+    progress: bool = False,
+    subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    regions: Sequence[str] = (),
+    targets: None | Path = None,
+) -> Counter[ReadDecision]:
+    """
+    Write each read to the output or discarded output based on a decision.
+
+    With drop_mates, both mates of a read pair get the same decision, so a
+    discarded or dropped mate doesn't leave an orphan mate in the output.
+
+    With more than one thread, reading, deciding and writing run as stages
+    of a pipeline, and htslib uses the threads for (de)compression.
+    With more than one worker, batches of reads are filtered in worker
+    processes, and the output is the same as with a single worker.
+    The decision function must be picklable in that case.
+    CRAM files are decoded and encoded with the reference FASTA, if any.
+    With progress, the reads processed, throughput and an ETA are
+    reported on stderr.
+    With subsample, only that fraction of the read pairs is decided,
+    chosen by a hash of the query name with the seed, and the other reads
+    are written to neither output.
+    With samtools style regions or a targets BED file, only the reads
+    overlapping them are filtered, fetched from the index if there is one,
+    and the other reads are written to neither output.
+    Decision functions that count their reasons, see CountingDecision,
+    have the reasons counted in workers added to theirs.
+    """
+    if workers > 1 and drop_mates:
+        error_msg = "Dropping mates is not supported with worker processes."
+        raise ValueError(error_msg)
+
+    if workers > 1:
+        return parallel_filter_reads(
+            infile,
+            outfile,
+            output_mode,
+            decide,
+            discarded_outfile=discarded_outfile,
+            workers=workers,
+            reference=reference,
+            progress=progress,
+            subsample=subsample,
+            seed=seed,
+            regions=regions,
+            targets=targets,
+        )
+
+    index = region_index(regions, targets)
+    subsampler = read_subsampler(subsample, seed)
+    counts: Counter[ReadDecision] = Counter()
+    with ExitStack() as stack:
+        infile_handle = stack.enter_context(
+            open_alignment_file(infile, reference=reference, threads=threads),
+        )
+        reporter = (
+            alignment_progress(infile_handle, infile, whole_file=index is None)
+            if progress
+            else None
+        )
+        outfile_handle = stack.enter_context(
+            open_alignment_file(
+                outfile,
+                output_mode,
+                reference=reference,
+                template=infile_handle,
+                threads=threads,
+            ),
+        )
+        discarded_handle = (
+            stack.enter_context(
+                open_alignment_file(
+                    discarded_outfile,
+                    output_mode,
+                    reference=reference,
+                    template=infile_handle,
+                    threads=threads,
+                ),
+            )
+            if discarded_outfile is not None
+            else None
+        )
+
+        # Reading, deciding and writing run in separate threads, connected by
+        # bounded queues of batches of reads
+        threaded = threads > 1
+        kept_writer = stack.enter_context(
+            BatchWriter(outfile_handle, threaded=threaded),
+        )
+        discarded_writer = (
+            stack.enter_context(BatchWriter(discarded_handle, threaded=threaded))
+            if discarded_handle
+            else None
+        )
+        batches = stack.enter_context(
+            read_batches(
+                infile_handle,
+                threaded=threaded,
+                progress=reporter,
+                subsampler=subsampler,
+                regions=index,
+            ),
+        )
+
+        # Decide each read on its own, or both mates of read pairs together
+        reads = (read for batch in batches for read in batch)
+        decided = (
+            decide_mates(
+                reads,
+                decide,
+                infile_handle.header,
+                buffer_size=mate_buffer_size,
+            )
+            if drop_mates
+            else ((read, decide(read)) for read in reads)
+        )
+
+        # Iterate over each read in the input file
+        while decided_batch := list(islice(decided, PIPELINE_BATCH_SIZE)):
+            kept: list[pysam.AlignedSegment] = []
+            discarded: list[pysam.AlignedSegment] = []
+            for read, decision in decided_batch:
+                counts[decision] += 1
+                if decision is ReadDecision.KEEP:
+                    kept.append(read)
+                elif decision is ReadDecision.DISCARD:
+                    discarded.append(read)
+            kept_writer.write(kept)
+            if discarded_writer:
+                discarded_writer.write(discarded)
+
+    if reporter is not None:
+        reporter.finish()
+    return counts
+
+
+@dataclass
+class FilteredBatch:
+
+    """Output parts of a batch of reads filtered by a worker."""
+
+    kept_part: Path
+    discarded_part: None | Path
+    counts: Counter[ReadDecision]
+    reasons: Counter[str]
+
+
+def _init_worker(
+    header_text: str,
+    decide: Callable[[pysam.AlignedSegment], ReadDecision],
+    output_mode: OutputMode,
+    part_dir: Path,
+) -> None:
+    """Set up the state of a worker process."""
+    _worker_state["header"] = pysam.AlignmentHeader.from_text(header_text)
+    _worker_state["decide"] = decide
+    _worker_state["output_mode"] = output_mode
+    _worker_state["part_dir"] = part_dir
+
+
+def _open_part(
+    path: Path,
+    stack: ExitStack,
+) -> Callable[[pysam.AlignedSegment], object]:
+    """Open an output part, returning a function that writes a read to it."""
+    output_mode = _worker_state["output_mode"]
+
+    # SAM parts are the read lines without a header
+    if output_mode == "w":
+        handle = stack.enter_context(path.open("w"))
+        return lambda read: handle.write(f"{read.to_string()}\n")
+
+    # BAM parts are complete BAM files, the header and EOF blocks are
+    # stripped when the parts are concatenated.
+    bam_handle = stack.enter_context(
+        pysam.AlignmentFile(
+            str(path),
+            mode=output_mode,
+            header=_worker_state["header"],
+        ),
+    )
+    return bam_handle.write
+
+
+def _filter_batch(
+    index: int,
+    input_part: Path,
+    *,
+    write_discarded: bool,
+) -> FilteredBatch:
+    """Filter a batch of reads from an input part in a worker process."""
+    decide = _worker_state["decide"]
+    part_dir = _worker_state["part_dir"]
+
+    batch = FilteredBatch(
+        kept_part=part_dir / f"{index}.kept",
+        discarded_part=part_dir / f"{index}.discarded" if write_discarded else None,
+        counts=Counter(),
+        reasons=Counter(),
+    )
+    # Reasons are counted per batch, and added up in the parent process
+    counting = isinstance(decide, CountingDecision)
+    if counting:
+        decide.reasons.clear()
+
+    with ExitStack() as stack:
+        reads = stack.enter_context(
+            pysam.AlignmentFile(str(input_part), check_sq=False),
+        )
+        write_kept = _open_part(batch.kept_part, stack)
+        write_discarded_read = (
+            _open_part(batch.discarded_part, stack) if batch.discarded_part else None
+        )
+
+        for read in reads:
+            decision = decide(read)
+            batch.counts[decision] += 1
+            if decision is ReadDecision.KEEP:
+                write_kept(read)
+            elif decision is ReadDecision.DISCARD and write_discarded_read:
+                write_discarded_read(read)
+    input_part.unlink()
+
+    if counting:
+        batch.reasons.update(decide.reasons)
+    return batch
+
+
+def _header_bytes(
+    infile_handle: pysam.AlignmentFile,
+    output_mode: OutputMode,
+    part_dir: Path,
+) -> bytes:
+    """Get the bytes of the output header, without the BGZF EOF block."""
+    if output_mode == "w":
+        return str(infile_handle.header).encode()
+
+    # htslib flushes the BAM header into its own BGZF blocks, so the header
+    # of a header-only BAM file is a prefix of every part.
+    header_path = part_dir / "header"
+    with pysam.AlignmentFile(
+        str(header_path),
+        mode=output_mode,
+        template=infile_handle,
+    ):
+        pass
+    data = header_path.read_bytes()
+    header_path.unlink()
+    return data.removesuffix(BGZF_EOF)
+
+
+def _open_binary_output(
+    path: Literal["-"] | Path,
+    stack: ExitStack,
+) -> IO[bytes]:
+    """Open a binary output file or stdout."""
+    if str(path) == "-":
+        return sys.stdout.buffer
+    return stack.enter_context(Path(path).open("wb"))
+
+
+class ConcatenatedOutput:
+
+    """An output file that the parts written by workers are appended to."""
+
+    def __init__(
+        self,
+        handle: IO[bytes],
+        header: bytes,
+        output_mode: OutputMode,
+    ) -> None:
+        """Write the header to the output handle."""
+        self.handle = handle
+        self.header = header
+        self.output_mode = output_mode
+        self.handle.write(header)
+
+    def append(
+        self,
+        part: None | Path,
+    ) -> None:
+        """Append the records of an output part, copying BGZF blocks as-is."""
+        if part is None:
+            return
+
+        # BAM parts start with the header blocks and end with the EOF block
+        is_bgzf = self.output_mode != "w"
+        with part.open("rb") as part_handle:
+            if is_bgzf and part_handle.read(len(self.header)) != self.header:
+                error_msg = f"Unexpected header in output part {part}"
+                raise RuntimeError(error_msg)
+
+            # Copy everything up to the EOF block, without recompressing
+            end = part.stat().st_size - (len(BGZF_EOF) if is_bgzf else 0)
+            remaining = end - part_handle.tell()
+            while remaining > 0:
+                chunk = part_handle.read(min(remaining, 1 << 20))
+                self.handle.write(chunk)
+                remaining -= len(chunk)
+        part.unlink()
+
+    def close(self) -> None:
+        """Write the BGZF EOF block for BAM outputs."""
+        if self.output_mode != "w":
+            self.handle.write(BGZF_EOF)
+        self.handle.flush()
+
+
+class OrderedBatches:
+
+    """
+    Batches of reads filtered by workers, collected in submission order.
+
+    Reads are sent to the workers as uncompressed BAM input parts, so they
+    are neither formatted nor parsed as text, and keep their tag types.
+    """
+
+    def __init__(
+        self,
+        executor: ProcessPoolExecutor,
+        outputs: list[ConcatenatedOutput],
+        max_pending: Annotated[int, Ge(1)],
+        header: pysam.AlignmentHeader,
+        part_dir: Path,
+    ) -> None:
+        """Initialize with the outputs for kept and (optionally) discarded reads."""
+        self.executor = executor
+        self.outputs = outputs
+        self.max_pending = max_pending
+        self.header = header
+        self.part_dir = part_dir
+        self.pending: deque[Future[FilteredBatch]] = deque()
+        self.batch_indices = count()
+        self.counts: Counter[ReadDecision] = Counter()
+        self.reasons: Counter[str] = Counter()
+        self.input_part: None | tuple[int, Path, pysam.AlignmentFile] = None
+        self.input_size = 0
+
+    def add(
+        self,
+        read: pysam.AlignedSegment,
+    ) -> None:
+        """Add a read to the current input part, submitting it once it's full."""
+        if self.input_part is None:
+            index = next(self.batch_indices)
+            path = self.part_dir / f"{index}.input"
+            handle = pysam.AlignmentFile(str(path), mode="wbu", header=self.header)
+            self.input_part = (index, path, handle)
+        self.input_part[2].write(read)
+        self.input_size += 1
+        if self.input_size == BATCH_SIZE:
+            self.submit()
+
+    def submit(self) -> None:
+        """Submit the current input part, collecting batches to bound memory."""
+        if self.input_part is None:
+            return
+        index, path, handle = self.input_part
+        handle.close()
+        self.input_part = None
+        self.input_size = 0
+
+        self.pending.append(
+            self.executor.submit(
+                _filter_batch,
+                index,
+                path,
+                write_discarded=len(self.outputs) > 1,
+            ),
+        )
+        while len(self.pending) > self.max_pending:
+            self.collect()
+
+    def collect(self) -> None:
+        """Wait for the oldest batch and append its parts to the outputs."""
+        batch = self.pending.popleft().result()
+        self.counts.update(batch.counts)
+        self.reasons.update(batch.reasons)
+        self.outputs[0].append(batch.kept_part)
+        if len(self.outputs) > 1:
+            self.outputs[1].append(batch.discarded_part)
+
+    def finish(self) -> None:
+        """Submit the last input part, collect all batches and close the outputs."""
+        self.submit()
+        while self.pending:
+            self.collect()
+        for output in self.outputs:
+            output.close()
+
+
+def parallel_filter_reads(
+    infile: Literal["-"] | Path,
+    outfile: Literal["-"] | Path,
+    output_mode: OutputMode,
+    decide: Callable[[pysam.AlignedSegment], ReadDecision],
+    *,
+    discarded_outfile: None | Path = None,
+    workers: Annotated[int, Ge(1)] = 2,
+    reference: None | Path = None,
+    progress: bool = False,
+    subsample: None | Annotated[float, Gt(0), Le(1)] = None,
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    regions: Sequence[str] = (),
+    targets: None | Path = None,
+) -> Counter[ReadDecision]:
+    """
+    Filter reads in batches with worker processes.
+
+    Workers compress their own output parts, which are concatenated in input
+    order at the BGZF block level, so the output matches the serial filter.
+    CRAM inputs are supported, but CRAM outputs are not, since CRAM
+    containers can't be concatenated like BGZF blocks.
+    """
+    if output_mode == "wc":
+        error_msg = "Worker processes are not supported for CRAM output."
+        raise ValueError(error_msg)
+
+    index = region_index(regions, targets)
+
+    with ExitStack() as stack:
+        part_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        infile_handle = stack.enter_context(
+            open_alignment_file(infile, reference=reference),
+        )
+        reporter = (
+            alignment_progress(infile_handle, infile, whole_file=index is None)
+            if progress
+            else None
+        )
+
+        # Write the headers of the outputs
+        header = _header_bytes(infile_handle, output_mode, part_dir)
+        outputs = [
+            ConcatenatedOutput(_open_binary_output(path, stack), header, output_mode)
+            for path in (outfile, discarded_outfile)
+            if path is not None
+        ]
+
+        executor = stack.enter_context(
+            ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(str(infile_handle.header), decide, output_mode, part_dir),
+            ),
+        )
+        batches = OrderedBatches(
+            executor,
+            outputs,
+            max_pending=workers * 2,
+            header=infile_handle.header,
+            part_dir=part_dir,
+        )
+
+        # Send the reads in the subsample to the workers in batches
+        input_batches = stack.enter_context(
+            read_batches(
+                infile_handle,
+                threaded=False,
+                progress=reporter,
+                subsampler=read_subsampler(subsample, seed),
+                regions=index,
+            ),
+        )
+        for input_batch in input_batches:
+            for read in input_batch:
+                batches.add(read)
+        batches.finish()
+
+    if isinstance(decide, CountingDecision):
+        decide.reasons.update(batches.reasons)
+    if reporter is not None:
+        reporter.finish()
+    return batches.counts
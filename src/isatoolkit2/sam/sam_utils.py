@@ -1,12 +1,224 @@
-"""SAM utilities for handling SAM/BAM files."""
+"""SAM utilities for handling SAM/BAM/CRAM files."""
 
-from typing import Literal
+import hashlib
+import os
+from collections.abc import Iterator
+from enum import Enum
+from pathlib import Path
+from typing import Any, Literal
+
+import pysam
+
+from isatoolkit2.bed.intervals import IntervalIndex
+from isatoolkit2.progress import ProgressReporter
+
+# Modes for writing SAM, uncompressed BAM, BAM and CRAM files
+OutputMode = Literal["w", "wbu", "wb", "wc"]
+
+# Marker file name for a reference that was added to a reference cache
+POPULATED_MARKER_PREFIX = ".populated-"
 
 
 def get_output_mode(
-    output_format: Literal["sam", "bam"],
+    output_format: Literal["sam", "bam", "cram"],
     *,
     uncompressed: bool,
-) -> Literal["w", "wbu", "wb"]:
+) -> OutputMode:
     """Get the output mode based on the output format and compression options."""
+    if output_format == "cram":
+        return "wc"
     return "w" if output_format == "sam" else "wbu" if uncompressed else "wb"
+
+
+def open_alignment_file(
+    path: Literal["-"] | Path,
+    mode: Literal["r"] | OutputMode = "r",
+    *,
+    reference: None | Path = None,
+    **kwargs: Any,  # noqa: ANN401
+) -> pysam.AlignmentFile:
+    """Open a SAM/BAM/CRAM file, decoding or encoding CRAM with a reference FASTA."""
+    return pysam.AlignmentFile(
+        str(path),
+        mode=mode,
+        reference_filename=str(reference) if reference else None,
+        **kwargs,
+    )
+
+
+def alignment_progress(
+    infile_handle: pysam.AlignmentFile,
+    infile: Literal["-"] | Path,
+    *,
+    whole_file: bool = True,
+) -> ProgressReporter:
+    """
+    Create a progress reporter for reading a SAM/BAM/CRAM file.
+
+    The total number of records is taken from the index, if there is one,
+    otherwise progress is estimated from the offset in the input file.
+    If only part of the file is read, e.g. regions, only the records
+    processed and the throughput are reported.
+    """
+    if not whole_file:
+        return ProgressReporter()
+
+    total_records = None
+    if infile_handle.has_index():
+        try:
+            total_records = (
+                infile_handle.mapped
+                + infile_handle.unmapped
+                + infile_handle.nocoordinate
+            )
+        except ValueError:
+            # CRAM indices have no read counts
+            total_records = None
+
+    total_bytes = None
+    if str(infile) != "-" and Path(infile).is_file():
+        total_bytes = Path(infile).stat().st_size
+
+    # BAM offsets are BGZF virtual offsets, with the compressed offset in the
+    # upper 48 bits. SAM and CRAM offsets are file offsets.
+    def tell() -> int:
+        offset = infile_handle.tell()
+        return offset >> 16 if infile_handle.is_bam else offset
+
+    return ProgressReporter(
+        total_records=total_records,
+        total_bytes=total_bytes,
+        tell=tell,
+    )
+
+
+def _fetch_region_reads(
+    infile_handle: pysam.AlignmentFile,
+    regions: IntervalIndex,
+) -> Iterator[pysam.AlignedSegment]:
+    """Fetch the reads of each region from an indexed file, without duplicates."""
+    for contig, length in zip(
+        infile_handle.references,
+        infile_handle.lengths,
+        strict=True,
+    ):
+        previous_end = 0
+        for start, end in regions.intervals(contig):
+            if start >= length:
+                break
+            for read in infile_handle.fetch(contig, start, min(end, length)):
+                # The merged regions are disjoint, so a read starting before
+                # the end of the previous region was already returned for it
+                if read.reference_start >= previous_end:
+                    yield read
+            previous_end = end
+
+
+def _stream_region_reads(
+    infile_handle: pysam.AlignmentFile,
+    regions: IntervalIndex,
+) -> Iterator[pysam.AlignedSegment]:
+    """Stream the reads of a file, skipping the reads outside the regions."""
+    for read in infile_handle:
+        start = read.reference_start
+        if read.reference_name is None or start < 0:
+            continue
+        # Reads without aligned bases are indexed with a length of 1
+        end = read.reference_end or start + 1
+        if regions.overlaps(read.reference_name, start, end):
+            yield read
+
+
+def region_reads(
+    infile_handle: pysam.AlignmentFile,
+    regions: IntervalIndex,
+) -> Iterator[pysam.AlignedSegment]:
+    """
+    Get the reads overlapping any of the regions.
+
+    With an index, only the regions are read, in the order of the contigs
+    in the header. A read overlapping several regions is fetched for each
+    of them, but only returned for the first one. Without an index, the
+    whole file is streamed, and reads outside the regions are skipped.
+    Either way, reads keep their order in a coordinate sorted file.
+    """
+    references = infile_handle.references
+    missing = [chrom for chrom in regions.chromosomes() if chrom not in references]
+    if missing:
+        error_msg = f"Region contigs are not in the input header: {', '.join(missing)}"
+        raise ValueError(error_msg)
+
+    if infile_handle.has_index():
+        return _fetch_region_reads(infile_handle, regions)
+    return _stream_region_reads(infile_handle, regions)
+
+
+def reference_cache_path(
+    cache_dir: Path,
+    md5: str,
+) -> Path:
+    """Get the path of a sequence in a reference cache, in the htslib layout."""
+    return cache_dir / md5[:2] / md5[2:4] / md5[4:]
+
+
+def populate_reference_cache(
+    reference: Path,
+    cache_dir: Path,
+) -> None:
+    """
+    Add the sequences of a reference FASTA to a reference cache.
+
+    Sequences are stored under the MD5 of their upper case bases, as in the
+    M5 tag of CRAM headers, so CRAM files can later be decoded without the
+    FASTA. A marker file skips references that were already added.
+    """
+    stat = reference.stat()
+    marker = cache_dir / (
+        POPULATED_MARKER_PREFIX
+        + hashlib.sha256(
+            f"{reference.resolve()}\t{stat.st_size}\t{stat.st_mtime_ns}".encode(),
+        ).hexdigest()
+    )
+    if marker.exists():
+        return
+
+    with pysam.FastxFile(str(reference)) as fasta:
+        for record in fasta:
+            sequence = record.sequence.upper().encode() if record.sequence else b""
+            path = reference_cache_path(cache_dir, hashlib.md5(sequence).hexdigest())  # noqa: S324
+            if path.exists():
+                continue
+
+            # Write to a temporary file first, so readers never see partial sequences
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+            tmp_path.write_bytes(sequence)
+            tmp_path.replace(path)
+
+    marker.touch()
+
+
+def configure_reference_cache(
+    cache_dir: Path,
+    reference: None | Path = None,
+) -> None:
+    """
+    Use a local reference cache for decoding and encoding CRAM files.
+
+    htslib looks up references by MD5 in the cache before REF_PATH, and keeps
+    references found through REF_PATH in the cache for later runs.
+    The sequences of the reference FASTA, if any, are added to the cache.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["REF_CACHE"] = str(cache_dir / "%2s" / "%2s" / "%s")
+    if reference is not None:
+        populate_reference_cache(reference, cache_dir)
+
+
+class ReadDecision(Enum):
+
+    """What a read filter does with a read."""
+
+    KEEP = "keep"  # Write to the output
+    DISCARD = "discard"  # Write to the discarded output, if any
+    DROP = "drop"  # Write to neither output
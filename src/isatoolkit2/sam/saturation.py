@@ -0,0 +1,84 @@
+"""Saturation curve of unique integration sites against sequencing depth."""
+
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Annotated, Literal
+
+import pysam
+from annotated_types import Gt
+
+from isatoolkit2.sam.subsample import ReadSubsampler
+
+# Default number of depths on the curve
+SATURATION_POINTS = 20
+
+# Integration site key, as counted
+SiteKey = tuple[str, int, Literal["+", "-"]]
+
+
+class SaturationCurve:
+
+    """
+    Unique integration sites at many sequencing depths, counted in one pass.
+
+    Each read is assigned to one of a number of equal depth buckets by the
+    same query name hash as subsampling, so the first k buckets hold the
+    reads that would be kept when subsampling k / points of the reads.
+    Only the R1 reads per bucket and the first bucket each site is seen in
+    are kept, and the curve is their running totals.
+    """
+
+    def __init__(
+        self,
+        subsampler: ReadSubsampler,
+        points: Annotated[int, Gt(0)] = SATURATION_POINTS,
+    ) -> None:
+        """Prepare empty buckets for the reads in a subsample."""
+        self.subsampler = subsampler
+        self.points = points
+        # Reads are only counted if they are in the subsample, so the buckets
+        # divide the hashes below its threshold
+        self.limit = subsampler.threshold
+        self.r1_reads = [0] * points
+        self.first_bucket: dict[SiteKey, int] = {}
+
+    def add(
+        self,
+        reads: list[pysam.AlignedSegment],
+        sites: list[None | SiteKey],
+    ) -> None:
+        """Add counted R1 reads, and the integration sites they support, if any."""
+        points = self.points
+        limit = self.limit
+        r1_reads = self.r1_reads
+        first_bucket = self.first_bucket
+        for read_hash, site in zip(self.subsampler.hashes(reads), sites, strict=True):
+            bucket = read_hash * points // limit
+            r1_reads[bucket] += 1
+            if site is not None and bucket < first_bucket.get(site, points):
+                first_bucket[site] = bucket
+
+    def rows(self) -> Iterator[tuple[float, int, int]]:
+        """Get the fraction of reads, R1 reads and unique sites at each depth."""
+        new_sites = [0] * self.points
+        for bucket in self.first_bucket.values():
+            new_sites[bucket] += 1
+
+        r1_reads = 0
+        unique_sites = 0
+        for bucket in range(self.points):
+            r1_reads += self.r1_reads[bucket]
+            unique_sites += new_sites[bucket]
+            yield (bucket + 1) / self.points, r1_reads, unique_sites
+
+    def write(
+        self,
+        path: Path,
+    ) -> None:
+        """Write the curve as TSV, with a header line."""
+        lines = ["fraction\tr1_reads\tunique_sites\n"]
+        lines.extend(
+            f"{fraction:.4g}\t{r1_reads}\t{unique_sites}\n"
+            for fraction, r1_reads, unique_sites in self.rows()
+        )
+        path.write_text("".join(lines))
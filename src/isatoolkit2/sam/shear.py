@@ -0,0 +1,99 @@
+"""Count distinct shear sites per integration site, from the R1 records alone."""
+
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Annotated
+
+import pysam
+from annotated_types import Ge
+
+from isatoolkit2.sam.distinct import (
+    SiteValues,
+    add_distinct,
+    distinct_count,
+    distinct_counts,
+)
+from isatoolkit2.sam.saturation import SiteKey
+
+
+def shear_position(
+    read: pysam.AlignedSegment,
+) -> None | int:
+    """
+    Get the 5' position of the mate of an R1 read, from its mate fields.
+
+    The mate of a forward R1 read is on the reverse strand, with its 5' end
+    at the end of the fragment, TLEN - 1 after the R1 start. The mate of a
+    reverse R1 read is on the forward strand, with its 5' end at the mate
+    position. Reads without a mate on the same chromosome, or with a TLEN
+    of the wrong sign for their strand, have no shear site.
+    """
+    # Check the mate on the FLAG alone first
+    flag = read.flag
+    if (
+        flag & (pysam.FPAIRED | pysam.FMUNMAP) != pysam.FPAIRED
+        or read.next_reference_id != read.reference_id
+    ):
+        return None
+    tlen = read.template_length
+    if flag & pysam.FREVERSE:
+        return read.next_reference_start if tlen < 0 else None
+    return read.reference_start + tlen - 1 if tlen > 0 else None
+
+
+@dataclass
+class ShearSites:
+
+    """
+    Distinct shear sites of the R1 reads at each integration site.
+
+    Each distinct shear site is a distinct sonication fragment, so their
+    number estimates the clonal abundance of a site better than reads do.
+    Shear sites are kept like UMIs, as one integer for most sites and a
+    sorted array of 4 bytes per shear site for the others.
+    """
+
+    sites: dict[SiteKey, SiteValues] = field(default_factory=dict)
+    pairs: Annotated[int, Ge(0)] = 0
+    unpaired: Annotated[int, Ge(0)] = 0
+
+    def add(
+        self,
+        site: SiteKey,
+        read: pysam.AlignedSegment,
+    ) -> None:
+        """Add the shear site of an R1 read at a site, if it has one."""
+        shear = shear_position(read)
+        if shear is None:
+            self.unpaired += 1
+            return
+        self.pairs += 1
+        add_distinct(self.sites, site, shear, "I")
+
+    def counts(self) -> Iterator[tuple[SiteKey, int]]:
+        """Get the number of distinct shear sites of each site."""
+        return distinct_counts(self.sites)
+
+    def write(
+        self,
+        path: Path,
+        order: Iterable[SiteKey],
+    ) -> None:
+        """Write the shear site counts as BED, for the sites in order only."""
+        sites = self.sites
+        with path.open("w", encoding="utf-8") as handle:
+            handle.writelines(
+                f"{site[0]}\t{site[1]}\t{site[1]}\t.\t{distinct_count(values)}"
+                f"\t{site[2]}\n"
+                for site in order
+                if (values := sites.get(site)) is not None
+            )
+
+    def __str__(self) -> str:
+        """Describe the shear sites for a report."""
+        return (
+            f"Counted {len(self.sites):,} sites with shear sites "
+            f"from {self.pairs:,} R1 reads, "
+            f"skipped {self.unpaired:,} without a mate on the same chromosome"
+        )
@@ -0,0 +1,95 @@
+"""Deterministic subsampling of reads by a hash of their query name."""
+
+import hashlib
+from typing import Annotated
+
+import pysam
+from annotated_types import Ge, Gt, Le
+
+# Default seed of the query name hash
+SUBSAMPLE_SEED = 0
+
+# Number of bytes of the query name hash
+HASH_SIZE = 8
+
+# Number of distinct query name hashes
+HASH_RANGE = 1 << (8 * HASH_SIZE)
+
+
+class ReadSubsampler:
+
+    """
+    Keep a fraction of the reads, chosen by a seeded hash of the query name.
+
+    Both mates of a read pair, and all records of a read, have the same
+    query name, so they are kept or dropped together, and the same seed
+    keeps the same reads in every run. Reads are hashed with BLAKE2b,
+    salted with the seed, which is fast enough to run on every read and
+    spreads similar query names evenly.
+    """
+
+    def __init__(
+        self,
+        fraction: Annotated[float, Gt(0), Le(1)],
+        seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+    ) -> None:
+        """Prepare the hash state for a fraction and seed."""
+        if not 0 < fraction <= 1:
+            error_msg = f"Subsample fraction must be in (0, 1], got {fraction}."
+            raise ValueError(error_msg)
+        if not 0 <= seed < 1 << 128:
+            error_msg = f"Subsample seed must be in [0, 2^128), got {seed}."
+            raise ValueError(error_msg)
+
+        self.fraction = fraction
+        self.seed = seed
+        self.threshold = round(fraction * HASH_RANGE)
+        # Copying the salted state is faster than salting each hash
+        self._state = hashlib.blake2b(
+            digest_size=HASH_SIZE,
+            salt=seed.to_bytes(16, "little"),
+        )
+
+    def hash(
+        self,
+        query_name: str,
+    ) -> int:
+        """Hash a query name to an integer below HASH_RANGE."""
+        state = self._state.copy()
+        state.update(query_name.encode())
+        return int.from_bytes(state.digest(), "little")
+
+    def hashes(
+        self,
+        batch: list[pysam.AlignedSegment],
+    ) -> list[int]:
+        """Hash the query names of a batch of reads."""
+        copy = self._state.copy
+        hashes = []
+        for read in batch:
+            state = copy()
+            state.update((read.query_name or "").encode())
+            hashes.append(int.from_bytes(state.digest(), "little"))
+        return hashes
+
+    def sample(
+        self,
+        batch: list[pysam.AlignedSegment],
+    ) -> list[pysam.AlignedSegment]:
+        """Get the reads of a batch that are in the subsample."""
+        if self.threshold >= HASH_RANGE:
+            return batch
+        threshold = self.threshold
+        return [
+            read
+            for read, read_hash in zip(batch, self.hashes(batch), strict=True)
+            if read_hash < threshold
+        ]
+
+
+def read_subsampler(
+    fraction: None | Annotated[float, Gt(0), Le(1)],
+    seed: Annotated[int, Ge(0)] = SUBSAMPLE_SEED,
+) -> None | ReadSubsampler:
+    """Create a subsampler for a fraction, if reads are subsampled."""
+    return ReadSubsampler(fraction, seed) if fraction is not None else None
@@ -0,0 +1,154 @@
+"""Count distinct UMIs per integration site, packed 2 bits per base."""
+
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import Annotated
+
+import pysam
+from annotated_types import Ge, MinLen
+
+from isatoolkit2.sam.distinct import SiteValues, add_distinct, distinct_counts
+from isatoolkit2.sam.saturation import SiteKey
+
+# Separator of the UMI at the end of query names, as written by umi_tools
+UMI_SEPARATOR = "_"
+
+# Longest UMI that fits in 64 bits, with 2 bits per base and a length bit
+MAX_UMI_LENGTH = 31
+
+# Bases as base 4 digits, separators of dual UMIs (e.g. ACGT-TGCA) removed,
+# and digits mapped to an invalid digit so they aren't read as bases
+UMI_DIGITS = str.maketrans(
+    {
+        "A": "0",
+        "C": "1",
+        "G": "2",
+        "T": "3",
+        "a": "0",
+        "c": "1",
+        "g": "2",
+        "t": "3",
+        "-": None,
+        "+": None,
+        **dict.fromkeys("0123456789", "x"),
+    },
+)
+
+
+def encode_umi(
+    umi: str,
+) -> None | int:
+    """
+    Pack a UMI into an integer with 2 bits per base, or None if it's invalid.
+
+    A leading 1 bit marks the length, so UMIs of different lengths differ.
+    UMIs with bases other than A, C, G and T, e.g. N, are invalid.
+    """
+    digits = umi.translate(UMI_DIGITS)
+    if not digits or len(digits) > MAX_UMI_LENGTH:
+        return None
+    try:
+        return int(f"1{digits}", 4)
+    except ValueError:
+        return None
+
+
+def decode_umi(
+    packed: Annotated[int, Ge(1)],
+) -> str:
+    """Unpack a UMI packed by encode_umi."""
+    bases = []
+    while packed > 1:
+        bases.append("ACGT"[packed & 3])
+        packed >>= 2
+    return "".join(reversed(bases))
+
+
+def umi_clusters(
+    umis: Iterable[int],
+) -> int:
+    """
+    Count the clusters of UMIs connected by a single base difference.
+
+    UMIs one base apart are chained into the same cluster, as in the
+    umi_tools cluster method, by looking up the 3 other bases at each
+    position of each UMI.
+    """
+    remaining = set(umis)
+    clusters = 0
+    while remaining:
+        clusters += 1
+        stack = [remaining.pop()]
+        while stack:
+            umi = stack.pop()
+            for shift in range(0, umi.bit_length() - 1, 2):
+                for difference in (1 << shift, 2 << shift, 3 << shift):
+                    neighbor = umi ^ difference
+                    if neighbor in remaining:
+                        remaining.remove(neighbor)
+                        stack.append(neighbor)
+    return clusters
+
+
+@dataclass
+class UmiCounts:
+
+    """
+    Distinct UMIs of the R1 reads at each integration site.
+
+    Most sites have a single UMI, which is kept as a packed integer. Sites
+    with more UMIs keep them in a sorted array of 8 bytes per UMI, and only
+    sites with more than DISTINCT_ARRAY_SIZE UMIs switch to a set.
+    """
+
+    tag: None | Annotated[str, MinLen(2)] = None
+    separator: Annotated[str, MinLen(1)] = UMI_SEPARATOR
+    sites: dict[SiteKey, SiteValues] = field(default_factory=dict)
+    reads: Annotated[int, Ge(0)] = 0
+    invalid: Annotated[int, Ge(0)] = 0
+
+    def umi(
+        self,
+        read: pysam.AlignedSegment,
+    ) -> None | int:
+        """Get the packed UMI of a read, from its tag or the end of its name."""
+        if self.tag is not None:
+            if not read.has_tag(self.tag):
+                return None
+            return encode_umi(str(read.get_tag(self.tag)))
+        name, separator, umi = (read.query_name or "").rpartition(self.separator)
+        return encode_umi(umi) if separator and name else None
+
+    def add(
+        self,
+        site: SiteKey,
+        read: pysam.AlignedSegment,
+    ) -> bool:
+        """Add the UMI of a read at a site, returning False if it has none."""
+        umi = self.umi(read)
+        if umi is None:
+            self.invalid += 1
+            return False
+        self.reads += 1
+        add_distinct(self.sites, site, umi)
+        return True
+
+    def counts(
+        self,
+        *,
+        collapse: bool = False,
+    ) -> Iterator[tuple[SiteKey, int]]:
+        """Get the number of distinct UMIs, or UMI clusters, of each site."""
+        if not collapse:
+            yield from distinct_counts(self.sites)
+            return
+        for site, umis in self.sites.items():
+            yield site, 1 if isinstance(umis, int) else umi_clusters(umis)
+
+    def __str__(self) -> str:
+        """Describe the UMIs for a report."""
+        return (
+            f"Counted {self.reads:,} R1 reads with a UMI "
+            f"at {len(self.sites):,} sites, "
+            f"skipped {self.invalid:,} without a valid UMI"
+        )
@@ -0,0 +1,275 @@
+"""
+Warm daemon that runs trace commands submitted over a Unix domain socket.
+
+The daemon imports the command modules once and forks a worker for each
+submitted command, so jobs skip interpreter start-up and imports. Clients
+pass their working directory and arguments as a JSON line, and their
+stdin, stdout and stderr file descriptors along with it, so commands read
+and write the client's streams as if they ran in the client process.
+
+This module doesn't import click, pydantic or pysam at the top level, so
+the client starts quickly.
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+from pathlib import Path
+from typing import Any
+
+# Modules imported by the daemon before serving
+WARM_MODULES = [
+    "isatoolkit2.main",
+    "isatoolkit2.bed.combine",
+    "isatoolkit2.bed.matrix",
+    "isatoolkit2.bed.merge",
+    "isatoolkit2.bed.sort",
+    "isatoolkit2.bgzf",
+    "isatoolkit2.cache",
+    "isatoolkit2.sam.count",
+    "isatoolkit2.sam.expression_filter",
+    "isatoolkit2.sam.fiveprime_filter",
+    "isatoolkit2.sam.mapping_filter",
+]
+
+# Environment variable with the socket path used by clients
+SOCKET_ENV = "TRACE_SOCKET"
+
+# Maximum size of a request line in bytes
+MAX_REQUEST_SIZE = 1 << 20
+
+# The standard streams passed from the client
+STREAM_FDS = (0, 1, 2)
+
+# How often (in seconds) the daemon checks if it was stopped
+POLL_INTERVAL = 0.5
+
+
+def default_socket_path() -> Path:
+    """Get the socket path from the environment, or a per-user default."""
+    if path := os.environ.get(SOCKET_ENV):
+        return Path(path)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return Path(runtime_dir) / f"trace-{os.getuid()}.sock"
+
+
+def _read_line(
+    connection: socket.socket,
+    data: bytes,
+) -> bytes:
+    """Read from a connection until the end of a line."""
+    while not data.endswith(b"\n"):
+        if len(data) > MAX_REQUEST_SIZE:
+            error_msg = "Request is too large."
+            raise ValueError(error_msg)
+        chunk = connection.recv(1 << 16)
+        if not chunk:
+            error_msg = "Connection closed before the end of the message."
+            raise ValueError(error_msg)
+        data += chunk
+    return data
+
+
+def _run_command(
+    args: list[str],
+) -> int:
+    """Run a trace command as the CLI would, returning its exit code."""
+    from isatoolkit2.main import cli
+
+    try:
+        cli.main(args=args, prog_name="trace")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)  # noqa: T201
+        return 1
+    except BaseException:  # noqa: BLE001
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class CommandHandler(socketserver.BaseRequestHandler):
+
+    """Run one submitted command in a forked worker."""
+
+    request: socket.socket
+
+    def handle(self) -> None:
+        """Receive the client streams and request, run it and send the exit code."""
+        # Workers stop with the default signal handlers, not the daemon's
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        data, fds, _, _ = socket.recv_fds(self.request, 1 << 16, len(STREAM_FDS))
+        if len(fds) != len(STREAM_FDS):
+            for fd in fds:
+                os.close(fd)
+            self._respond(1, "Expected the stdin, stdout and stderr of the client.")
+            return
+
+        try:
+            request = json.loads(_read_line(self.request, data))
+
+            # Take over the client's streams and working directory
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, target in zip(fds, STREAM_FDS, strict=True):
+                os.dup2(fd, target)
+            # New stream objects, since the old ones cached properties of
+            # the daemon's streams, like being seekable
+            sys.stdin = os.fdopen(0, "r", closefd=False)
+            sys.stdout = os.fdopen(1, "w", closefd=False)
+            sys.stderr = os.fdopen(2, "w", buffering=1, closefd=False)
+            os.chdir(request["cwd"])
+
+            exit_code = _run_command(request["args"])
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._respond(1, f"Invalid request: {e}")
+            return
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        self._respond(exit_code)
+
+    def _respond(
+        self,
+        exit_code: int,
+        error: None | str = None,
+    ) -> None:
+        """Send the exit code of the command, and an error message if any."""
+        response = {"exit_code": exit_code, "error": error}
+        # The client may have gone away, e.g. if it was interrupted
+        with contextlib.suppress(BrokenPipeError):
+            self.request.sendall(json.dumps(response).encode() + b"\n")
+
+
+class ForkingUnixServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+
+    """Unix socket server that forks a worker per connection."""
+
+
+def _check_stale_socket(
+    socket_path: Path,
+) -> None:
+    """Remove a socket left behind by a stopped daemon."""
+    if not socket_path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(socket_path))
+        except ConnectionRefusedError:
+            socket_path.unlink()
+            return
+    error_msg = f"A trace server is already listening on {socket_path}."
+    raise ValueError(error_msg)
+
+
+def serve(
+    socket_path: Path,
+    workers: int = 4,
+) -> None:
+    """
+    Serve trace commands on a Unix domain socket until stopped.
+
+    Up to workers commands run at the same time, each in a worker forked
+    from the warm daemon, so jobs don't share any state. Further
+    connections wait until a worker finishes.
+    """
+    for module in WARM_MODULES:
+        importlib.import_module(module)
+
+    _check_stale_socket(socket_path)
+
+    # Stop cleanly on SIGTERM or SIGINT, after the current request, since
+    # raising from the signal handler could interrupt forking a worker.
+    stopping = False
+
+    def stop(*_: object) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Only the user running the daemon can submit commands
+    old_umask = os.umask(0o177)
+    try:
+        server = ForkingUnixServer(str(socket_path), CommandHandler)
+    finally:
+        os.umask(old_umask)
+    server.max_children = workers
+    server.timeout = POLL_INTERVAL
+
+    try:
+        with server:
+            while not stopping:
+                server.handle_request()
+                # Reap finished workers, waiting while all workers are busy
+                server.service_actions()
+    finally:
+        socket_path.unlink(missing_ok=True)
+
+
+def submit(
+    args: list[str],
+    socket_path: Path,
+) -> int:
+    """Run a trace command on the daemon with this process's streams."""
+    request = json.dumps({"args": args, "cwd": str(Path.cwd())}).encode() + b"\n"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(socket_path))
+        socket.send_fds(connection, [request], list(STREAM_FDS))
+        response: dict[str, Any] = json.loads(_read_line(connection, b""))
+    if response["error"]:
+        print(f"Error: {response['error']}", file=sys.stderr)  # noqa: T201
+    return int(response["exit_code"])
+
+
+def submit_main() -> None:
+    """Entry point of the trace-submit client."""
+    parser = argparse.ArgumentParser(
+        prog="trace-submit",
+        description=(
+            "Run a trace command on a warm trace server, "
+            "e.g. trace-submit sam count -i in.bam -o sites.bed"
+        ),
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        type=Path,
+        default=default_socket_path(),
+        help=f"Socket of the trace server (default: ${SOCKET_ENV} or %(default)s)",
+    )
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="trace command")
+    options = parser.parse_args()
+
+    try:
+        exit_code = submit(options.args, options.socket)
+    except (ConnectionRefusedError, FileNotFoundError):
+        print(  # noqa: T201
+            f"Error: no trace server is listening on {options.socket}. "
+            "Start one with trace serve.",
+            file=sys.stderr,
+        )
+        exit_code = 1
+    except (ConnectionError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)  # noqa: T201
+        exit_code = 1
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    submit_main()
@@ -6,11 +6,14 @@ from typing import Literal
 import click
 from pydantic import BaseModel, FilePath, NewPath, ValidationError, field_validator
 
+# File suffixes of alignment files
+ALIGNMENT_SUFFIXES = [".sam", ".bam", ".cram"]
 
-# SAM/BAM inputs
+
+# SAM/BAM/CRAM inputs
 class SamBamInputSchema(BaseModel):
 
-    """SAM/BAM file schema."""
+    """SAM/BAM/CRAM file schema."""
 
     input: Literal["-"] | FilePath
 
@@ -19,18 +22,18 @@ class SamBamInputSchema(BaseModel):
         cls,
         value: Literal["-"] | Path,
     ) -> Literal["-"] | Path:
-        """Check if the file is a SAM/BAM file."""
-        if isinstance(value, Path) and value.suffix.lower() not in [".sam", ".bam"]:
-            error_msg = f"File {value} is not a SAM/BAM file"
+        """Check if the file is a SAM/BAM/CRAM file."""
+        if isinstance(value, Path) and value.suffix.lower() not in ALIGNMENT_SUFFIXES:
+            error_msg = f"File {value} is not a SAM/BAM/CRAM file"
             raise ValueError(error_msg)
         return value
 
 
 class SamBamInputType(click.ParamType):
 
-    """SAM/BAM file type."""
+    """SAM/BAM/CRAM file type."""
 
-    name = "sam/bam"
+    name = "sam/bam/cram"
 
     def convert(
         self,
@@ -38,7 +41,7 @@ class SamBamInputType(click.ParamType):
         param: click.Parameter | None,
         ctx: click.Context | None,
     ) -> Literal["-"] | Path:
-        """Check if the file is a SAM/BAM file."""
+        """Check if the file is a SAM/BAM/CRAM file."""
         try:
             SamBamInputSchema(input=value)
         except ValidationError as e:
@@ -47,10 +50,10 @@ class SamBamInputType(click.ParamType):
             return value
 
 
-# SAM/BAM outputs
+# SAM/BAM/CRAM outputs
 class SamBamOutputSchema(BaseModel):
 
-    """SAM/BAM file schema."""
+    """SAM/BAM/CRAM file schema."""
 
     output: Literal["-"] | FilePath | NewPath
 
@@ -59,18 +62,18 @@ class SamBamOutputSchema(BaseModel):
         cls,
         value: Literal["-"] | Path,
     ) -> Literal["-"] | Path:
-        """Check if the file is a SAM/BAM file."""
-        if isinstance(value, Path) and value.suffix.lower() not in [".sam", ".bam"]:
-            error_msg = f"File {value} is not a SAM/BAM file"
+        """Check if the file is a SAM/BAM/CRAM file."""
+        if isinstance(value, Path) and value.suffix.lower() not in ALIGNMENT_SUFFIXES:
+            error_msg = f"File {value} is not a SAM/BAM/CRAM file"
             raise ValueError(error_msg)
         return value
 
 
 class SamBamOutputType(click.ParamType):
 
-    """SAM/BAM file type."""
+    """SAM/BAM/CRAM file type."""
 
-    name = "sam/bam"
+    name = "sam/bam/cram"
 
     def convert(
         self,
@@ -78,7 +81,7 @@ class SamBamOutputType(click.ParamType):
         param: click.Parameter | None,
         ctx: click.Context | None,
     ) -> Literal["-"] | Path:
-        """Check if the file is a SAM/BAM file."""
+        """Check if the file is a SAM/BAM/CRAM file."""
         try:
             SamBamOutputSchema(output=value)
         except ValidationError as e:
@@ -87,10 +90,10 @@ class SamBamOutputType(click.ParamType):
             return value
 
 
-# SAM/BAM discarded output
+# SAM/BAM/CRAM discarded output
 class SamBamDiscardedOutputSchema(BaseModel):
 
-    """SAM/BAM discarded output file schema."""
+    """SAM/BAM/CRAM discarded output file schema."""
 
     discarded_output: Literal["-"] | FilePath | NewPath
 
@@ -99,18 +102,18 @@ class SamBamDiscardedOutputSchema(BaseModel):
         cls,
         value: Literal["-"] | Path,
     ) -> Literal["-"] | Path:
-        """Check if the file is a SAM/BAM file."""
-        if isinstance(value, Path) and value.suffix.lower() not in [".sam", ".bam"]:
-            error_msg = f"File {value} is not a SAM/BAM file"
+        """Check if the file is a SAM/BAM/CRAM file."""
+        if isinstance(value, Path) and value.suffix.lower() not in ALIGNMENT_SUFFIXES:
+            error_msg = f"File {value} is not a SAM/BAM/CRAM file"
             raise ValueError(error_msg)
         return value
 
 
 class SamBamDiscardedOutputType(click.ParamType):
 
-    """SAM/BAM discarded output file type."""
+    """SAM/BAM/CRAM discarded output file type."""
 
-    name = "sam/bam"
+    name = "sam/bam/cram"
 
     def convert(
         self,
@@ -118,7 +121,7 @@ class SamBamDiscardedOutputType(click.ParamType):
         param: click.Parameter | None,
         ctx: click.Context | None,
     ) -> Literal["-"] | Path:
-        """Check if the file is a SAM/BAM file."""
+        """Check if the file is a SAM/BAM/CRAM file."""
         try:
             SamBamDiscardedOutputSchema(discarded_output=value)
         except ValidationError as e:
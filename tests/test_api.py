@@ -0,0 +1,96 @@
+"""Test the Python API over site records."""
+
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from isatoolkit2.api import (
+    BedLine,
+    count_sites,
+    merge_sites,
+    read_sites,
+    sort_sites,
+    write_sites,
+)
+from isatoolkit2.bed.bed_utils import format_bed_line
+from isatoolkit2.bed.merge import iter_lines, merge_integration_sites
+from isatoolkit2.bed.sort import sort_bed
+
+BED = (
+    "chr2\t100\t100\t.\t3\t+\n"
+    "chr10\t100\t100\t.\t1\t+\n"
+    "chr2\t103\t103\t.\t5\t+\n"
+    "chr2\t101\t101\t.\t2\t-\n"
+    "chr2\t200\t200\t.\t4\t+\n"
+)
+
+
+def parse(text: str) -> list[BedLine]:
+    """Parse BED text into site records."""
+    return list(iter_lines(StringIO(text)))
+
+
+def test_merge_sites() -> None:
+    """Test that merging site records matches merging a BED file."""
+    expected = StringIO()
+    merge_integration_sites(StringIO(BED), expected, distance=5)
+
+    merged = merge_sites(parse(BED), distance=5)
+
+    assert "".join(map(format_bed_line, merged)) == expected.getvalue()
+
+
+@pytest.mark.parametrize(
+    "sort_by, top",
+    [("position", None), ("score", None), ("score", 2)],
+    ids=["position", "score", "top 2 by score"],
+)
+def test_sort_sites(
+    sort_by: str,
+    top: None | int,
+) -> None:
+    """Test that sorting site records matches sorting a BED file."""
+    expected = StringIO()
+    sort_bed(StringIO(BED), expected, sort_by, top)  # pyright: ignore[reportArgumentType]
+
+    sorted_sites = sort_sites(parse(BED), sort_by, top)  # pyright: ignore[reportArgumentType]
+
+    assert "".join(map(format_bed_line, sorted_sites)) == expected.getvalue()
+
+
+def test_count_merge_sites(
+    tmp_path: Path,
+) -> None:
+    """Test counting sites of a SAM file and merging them in process."""
+    input_sam_path = tmp_path / "input.sam"
+    input_sam_path.write_text(
+        "@HD\tVN:1.6\tSO:coordinate\n"
+        "@SQ\tSN:chr1\tLN:1000\n"
+        "read1\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        "read2\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        "read3\t64\tchr1\t102\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        "read4\t128\tchr1\t300\t60\t5M\t*\t0\t0\tAGCTT\t*\n",
+    )
+
+    counts = count_sites(input_sam_path)
+    merged = list(merge_sites(counts.sites()))
+
+    assert counts.r1_total == 3  # noqa: PLR2004
+    assert [(site.seqname, site.start, site.score) for site in merged] == [
+        ("chr1", 99, 3),
+    ]
+
+
+@pytest.mark.parametrize("suffix", [".bed", ".bed.gz"], ids=["plain", "compressed"])
+def test_read_write_sites(
+    suffix: str,
+    tmp_path: Path,
+) -> None:
+    """Test that written sites are read back unchanged."""
+    path = tmp_path / f"sites{suffix}"
+    sites = parse(BED)
+
+    write_sites(sites, path)
+
+    assert list(read_sites(path)) == sites
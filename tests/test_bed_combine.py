@@ -0,0 +1,76 @@
+"""Test combining position sorted count BED files."""
+
+from io import StringIO
+
+import pytest
+
+from isatoolkit2.bed.combine import combine_counts
+
+
+@pytest.mark.parametrize(
+    "inputs, expected",
+    [
+        (
+            [
+                "chr1\t100\t100\t.\t1\t+\nchr1\t200\t200\t.\t2\t-\n",
+                "chr1\t100\t100\t.\t3\t+\nchr1\t200\t200\t.\t4\t+\n",
+            ],
+            (
+                "chr1\t100\t100\t.\t4\t+\n"
+                "chr1\t200\t200\t.\t4\t+\n"
+                "chr1\t200\t200\t.\t2\t-\n"
+            ),
+        ),
+        (
+            [
+                "chr2\t5\t5\t.\t1\t+\nchr10\t1\t1\t.\t1\t+\n",
+                "chr1\t9\t9\t.\t1\t-\nchr10\t1\t1\t.\t2\t+\n",
+                "",
+            ],
+            (
+                "chr1\t9\t9\t.\t1\t-\n"
+                "chr2\t5\t5\t.\t1\t+\n"
+                "chr10\t1\t1\t.\t3\t+\n"
+            ),
+        ),
+        (
+            ["chr1\t7\t7\ta\t1\t+\nchr1\t7\t7\tb\t2\t+\n", "chr1\t7\t7\tc\t5\t+\n"],
+            "chr1\t7\t7\ta\t8\t+\n",
+        ),
+        (
+            ["# shard 1\nchr1\t1\t1\t.\t1\t+\n"],
+            "chr1\t1\t1\t.\t1\t+\n",
+        ),
+    ],
+    ids=[
+        "same sites summed",
+        "natural chromosome order",
+        "duplicates within an input",
+        "single input",
+    ],
+)
+def test_combine_counts(
+    inputs: list[str],
+    expected: str,
+) -> None:
+    """Test that identical sites are summed and the output is position sorted."""
+    outfile = StringIO()
+    combine_counts(
+        [StringIO(text) for text in inputs],
+        [f"shard{i}.bed" for i in range(len(inputs))],
+        outfile,
+    )
+    assert outfile.getvalue() == expected
+
+
+def test_combine_unsorted() -> None:
+    """Test that unsorted inputs are rejected."""
+    with pytest.raises(ValueError, match=r"shard1\.bed is not position sorted"):
+        combine_counts(
+            [
+                StringIO("chr1\t1\t1\t.\t1\t+\n"),
+                StringIO("chr1\t5\t5\t.\t1\t-\nchr1\t5\t5\t.\t1\t+\n"),
+            ],
+            ["shard0.bed", "shard1.bed"],
+            StringIO(),
+        )
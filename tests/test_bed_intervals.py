@@ -0,0 +1,110 @@
+"""Test genomic intervals and overlap queries."""
+
+from pathlib import Path
+
+import pytest
+
+from isatoolkit2.bed.intervals import (
+    CONTIG_END,
+    IntervalIndex,
+    parse_region,
+    read_bed_intervals,
+    region_index,
+)
+
+
+@pytest.mark.parametrize(
+    "region, expected",
+    [
+        ("chr1", ("chr1", 0, CONTIG_END)),
+        ("chr1:1000", ("chr1", 999, CONTIG_END)),
+        ("chr1:1000-", ("chr1", 999, CONTIG_END)),
+        ("chr1:1,000-2,000", ("chr1", 999, 2000)),
+        ("chr1:5-5", ("chr1", 4, 5)),
+        ("{HLA-A*01:01:01:01}", ("HLA-A*01:01:01:01", 0, CONTIG_END)),
+        ("{HLA-A*01:01:01:01}:10-20", ("HLA-A*01:01:01:01", 9, 20)),
+        ("HLA-A*01:01:01:01:10-20", ("HLA-A*01:01:01:01", 9, 20)),
+    ],
+    ids=[
+        "contig",
+        "start",
+        "open end",
+        "thousands separators",
+        "single base",
+        "contig in braces",
+        "contig in braces and range",
+        "contig with colons and range",
+    ],
+)
+def test_parse_region(
+    region: str,
+    expected: tuple[str, int, int],
+) -> None:
+    """Test that regions are parsed to 0-based, half-open intervals."""
+    assert parse_region(region) == expected
+
+
+@pytest.mark.parametrize(
+    "region",
+    ["chr1:0-10", "chr1:20-10", "{chr1}10-20"],
+    ids=["zero start", "end before start", "braces without colon"],
+)
+def test_parse_invalid_region(
+    region: str,
+) -> None:
+    """Test that invalid ranges are rejected."""
+    with pytest.raises(ValueError, match="Invalid region"):
+        parse_region(region)
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        (("chr1", 0, 10), False),
+        (("chr1", 0, 11), True),
+        (("chr1", 19, 20), True),
+        (("chr1", 25, 30), True),
+        (("chr1", 40, 50), True),
+        (("chr1", 50, 60), False),
+        (("chr1", 5, 100), True),
+        (("chr2", 10, 20), False),
+    ],
+    ids=[
+        "before",
+        "first base",
+        "inside",
+        "merged adjacent",
+        "merged overlapping",
+        "after",
+        "spanning",
+        "other chromosome",
+    ],
+)
+def test_overlaps(
+    query: tuple[str, int, int],
+    expected: bool,  # noqa: FBT001
+) -> None:
+    """Test overlap queries against merged intervals."""
+    index = IntervalIndex([("chr1", 30, 50), ("chr1", 10, 20), ("chr1", 20, 35)])
+    assert list(index.intervals("chr1")) == [(10, 50)]
+    assert index.overlaps(*query) is expected
+
+
+def test_region_index(
+    tmp_path: Path,
+) -> None:
+    """Test that regions and targets BED intervals are indexed together."""
+    targets = tmp_path / "targets.bed"
+    targets.write_text(
+        "track name=panel\n# comment\nchr2\t100\t200\tgene\nchr1\t500\t600\n",
+    )
+    assert list(read_bed_intervals(targets)) == [
+        ("chr2", 100, 200),
+        ("chr1", 500, 600),
+    ]
+
+    index = region_index(["chr1:1-100"], targets)
+    assert index is not None
+    assert len(index) == 3  # noqa: PLR2004
+    assert index.chromosomes() == ["chr1", "chr2"]
+    assert region_index() is None
@@ -0,0 +1,132 @@
+"""Test the count_matrix function."""
+
+import random
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from isatoolkit2.bed.matrix import count_matrix, sample_name
+from isatoolkit2.bed.merge import merge_integration_sites
+
+SAMPLE_A = "chr1\t100\t100\t.\t2\t+\nchr1\t103\t103\t.\t1\t-\nchr2\t50\t50\t.\t4\t+\n"
+SAMPLE_B = "chr1\t98\t98\t.\t1\t-\nchr1\t104\t104\t.\t3\t+\nchr1\t300\t300\t.\t1\t+\n"
+
+
+@pytest.mark.parametrize(
+    "output_format, expected_output",
+    [
+        (
+            "dense",
+            (
+                "#seqname\tstart\tend\tstrand\ta\tb\n"
+                "chr1\t100\t100\t-\t1\t1\n"
+                "chr1\t104\t104\t+\t2\t3\n"
+                "chr1\t300\t300\t+\t0\t1\n"
+                "chr2\t50\t50\t+\t4\t0\n"
+            ),
+        ),
+        (
+            "coo",
+            (
+                "#seqname\tstart\tend\tstrand\tsample\tcount\n"
+                "chr1\t100\t100\t-\ta\t1\n"
+                "chr1\t100\t100\t-\tb\t1\n"
+                "chr1\t104\t104\t+\ta\t2\n"
+                "chr1\t104\t104\t+\tb\t3\n"
+                "chr1\t300\t300\t+\tb\t1\n"
+                "chr2\t50\t50\t+\ta\t4\n"
+            ),
+        ),
+    ],
+    ids=["dense", "coo"],
+)
+def test_count_matrix(
+    output_format: str,
+    expected_output: str,
+) -> None:
+    """Test the dense and sparse matrix formats."""
+    outfile = StringIO()
+    count_matrix(
+        [StringIO(SAMPLE_A), StringIO(SAMPLE_B)],
+        ["a", "b"],
+        outfile,
+        output_format=output_format,  # type: ignore[arg-type]
+    )
+
+    assert outfile.getvalue() == expected_output
+
+
+def random_sample(rng: random.Random) -> str:
+    """Make a position sorted BED file of random sites."""
+    sites = sorted(
+        (rng.choice(["chr1", "chr2", "chr10"]), rng.randrange(500), rng.choice("+-"))
+        for _ in range(rng.randrange(1, 60))
+    )
+    sites.sort(key=lambda site: (int(site[0][3:]), site[1]))
+    return "".join(
+        f"{seqname}\t{start}\t{start}\t.\t{rng.randrange(1, 5)}\t{strand}\n"
+        for seqname, start, strand in sites
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("distance", [0, 5, 20])
+def test_count_matrix_matches_merge(
+    seed: int,
+    distance: int,
+) -> None:
+    """Test that the rows match merging the sites of all samples together."""
+    rng = random.Random(seed)  # noqa: S311
+    samples = [random_sample(rng) for _ in range(rng.randrange(1, 8))]
+    names = [f"sample{i}" for i in range(len(samples))]
+
+    outfile = StringIO()
+    count_matrix([StringIO(sample) for sample in samples], names, outfile, distance)
+    rows = [line.split("\t") for line in outfile.getvalue().splitlines()[1:]]
+
+    merged = StringIO()
+    merge_integration_sites(StringIO("".join(samples)), merged, distance)
+    merged_sites = sorted(
+        (fields[0], int(fields[1]), fields[5], int(fields[4]))
+        for fields in (line.split("\t") for line in merged.getvalue().splitlines())
+    )
+
+    assert (
+        sorted(
+            (row[0], int(row[1]), row[3], sum(int(count) for count in row[4:]))
+            for row in rows
+        )
+        == merged_sites
+    )
+
+    # Rows are position sorted
+    keys = [(int(row[0][3:]), int(row[1])) for row in rows]
+    assert keys == sorted(keys)
+
+
+def test_count_matrix_unsorted() -> None:
+    """Test that unsorted input is rejected."""
+    with pytest.raises(ValueError, match="not position sorted"):
+        count_matrix(
+            [StringIO("chr1\t200\t200\t.\t1\t+\nchr1\t100\t100\t.\t1\t+\n")],
+            ["a"],
+            StringIO(),
+        )
+
+
+@pytest.mark.parametrize(
+    "path, expected_name",
+    [
+        (Path("dir/sample1.bed"), "sample1"),
+        (Path("sample1.bed.gz"), "sample1"),
+        (Path("sample1.counts.bgz"), "sample1.counts"),
+        ("-", "stdin"),
+    ],
+)
+def test_sample_name(
+    path: Path,
+    expected_name: str,
+) -> None:
+    """Test that BED and compression suffixes are removed from sample names."""
+    assert sample_name(path) == expected_name
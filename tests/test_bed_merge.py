@@ -1,10 +1,12 @@
 """Test the bed_merge function."""
 
 from io import StringIO
+from pathlib import Path
 
 import pytest
 
-from isatoolkit2.bed.merge import merge_integration_sites
+from isatoolkit2.bed.intervals import ExcludedSites
+from isatoolkit2.bed.merge import merge_integration_sites, update_merged_sites
 
 
 @pytest.mark.parametrize(
@@ -91,3 +93,128 @@ def test_merge_bed(
 
     # Assert that the output matches the expected output
     assert output_bed == expected_output
+
+
+def test_merge_bed_keep_members() -> None:
+    """Test that the merged sites can be written as extra columns."""
+    input_bed_file = StringIO(
+        "chr1\t100\t100\ta\t1\t+\n"
+        "chr1\t102\t102\tb\t2\t+\n"
+        "chr1\t200\t200\tc\t1\t+\n",
+    )
+    output_bed_file = StringIO()
+
+    merge_integration_sites(input_bed_file, output_bed_file, keep_members=True)
+
+    assert output_bed_file.getvalue() == (
+        "chr1\t102\t102\tb\t3\t+\t100,102\t1,2\ta,b\n"
+        "chr1\t200\t200\tc\t1\t+\t200\t1\tc\n"
+    )
+
+
+@pytest.mark.parametrize(
+    "history_bed, new_bed",
+    [
+        # New sites far from all merged sites
+        (
+            ("chr1\t100\t100\t.\t1\t+\nchr1\t200\t200\t.\t1\t+\n"),
+            ("chr1\t300\t300\t.\t1\t+\nchr2\t100\t100\t.\t1\t+\n"),
+        ),
+        # New site joins a merged site and changes its position
+        (
+            ("chr1\t100\t100\t.\t1\t+\nchr1\t102\t102\t.\t1\t+\n"),
+            ("chr1\t104\t104\t.\t5\t+\n"),
+        ),
+        # New site bridges two merged sites
+        (
+            ("chr1\t100\t100\t.\t1\t+\nchr1\t110\t110\t.\t1\t+\n"),
+            ("chr1\t105\t105\t.\t1\t+\n"),
+        ),
+        # New site at the same position as a merged site, on another strand
+        (
+            ("chr1\t100\t100\ta\t2\t+\nchr1\t100\t100\tb\t2\t-\n"),
+            ("chr1\t100\t100\tc\t2\t+\n"),
+        ),
+        # No new sites
+        (
+            ("chr1\t100\t100\t.\t1\t+\nchr10\t100\t100\t.\t1\t-\n"),
+            "",
+        ),
+    ],
+    ids=[
+        "new sites not proximal",
+        "new site joins merged site",
+        "new site bridges merged sites",
+        "new site at same position",
+        "no new sites",
+    ],
+)
+def test_update_merged_sites(
+    history_bed: str,
+    new_bed: str,
+) -> None:
+    """Test that incremental merging matches merging the full history."""
+    # Merge the full history of sites
+    expected_output = StringIO()
+    merge_integration_sites(StringIO(history_bed + new_bed), expected_output)
+
+    # Merge the history with members, then fold in the new sites
+    merged_bed_file = StringIO()
+    merge_integration_sites(StringIO(history_bed), merged_bed_file, keep_members=True)
+    output_bed_file = StringIO()
+    update_merged_sites(
+        StringIO(merged_bed_file.getvalue()),
+        StringIO(new_bed),
+        output_bed_file,
+    )
+
+    assert output_bed_file.getvalue() == expected_output.getvalue()
+
+
+def test_update_merged_sites_without_members() -> None:
+    """Test that merged sites without member columns are rejected."""
+    with pytest.raises(ValueError, match="need member columns"):
+        update_merged_sites(
+            StringIO("chr1\t100\t100\t.\t1\t+\n"),
+            StringIO(),
+            StringIO(),
+        )
+
+
+def test_merge_bed_exclude(
+    tmp_path: Path,
+) -> None:
+    """Test that excluded sites are dropped before merging, and counted."""
+    exclude = tmp_path / "exclude.bed"
+    exclude.write_text("chr1\t102\t103\tvector\nchr2\t0\t1000\n")
+    input_bed = (
+        "chr1\t100\t100\t.\t1\t+\n"
+        "chr1\t102\t102\t.\t5\t+\n"
+        "chr1\t104\t104\t.\t2\t+\n"
+        "chr1\t103\t103\t.\t1\t-\n"
+        "chr2\t500\t500\t.\t3\t+\n"
+    )
+
+    output_bed_file = StringIO()
+    excluded = merge_integration_sites(
+        StringIO(input_bed),
+        output_bed_file,
+        exclude=exclude,
+    )
+
+    assert output_bed_file.getvalue() == (
+        "chr1\t104\t104\t.\t3\t+\nchr1\t103\t103\t.\t1\t-\n"
+    )
+    assert excluded == ExcludedSites(sites=2, reads=8)
+
+    # New sites are excluded when updating merged sites too
+    merged_bed_file = StringIO()
+    merge_integration_sites(StringIO(), merged_bed_file, keep_members=True)
+    output_bed_file = StringIO()
+    excluded = update_merged_sites(
+        StringIO(merged_bed_file.getvalue()),
+        StringIO(input_bed),
+        output_bed_file,
+        exclude=exclude,
+    )
+    assert excluded == ExcludedSites(sites=2, reads=8)
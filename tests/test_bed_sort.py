@@ -1,5 +1,6 @@
 """Test sorting of BED files."""
 
+import random
 from io import StringIO
 
 import pytest
@@ -151,3 +152,82 @@ def test_invalid_bed_file(
     # And capture the output
     with pytest.raises(error_type, match=error_msg):
         sort_bed(input_bed_file, output_bed_file)
+
+
+@pytest.mark.parametrize(
+    "input_bed, top, expected_output",
+    [
+        # Fewer lines than requested
+        (
+            ("chr1\t100\t100\t.\t1\t+\nchr1\t101\t101\t.\t2\t+\n"),
+            5,
+            ("chr1\t101\t101\t.\t2\t+\nchr1\t100\t100\t.\t1\t+\n"),
+        ),
+        # Keep the highest scores
+        (
+            (
+                "chr1\t100\t100\t.\t1\t+\n"
+                "chr1\t101\t101\t.\t3\t+\n"
+                "chr1\t102\t102\t.\t2\t+\n"
+                "chr1\t103\t103\t.\t4\t+\n"
+            ),
+            2,
+            ("chr1\t103\t103\t.\t4\t+\nchr1\t101\t101\t.\t3\t+\n"),
+        ),
+        # Ties are broken by position, regardless of input order
+        (
+            (
+                "chr2\t100\t100\t.\t2\t+\n"
+                "chr10\t100\t100\t.\t2\t+\n"
+                "chr1\t101\t101\t.\t2\t-\n"
+                "chr1\t101\t101\t.\t2\t+\n"
+                "chr1\t100\t100\t.\t1\t+\n"
+            ),
+            3,
+            (
+                "chr1\t101\t101\t.\t2\t+\n"
+                "chr1\t101\t101\t.\t2\t-\n"
+                "chr2\t100\t100\t.\t2\t+\n"
+            ),
+        ),
+    ],
+    ids=[
+        "fewer lines than top",
+        "keep highest scores",
+        "ties broken by position",
+    ],
+)
+def test_top_score_sorting(
+    input_bed: str,
+    top: int,
+    expected_output: str,
+) -> None:
+    """Test that only the top scoring lines are output."""
+    input_bed_file = StringIO(input_bed)
+    output_bed_file = StringIO()
+
+    sort_bed(input_bed_file, output_bed_file, sort_by="score", top=top)
+
+    assert output_bed_file.getvalue() == expected_output
+
+
+def test_top_position_sorting() -> None:
+    """Test that top selection is rejected when sorting by position."""
+    with pytest.raises(ValueError, match="only supported when sorting by score"):
+        sort_bed(StringIO(), StringIO(), sort_by="position", top=1)
+
+
+def test_top_all_lines_score_sorting() -> None:
+    """Test that selecting all lines gives the same order as the full score sort."""
+    rng = random.Random(7)  # noqa: S311
+    input_bed = "".join(
+        f"chr{rng.choice([1, 2, 10])}\t{rng.randrange(100)}\t0\t.\t"
+        f"{rng.randint(1, 3)}\t{rng.choice('+-')}\n"
+        for _ in range(500)
+    )
+    full_output = StringIO()
+    sort_bed(StringIO(input_bed), full_output, sort_by="score")
+    top_output = StringIO()
+    sort_bed(StringIO(input_bed), top_output, sort_by="score", top=500)
+
+    assert top_output.getvalue() == full_output.getvalue()
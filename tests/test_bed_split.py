@@ -0,0 +1,114 @@
+"""Test splitting BED outputs by contig."""
+
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from isatoolkit2.bed.merge import merge_integration_sites
+from isatoolkit2.bed.split import ContigSplitWriter, open_split_output, split_file_name
+
+BED = (
+    "chr2\t100\t100\t.\t3\t+\n"
+    "chr1\t100\t100\t.\t1\t+\n"
+    "chr2\t103\t103\t.\t5\t-\n"
+    "chrUn/1\t7\t7\t.\t1\t+\n"
+    "chr1\t300\t300\t.\t2\t-\n"
+    "chr3\t5\t5\t.\t4\t+\n"
+    "chr2\t200\t200\t.\t4\t+\n"
+)
+
+
+@pytest.mark.parametrize(
+    "by_strand, expected",
+    [
+        (
+            False,
+            {
+                "chr1.bed": [1, 4],
+                "chr2.bed": [0, 2, 6],
+                "chr3.bed": [5],
+                "chrUn%2F1.bed": [3],
+            },
+        ),
+        (
+            True,
+            {
+                "chr1.minus.bed": [4],
+                "chr1.plus.bed": [1],
+                "chr2.minus.bed": [2],
+                "chr2.plus.bed": [0, 6],
+                "chr3.plus.bed": [5],
+                "chrUn%2F1.plus.bed": [3],
+            },
+        ),
+    ],
+    ids=["by contig", "by contig and strand"],
+)
+@pytest.mark.parametrize(
+    "max_open, buffer_size",
+    [(64, 1 << 20), (2, 0), (1, 10)],
+    ids=["all open", "evicting unbuffered", "one open"],
+)
+def test_split_writer(
+    by_strand: bool,  # noqa: FBT001
+    expected: dict[str, list[int]],
+    max_open: int,
+    buffer_size: int,
+    tmp_path: Path,
+) -> None:
+    """Test that each line is written to its file, in order, however it's chunked."""
+    lines = BED.splitlines(keepends=True)
+    with ContigSplitWriter(
+        tmp_path,
+        by_strand=by_strand,
+        max_open=max_open,
+        buffer_size=buffer_size,
+    ) as writer:
+        # Chunks that split lines, as a text wrapper would write them
+        data = BED.encode()
+        for start in range(0, len(data), 9):
+            writer.write(data[start : start + 9])
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(expected)
+    for name, indices in expected.items():
+        assert (tmp_path / name).read_text() == "".join(lines[i] for i in indices)
+
+
+def test_split_merged_sites(
+    tmp_path: Path,
+) -> None:
+    """Test that splitting a merged output gives the lines of each contig."""
+    whole = StringIO()
+    merge_integration_sites(StringIO(BED), whole, distance=5)
+    outdir = tmp_path / "split"
+    with open_split_output(outdir) as outfile:
+        merge_integration_sites(StringIO(BED), outfile, distance=5)
+
+    for path in outdir.iterdir():
+        contig = path.name.removesuffix(".bed").replace("%2F", "/")
+        assert path.read_text() == "".join(
+            line
+            for line in whole.getvalue().splitlines(keepends=True)
+            if line.split("\t")[0] == contig
+        )
+
+
+@pytest.mark.parametrize(
+    "contig, strand, expected",
+    [
+        ("chr1", None, "chr1.bed"),
+        ("chr1", "plus", "chr1.plus.bed"),
+        ("HLA-A*01:01", None, "HLA-A*01:01.bed"),
+        ("a/b%c", None, "a%2Fb%25c.bed"),
+        ("..", None, "%2E..bed"),
+    ],
+    ids=["contig", "strand", "colons", "slash and percent", "dots"],
+)
+def test_split_file_name(
+    contig: str,
+    strand: None | str,
+    expected: str,
+) -> None:
+    """Test that contig names are made safe as file names."""
+    assert split_file_name(contig, strand) == expected
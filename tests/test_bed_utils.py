@@ -1,8 +1,10 @@
 """Bed utils tests."""
 
+import random
+
 import pytest
 
-from isatoolkit2.bed.bed_utils import natural_key
+from isatoolkit2.bed.bed_utils import BedLine, Strand, natural_key, sort_by_position
 
 
 @pytest.mark.parametrize(
@@ -31,3 +33,42 @@ def test_natural_key(
     """Test the natural_key function with various input strings."""
     result = natural_key(input_str)
     assert result == expected_output
+
+
+@pytest.mark.parametrize(
+    "strand_first",
+    [False, True],
+    ids=["chromosome, start, strand", "chromosome, strand, start"],
+)
+def test_sort_by_position(
+    *,
+    strand_first: bool,
+) -> None:
+    """Test that the packed key sort matches sorting on natural keys."""
+    rng = random.Random(42)  # noqa: S311
+    seqnames = ["chr1", "Chr1", "chr2", "chr10", "chrX", "chrUn_1", "scaffold_2"]
+    lines = [
+        BedLine(
+            seqname=rng.choice(seqnames),
+            start=rng.randrange(0, 2**40 if i % 10 == 0 else 50),
+            end=0,
+            name=str(i),
+            score=1,
+            strand=rng.choice([Strand.PLUS, Strand.MINUS]),
+        )
+        for i in range(2000)
+    ]
+
+    if strand_first:
+        expected = sorted(
+            lines,
+            key=lambda line: (natural_key(line.seqname), line.strand, line.start),
+        )
+    else:
+        expected = sorted(
+            lines,
+            key=lambda line: (natural_key(line.seqname), line.start, line.strand),
+        )
+
+    sort_by_position(lines, strand_first=strand_first)
+    assert [line.name for line in lines] == [line.name for line in expected]
@@ -0,0 +1,98 @@
+"""Test reading and writing gzip/BGZF compressed text files."""
+
+import gzip
+import struct
+from collections.abc import Callable
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.bgzf import (
+    BGZF_BLOCK_SIZE,
+    BGZF_EOF,
+    open_text_input,
+    open_text_output,
+)
+
+BED_LINES = "".join(
+    f"chr{i % 22 + 1}\t{i}\t{i}\t.\t{i % 7 + 1}\t{'+-'[i % 2]}\n"
+    for i in range(20000)
+)
+
+
+def read_block_sizes(data: bytes) -> list[int]:
+    """Get the size of each BGZF block from the BSIZE fields."""
+    sizes = []
+    offset = 0
+    while offset < len(data):
+        (bsize,) = struct.unpack_from("<H", data, offset + 16)
+        sizes.append(bsize + 1)
+        offset += bsize + 1
+    return sizes
+
+
+@pytest.mark.parametrize(
+    "threads",
+    [1, 4],
+    ids=["single thread", "multiple threads"],
+)
+def test_bgzf_output(
+    threads: int,
+    tmp_path: Path,
+) -> None:
+    """Test that '.gz' outputs are valid BGZF files."""
+    output_file = tmp_path / "output.bed.gz"
+    with open_text_output(output_file, threads=threads) as f:
+        f.write(BED_LINES)
+
+    data = output_file.read_bytes()
+
+    # The file is readable as a gzip file and ends with the BGZF EOF block.
+    assert gzip.decompress(data).decode() == BED_LINES
+    assert data.endswith(BGZF_EOF)
+
+    # Every block fits in the BGZF block size limit,
+    # and more than one block is needed for this input.
+    block_sizes = read_block_sizes(data)
+    assert sum(block_sizes) == len(data)
+    assert len(block_sizes) > 2  # noqa: PLR2004
+    assert max(block_sizes) <= BGZF_BLOCK_SIZE + 0xFF
+
+    # htslib can read the file back.
+    with pysam.BGZFile(str(output_file), "rb", index=None) as f:
+        assert f.read().decode() == BED_LINES
+
+
+def test_plain_output(
+    tmp_path: Path,
+) -> None:
+    """Test that outputs without a '.gz' suffix are not compressed."""
+    output_file = tmp_path / "output.bed"
+    with open_text_output(output_file, threads=2) as f:
+        f.write(BED_LINES)
+
+    assert output_file.read_text() == BED_LINES
+
+
+@pytest.mark.parametrize(
+    "filename, compress",
+    [
+        ("input.bed", None),
+        ("input.bed.gz", gzip.compress),
+        ("input.bed", gzip.compress),
+    ],
+    ids=["plain", "gzip", "gzip without suffix"],
+)
+def test_text_input(
+    filename: str,
+    compress: None | Callable[[bytes], bytes],
+    tmp_path: Path,
+) -> None:
+    """Test that compressed inputs are detected from the content."""
+    input_file = tmp_path / filename
+    data = BED_LINES.encode()
+    input_file.write_bytes(compress(data) if compress else data)
+
+    with open_text_input(input_file) as f:
+        assert f.read() == BED_LINES
@@ -0,0 +1,193 @@
+"""Test the content-addressed result cache."""
+
+import os
+from pathlib import Path
+from typing import Literal
+
+import pytest
+
+from isatoolkit2.cache import ResultCache, run_cached
+
+
+class CountingCommand:
+
+    """Command that writes its input upper-cased and counts its runs."""
+
+    def __init__(self, infile: Path) -> None:
+        """Initialize the command with its input file."""
+        self.infile = infile
+        self.runs = 0
+
+    def __call__(self, output: Literal["-"] | Path) -> str:
+        """Write the upper-cased input to the output file, and report the run."""
+        self.runs += 1
+        Path(output).write_text(self.infile.read_text().upper())
+        return f"Wrote {self.infile.name}\n"
+
+
+@pytest.fixture
+def infile(tmp_path: Path) -> Path:
+    """Create an input file."""
+    infile = tmp_path / "input.bed"
+    infile.write_text("chr1\t100\t100\t.\t1\t+\n")
+    return infile
+
+
+def test_cache_hit(
+    infile: Path,
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Test that a repeated run reuses the cached output and replays its report."""
+    command = CountingCommand(infile)
+    for i in range(2):
+        run_cached(
+            command,
+            tmp_path / f"output_{i}.bed",
+            cache_dir=tmp_path / "cache",
+            command="test",
+            params={"option": 1},
+            inputs=[infile],
+        )
+
+    assert command.runs == 1
+    assert (tmp_path / "output_1.bed").read_text() == "CHR1\t100\t100\t.\t1\t+\n"
+    assert capsys.readouterr().err == "Wrote input.bed\nWrote input.bed\n"
+
+
+@pytest.mark.parametrize(
+    "change",
+    ["input", "params", "command"],
+    ids=["input changed", "parameters changed", "command changed"],
+)
+def test_cache_miss(
+    change: str,
+    infile: Path,
+    tmp_path: Path,
+) -> None:
+    """Test that changing the input, parameters or command recomputes."""
+    command = CountingCommand(infile)
+    run_cached(
+        command,
+        tmp_path / "output.bed",
+        cache_dir=tmp_path / "cache",
+        command="test",
+        params={"option": 1},
+        inputs=[infile],
+    )
+
+    if change == "input":
+        infile.write_text("chr2\t100\t100\t.\t1\t+\n")
+    run_cached(
+        command,
+        tmp_path / "output.bed",
+        cache_dir=tmp_path / "cache",
+        command="other" if change == "command" else "test",
+        params={"option": 2 if change == "params" else 1},
+        inputs=[infile],
+    )
+
+    assert command.runs == 2  # noqa: PLR2004
+    assert (tmp_path / "output.bed").read_text() == infile.read_text().upper()
+
+
+def test_cache_skipped_for_stdin(
+    infile: Path,
+    tmp_path: Path,
+) -> None:
+    """Test that nothing is cached when reading from stdin."""
+    command = CountingCommand(infile)
+    for _ in range(2):
+        run_cached(
+            command,
+            tmp_path / "output.bed",
+            cache_dir=tmp_path / "cache",
+            command="test",
+            params={},
+            inputs=["-"],
+        )
+
+    assert command.runs == 2  # noqa: PLR2004
+    assert not (tmp_path / "cache").exists()
+
+
+def test_cache_eviction(
+    tmp_path: Path,
+) -> None:
+    """Test that the least recently used entries are evicted first."""
+    cache = ResultCache(tmp_path / "cache", max_size=25)
+
+    # Store two 10 byte entries, and use the older one before storing a third
+    for i, key in enumerate(["a", "b"]):
+        path = cache.temporary_path()
+        path.write_bytes(b"0123456789")
+        os.utime(path, (i, i))
+        cache.store(key, path)
+    assert cache.fetch("a", tmp_path / "output.bed") is not None
+
+    path = cache.temporary_path()
+    path.write_bytes(b"0123456789")
+    cache.store("c", path)
+
+    assert sorted(p.name for p in cache.cache_dir.iterdir()) == [".lock", "a", "c"]
+
+
+def test_cache_report_eviction(
+    tmp_path: Path,
+) -> None:
+    """Test that reports count towards the cache size and are evicted with outputs."""
+    cache = ResultCache(tmp_path / "cache", max_size=25)
+
+    # Two entries of 5 byte outputs and 5 byte reports, the older one is evicted
+    for i, key in enumerate(["a", "b", "c"]):
+        path = cache.temporary_path()
+        path.write_bytes(b"01234")
+        cache.store(key, path, "line\n")
+        os.utime(cache.cache_dir / key, (i, i))
+    assert cache.fetch("a", tmp_path / "output.bed") is None
+
+    assert sorted(p.name for p in cache.cache_dir.iterdir()) == [
+        ".lock",
+        "b",
+        "b.report",
+        "c",
+        "c.report",
+    ]
+    assert cache.fetch("b", tmp_path / "output.bed") == "line\n"
+
+    # Reports left without an output are removed
+    (cache.cache_dir / "b").unlink()
+    cache.evict()
+    assert not (cache.cache_dir / "b.report").exists()
+
+
+def test_cache_report_values(
+    infile: Path,
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Test that report values outside the key are filled in on a cache hit."""
+    runs = 0
+
+    def command(output: Literal["-"] | Path) -> str:
+        nonlocal runs
+        runs += 1
+        Path(output).write_text(infile.read_text())
+        return "Excluded 1 site overlapping $exclude\n"
+
+    for exclude in ("first.bed", "second.bed"):
+        run_cached(
+            command,
+            tmp_path / "output.bed",
+            cache_dir=tmp_path / "cache",
+            command="test",
+            params={},
+            inputs=[infile],
+            report_values={"exclude": exclude},
+        )
+
+    assert runs == 1
+    assert capsys.readouterr().err == (
+        "Excluded 1 site overlapping first.bed\n"
+        "Excluded 1 site overlapping second.bed\n"
+    )
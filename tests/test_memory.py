@@ -0,0 +1,75 @@
+"""Test the memory report."""
+
+import json
+import tracemalloc
+from io import StringIO
+from pathlib import Path
+
+from isatoolkit2.bed.merge import merge_integration_sites
+from isatoolkit2.memory import IGNORED_FILES, MemoryReport, allocation_sites
+
+BED = (
+    "chr1\t100\t100\t.\t3\t+\n"
+    "chr1\t102\t102\t.\t5\t+\n"
+    "chr2\t100\t100\t.\t1\t-\n"
+)
+
+
+def test_memory_report(
+    tmp_path: Path,
+) -> None:
+    """Test that a stage reports its peak and top allocation sites."""
+    report = MemoryReport("test", top=1)
+    with report.stage("allocate"):
+        data = [bytearray(1024) for _ in range(1000)]
+    report_path = tmp_path / "report.json"
+    report.write(report_path)
+
+    result = json.loads(report_path.read_text())
+    (stage,) = result["stages"]
+    assert len(data) == 1000  # noqa: PLR2004
+    assert result["command"] == "test"
+    assert result["peak_rss_bytes"] > 0
+    assert stage["name"] == "allocate"
+    assert stage["traced_peak_bytes"] >= 1000 * 1024
+    assert stage["top_allocations"][0]["site"].startswith(f"{__file__}:")
+
+
+def test_merge_memory_report(
+    tmp_path: Path,
+) -> None:
+    """Test that merging reports its stages without changing the output."""
+    expected = StringIO()
+    merge_integration_sites(StringIO(BED), expected)
+
+    report = MemoryReport("bed merge")
+    output = StringIO()
+    merge_integration_sites(StringIO(BED), output, memory=report)
+    report.write(tmp_path / "report.json")
+
+    result = json.loads((tmp_path / "report.json").read_text())
+    assert output.getvalue() == expected.getvalue()
+    assert [stage["name"] for stage in result["stages"]] == [
+        "parse",
+        "sort",
+        "group",
+        "merge",
+        "write",
+    ]
+
+
+def test_allocation_sites(
+    tmp_path: Path,
+) -> None:
+    """Test that the top allocation sites skip tracemalloc and imports."""
+    report = MemoryReport("test")
+    data = [bytearray(1024) for _ in range(1000)]
+    snapshot = tracemalloc.take_snapshot()
+    report.write(tmp_path / "report.json")
+
+    sites = allocation_sites(snapshot)
+    assert len(data) == 1000  # noqa: PLR2004
+    assert sites[0]["site"].startswith(f"{__file__}:")
+    assert not any(
+        site["site"].startswith(tuple(IGNORED_FILES)) for site in sites
+    )
@@ -0,0 +1,104 @@
+"""Test progress reporting."""
+
+from io import StringIO
+from pathlib import Path
+
+import pytest
+
+from isatoolkit2 import progress
+from isatoolkit2.progress import ProgressReporter
+from isatoolkit2.sam.count import count_sites
+
+
+class FakeClock:
+
+    """Monotonic clock advanced by the test."""
+
+    def __init__(self) -> None:
+        """Start at zero."""
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the current time."""
+        return self.now
+
+
+@pytest.mark.parametrize(
+    "total_records, total_bytes, expected_report",
+    [
+        (
+            None,
+            None,
+            "100 records, 10 records/s, 250.0 B read\n",
+        ),
+        (
+            None,
+            1000,
+            (
+                "100 records, 10 records/s, 250.0 B of 1000.0 B read, "
+                "25.0% done, ETA 0:00:30\n"
+            ),
+        ),
+        (
+            400,
+            1000,
+            (
+                "100 records, 10 records/s, 250.0 B of 1000.0 B read, "
+                "25.0% done, ETA 0:00:30\n"
+            ),
+        ),
+        (
+            200,
+            1000,
+            (
+                "100 records, 10 records/s, 250.0 B of 1000.0 B read, "
+                "50.0% done, ETA 0:00:10\n"
+            ),
+        ),
+    ],
+    ids=["no totals", "file size", "index counts", "index counts before size"],
+)
+def test_progress_report(
+    total_records: None | int,
+    total_bytes: None | int,
+    expected_report: str,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that reports are throttled and estimate the ETA."""
+    clock = FakeClock()
+    monkeypatch.setattr(progress.time, "monotonic", clock)
+    stream = StringIO()
+    reporter = ProgressReporter(
+        total_records=total_records,
+        total_bytes=total_bytes,
+        tell=lambda: 250,
+        interval=10,
+        stream=stream,
+    )
+
+    # Nothing is reported before the interval has passed
+    clock.now = 5
+    reporter.update(50)
+    assert stream.getvalue() == ""
+
+    clock.now = 10
+    reporter.update(50)
+    assert stream.getvalue() == expected_report
+
+
+def test_count_progress(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Test that counting with progress reports the total on stderr."""
+    input_sam_path = tmp_path / "input.sam"
+    input_sam_path.write_text(
+        "@HD\tVN:1.6\tSO:coordinate\n"
+        "@SQ\tSN:chr1\tLN:1000\n"
+        "read1\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        "read2\t128\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n",
+    )
+
+    count_sites(input_sam_path, progress=True)
+
+    assert capsys.readouterr().err.startswith("Processed 2 records in 0:00:00")
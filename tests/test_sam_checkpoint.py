@@ -0,0 +1,175 @@
+"""Test checkpoints and resuming sam count."""
+
+import os
+from io import StringIO
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam import count
+from isatoolkit2.sam.count import count_integration_sites
+from isatoolkit2.sam.pipeline import BATCH_SIZE
+from isatoolkit2.sam.saturation import SaturationCurve
+
+# Reads in the test input, enough for several batches
+NUM_READS = 5500
+
+# Batches counted before the first count is interrupted
+INTERRUPTED_AFTER = 3
+
+
+def write_alignments(
+    path: Path,
+    mode: str,
+) -> None:
+    """Write R1 and R2 reads at a spread of positions and strands."""
+    header = {
+        "HD": {"VN": "1.6"},
+        "SQ": [{"SN": "chr1", "LN": 100_000}, {"SN": "chr2", "LN": 100_000}],
+    }
+    with pysam.AlignmentFile(str(path), mode, header=header) as handle:
+        for i in range(NUM_READS):
+            read = pysam.AlignedSegment(handle.header)
+            read.query_name = f"read{i}"
+            read.flag = (16 if i % 3 == 0 else 0) | (128 if i % 7 == 0 else 64)
+            read.reference_id = i % 2
+            read.reference_start = 1 + (i * 37) % 2000
+            read.cigarstring = "5M"
+            read.query_sequence = "AGCTT"
+            read.mapping_quality = 60
+            handle.write(read)
+
+
+@pytest.mark.parametrize(
+    "suffix, mode, threads",
+    [(".bam", "wb", 1), (".bam", "wb", 4), (".sam", "w", 1), (".sam", "w", 2)],
+    ids=["BAM", "BAM threaded", "SAM", "SAM threaded"],
+)
+def test_resume(
+    suffix: str,
+    mode: str,
+    threads: int,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that a resumed count has the same output as an uninterrupted one."""
+    input_path = tmp_path / f"input{suffix}"
+    write_alignments(input_path, mode)
+    checkpoint = tmp_path / "count.ckpt"
+
+    expected = StringIO()
+    count_integration_sites(input_path, expected)
+
+    # Interrupt counting after a few batches, saving a checkpoint after each
+    count_batch = count._count_batch  # noqa: SLF001
+    batches_counted = 0
+
+    def interrupted_count_batch(
+        batch: list[pysam.AlignedSegment],
+        counts: count.PositionCounts,
+        saturation: None | SaturationCurve,
+    ) -> None:
+        nonlocal batches_counted
+        if batches_counted == INTERRUPTED_AFTER:
+            raise KeyboardInterrupt
+        batches_counted += 1
+        count_batch(batch, counts, saturation)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(count, "_count_batch", interrupted_count_batch)
+        with pytest.raises(KeyboardInterrupt):
+            count_integration_sites(
+                input_path,
+                StringIO(),
+                threads=threads,
+                checkpoint=checkpoint,
+                checkpoint_interval=0,
+            )
+    assert checkpoint.exists()
+
+    # Only the batches after the checkpoint are counted on resume
+    resumed_batches = []
+
+    def counting_count_batch(
+        batch: list[pysam.AlignedSegment],
+        counts: count.PositionCounts,
+        saturation: None | SaturationCurve,
+    ) -> None:
+        resumed_batches.append(batch)
+        count_batch(batch, counts, saturation)
+
+    monkeypatch.setattr(count, "_count_batch", counting_count_batch)
+    output = StringIO()
+    count_integration_sites(
+        input_path,
+        output,
+        threads=threads,
+        checkpoint=checkpoint,
+        resume=True,
+    )
+
+    assert output.getvalue() == expected.getvalue()
+    resumed_reads = sum(len(batch) for batch in resumed_batches)
+    assert resumed_reads == NUM_READS - INTERRUPTED_AFTER * BATCH_SIZE
+    assert not checkpoint.exists()
+
+
+def test_resume_changed_input(
+    tmp_path: Path,
+) -> None:
+    """Test that a checkpoint isn't resumed on a changed input file."""
+    input_path = tmp_path / "input.bam"
+    write_alignments(input_path, "wb")
+    checkpoint = tmp_path / "count.ckpt"
+    counts = count.count_sites(input_path, checkpoint=checkpoint)
+    assert counts.r1_total > 0
+    assert checkpoint.exists()
+
+    # A different modification time marks a different input
+    stat = input_path.stat()
+    os.utime(input_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    with pytest.raises(ValueError, match="different input file"):
+        count.count_sites(input_path, checkpoint=checkpoint, resume=True)
+
+
+@pytest.mark.parametrize(
+    "subsample, seed",
+    [(None, 0), (0.25, 1), (0.5, 2)],
+    ids=["no subsample", "other fraction", "other seed"],
+)
+def test_resume_changed_subsample(
+    subsample: None | float,
+    seed: int,
+    tmp_path: Path,
+) -> None:
+    """Test that a checkpoint isn't resumed with a different subsample."""
+    input_path = tmp_path / "input.bam"
+    write_alignments(input_path, "wb")
+    checkpoint = tmp_path / "count.ckpt"
+    counts = count.count_sites(
+        input_path,
+        checkpoint=checkpoint,
+        subsample=0.5,
+        seed=1,
+    )
+    assert checkpoint.exists()
+
+    with pytest.raises(ValueError, match="different --subsample or --seed"):
+        count.count_sites(
+            input_path,
+            checkpoint=checkpoint,
+            resume=True,
+            subsample=subsample,
+            seed=seed,
+        )
+
+    # The same options resume the checkpoint
+    resumed = count.count_sites(
+        input_path,
+        checkpoint=checkpoint,
+        resume=True,
+        subsample=0.5,
+        seed=1,
+    )
+    assert resumed.r1_total == counts.r1_total
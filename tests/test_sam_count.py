@@ -5,6 +5,7 @@ from pathlib import Path
 
 import pytest
 
+from isatoolkit2.bed.intervals import ExcludedSites
 from isatoolkit2.sam.count import count_integration_sites
 
 
@@ -111,9 +112,11 @@ from isatoolkit2.sam.count import count_integration_sites
         "1x R1 read, 1x R2 read, + strand",
     ],
 )
+@pytest.mark.parametrize("threads", [1, 2], ids=["1 thread", "2 threads"])
 def test_sam_count(
     input_sam: str,
     expected_output: str,
+    threads: int,
     tmp_path: Path,
 ) -> None:
     """Test the count_integration_sites function."""
@@ -126,10 +129,40 @@ def test_sam_count(
     output_bed_file = StringIO()
 
     # Call the function with the temporary files
-    count_integration_sites(input_sam_path, output_bed_file)
+    count_integration_sites(input_sam_path, output_bed_file, threads=threads)
 
     # Get the output as a string
     output_bed = output_bed_file.getvalue()
 
     # Check if the output matches the expected output
     assert output_bed == expected_output
+
+
+def test_sam_count_exclude(
+    tmp_path: Path,
+) -> None:
+    """Test that sites in excluded intervals are dropped and counted."""
+    input_sam_path = tmp_path / "input.sam"
+    input_sam_path.write_text(
+        "@HD\tVN:1.6\tSO:coordinate\n"
+        "@SQ\tSN:chr1\tLN:1000\n"
+        "@SQ\tSN:chr2\tLN:1000\n"
+        "read1\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        "read2\t80\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        "read3\t80\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        "read4\t64\tchr2\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n",
+    )
+    exclude = tmp_path / "exclude.bed"
+    exclude.write_text("chr1\t103\t200\n")
+
+    output_bed_file = StringIO()
+    counts = count_integration_sites(
+        input_sam_path,
+        output_bed_file,
+        exclude=exclude,
+    )
+
+    assert output_bed_file.getvalue() == (
+        "chr1\t99\t99\t.\t1\t+\nchr2\t99\t99\t.\t1\t+\n"
+    )
+    assert counts.excluded == ExcludedSites(sites=1, reads=2)
@@ -0,0 +1,179 @@
+"""Test filtering reads by expressions."""
+
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam.expression_filter import ReadExpression, expression_filtering
+from isatoolkit2.sam.sam_utils import ReadDecision
+
+HEADER = "@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:1000\n"
+
+READS = (
+    "read1\t99\tchr1\t100\t60\t3S7M\t=\t200\t110\t*\t*\tNM:i:1\n"
+    "read2\t65\tchr1\t100\t10\t10M\t*\t0\t0\t*\t*\tXA:Z:chr1,+500,10M,0;\n"
+    "read3\t4\t*\t0\t0\t*\t*\t0\t0\t*\t*\n"
+    "read4\t81\tchr1\t300\t40\t2M8S\t*\t0\t0\t*\t*\tNM:i:4\n"
+)
+
+
+def parse_read(
+    line: str,
+) -> pysam.AlignedSegment:
+    """Parse a SAM line into a read."""
+    header = pysam.AlignmentHeader.from_text(HEADER)
+    return pysam.AlignedSegment.fromstring(line.rstrip("\n"), header)
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("mapq >= 20", [True, False, False, True]),
+        ("not tag(XA)", [True, False, True, True]),
+        ("softclip5 <= 5", [True, True, True, False]),
+        ("proper_pair or (read1 and not reverse)", [True, True, False, False]),
+        ("nm <= 3", [True, False, False, False]),
+        ("100 <= tlen < 200 and pos == 100", [True, False, False, False]),
+        ("not unmapped and (mapq > 30 or tag(XA))", [True, True, False, True]),
+        ("flag == 4 or length > -1", [True, True, True, True]),
+    ],
+    ids=[
+        "mapq",
+        "tag",
+        "softclip",
+        "flags",
+        "missing tag",
+        "chained comparison",
+        "nested",
+        "flag and negative number",
+    ],
+)
+def test_read_expression(
+    expression: str,
+    expected: list[bool],
+) -> None:
+    """Test that expressions keep the matching reads."""
+    decide = ReadExpression(expression)
+    decisions = [decide(parse_read(line)) for line in READS.splitlines()]
+    assert decisions == [
+        ReadDecision.KEEP if keep else ReadDecision.DISCARD for keep in expected
+    ]
+
+
+@pytest.mark.parametrize(
+    "expression, message",
+    [
+        ("mapq >=", "invalid syntax"),
+        ("mapq", "must be compared"),
+        ("__import__('os')", "unsupported"),
+        ("mapq >= x", "unsupported"),
+        ("tag(XAA)", "unsupported"),
+        ("proper_pair == 1", "unsupported"),
+        ("read.flag > 0", "unsupported"),
+        ("mapq >= True", "unsupported"),
+        ("mapq in (1, 2)", "unsupported"),
+    ],
+    ids=[
+        "syntax error",
+        "bare numeric field",
+        "call",
+        "unknown field",
+        "tag name",
+        "compared flag field",
+        "attribute",
+        "boolean constant",
+        "membership",
+    ],
+)
+def test_invalid_expression(
+    expression: str,
+    message: str,
+) -> None:
+    """Test that expressions outside the grammar are rejected."""
+    with pytest.raises(ValueError, match=message):
+        ReadExpression(expression)
+
+
+def test_reasons_in_evaluation_order() -> None:
+    """Test that reads are counted by the first clause evaluated, FLAG first."""
+    decide = ReadExpression("mapq >= 20 and tag(NM) and not unmapped")
+    for line in READS.splitlines():
+        decide(parse_read(line))
+
+    # The unmapped read fails all clauses, but FLAG clauses are checked first
+    assert decide.reasons == {"mapq >= 20": 1, "not unmapped": 1}
+
+
+@pytest.mark.parametrize("workers", [1, 2], ids=["1 worker", "2 workers"])
+def test_expression_filtering(
+    workers: int,
+    tmp_path: Path,
+) -> None:
+    """Test that the counts per clause are the same with worker processes."""
+    input_path = tmp_path / "input.sam"
+    input_path.write_text(HEADER + READS * 3)
+    output_path = tmp_path / "output.sam"
+    discarded_path = tmp_path / "discarded.sam"
+
+    counts = expression_filtering(
+        input_path,
+        output_path,
+        "sam",
+        "not unmapped and not tag(XA) and softclip5 <= 5",
+        discarded_path,
+        workers=workers,
+    )
+
+    assert counts.total == 12  # noqa: PLR2004
+    assert counts.passing == 3  # noqa: PLR2004
+    assert counts.failed == {
+        "not unmapped": 3,
+        "not tag(XA)": 3,
+        "softclip5 <= 5": 3,
+    }
+    with pysam.AlignmentFile(str(output_path)) as handle:
+        assert [read.query_name for read in handle] == ["read1"] * 3
+    with pysam.AlignmentFile(str(discarded_path)) as handle:
+        assert len(list(handle)) == 9  # noqa: PLR2004
+
+
+@pytest.mark.parametrize(
+    "mate_buffer_size",
+    [1, 1000],
+    ids=["spilled mates", "mates in memory"],
+)
+def test_expression_filtering_drop_mates(
+    mate_buffer_size: int,
+    tmp_path: Path,
+) -> None:
+    """Test that each read is counted once, however many reads are spilled."""
+    # R1 reads, half with a low MAPQ, followed by their R2 mates
+    records = [
+        f"pair{i}\t{flag}\tchr1\t{start}\t{mapq}\t10M\t=\t{mate_start}\t0\t*\t*\n"
+        for i in range(20)
+        for flag, start, mapq, mate_start in [
+            (65, 1 + i * 10, 10 if i % 2 else 60, 500 + i * 10),
+            (129, 500 + i * 10, 60, 1 + i * 10),
+        ]
+    ]
+    input_path = tmp_path / "input.sam"
+    input_path.write_text(
+        "@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:1000\n"
+        + "".join(sorted(records, key=lambda record: int(record.split("\t")[3]))),
+    )
+    output_path = tmp_path / "output.sam"
+
+    counts = expression_filtering(
+        input_path,
+        output_path,
+        "sam",
+        "mapq >= 20",
+        drop_mates=True,
+        mate_buffer_size=mate_buffer_size,
+    )
+
+    assert counts.total == 40  # noqa: PLR2004
+    assert counts.failed == {"mapq >= 20": 10}
+    with pysam.AlignmentFile(str(output_path)) as handle:
+        assert len(list(handle)) == 20  # noqa: PLR2004
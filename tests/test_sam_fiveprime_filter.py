@@ -2,9 +2,10 @@
 
 from pathlib import Path
 
+import pysam
 import pytest
 
-from isatoolkit2.sam.fiveprime_filter import fiveprime_filter
+from isatoolkit2.sam.fiveprime_filter import fiveprime_filter, softclipped_bases
 
 
 @pytest.mark.parametrize(
@@ -116,3 +117,39 @@ def test_fiveprime_filter(
         output_data = f.read()
 
     assert output_data == expected_output
+
+
+@pytest.mark.parametrize(
+    "flag, cigar, expected_softclip",
+    [
+        (64, "10M", 0),
+        (64, "6S4M", 6),
+        (64, "4M6S", 0),
+        (80, "4M6S", 6),
+        (80, "6S4M", 0),
+        (64, "2H6S4M", 0),
+        (64, "*", None),
+    ],
+    ids=[
+        "+ strand, no softclip",
+        "+ strand, 5' softclip",
+        "+ strand, 3' softclip",
+        "- strand, 5' softclip",
+        "- strand, 3' softclip",
+        "+ strand, hardclip before softclip",
+        "no CIGAR",
+    ],
+)
+def test_softclipped_bases(
+    flag: int,
+    cigar: str,
+    expected_softclip: int | None,
+) -> None:
+    """Test that only the terminal 5' CIGAR operation is counted."""
+    header = pysam.AlignmentHeader.from_dict({"SQ": [{"SN": "chr1", "LN": 1000}]})
+    read = pysam.AlignedSegment.fromstring(
+        f"read1\t{flag}\tchr1\t100\t60\t{cigar}\t*\t0\t0\t*\t*",
+        header,
+    )
+
+    assert softclipped_bases(read) == expected_softclip
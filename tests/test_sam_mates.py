@@ -0,0 +1,219 @@
+"""Test applying read filter decisions to both mates of read pairs."""
+
+import random
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam import mates
+from isatoolkit2.sam.fiveprime_filter import fiveprime_filter
+from isatoolkit2.sam.mates import PendingPairs, decide_mates
+from isatoolkit2.sam.sam_utils import ReadDecision
+
+HEADER = pysam.AlignmentHeader.from_dict(
+    {
+        "HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": "chr1", "LN": 100_000}, {"SN": "chr2", "LN": 100_000}],
+    },
+)
+
+
+def make_reads(seed: int) -> list[pysam.AlignedSegment]:
+    """Make position sorted read pairs with near and distant mates."""
+    rng = random.Random(seed)  # noqa: S311
+    records = []
+    for i in range(200):
+        name = f"pair{i}"
+        if rng.random() < 0.1:  # noqa: PLR2004
+            # Unpaired read
+            records.append((rng.randrange(100_000), name, 0))
+            continue
+        start = rng.randrange(90_000)
+        mate_start = start + rng.choice([0, 50, 300, 50_000])
+        records.append((start, name, pysam.FPAIRED | pysam.FREAD1))
+        if rng.random() < 0.9:  # noqa: PLR2004
+            # Some mates are missing from the input
+            records.append((mate_start, name, pysam.FPAIRED | pysam.FREAD2))
+        if rng.random() < 0.1:  # noqa: PLR2004
+            secondary_flag = pysam.FPAIRED | pysam.FREAD1 | pysam.FSECONDARY
+            records.append((mate_start + 10, name, secondary_flag))
+    records.sort()
+    return [
+        pysam.AlignedSegment.fromstring(
+            f"{name}\t{flag}\tchr1\t{start + 1}\t60\t10M\t*\t0\t0\t*\t*",
+            HEADER,
+        )
+        for start, name, flag in records
+    ]
+
+
+def decide(read: pysam.AlignedSegment) -> ReadDecision:
+    """Decide reads based on their name, flag and position."""
+    return list(ReadDecision)[
+        (sum(map(ord, str(read.query_name))) + read.flag + read.reference_start) % 3
+    ]
+
+
+def expected_decisions(
+    reads: list[pysam.AlignedSegment],
+) -> list[tuple[str, int, ReadDecision]]:
+    """Decide reads with all mates in memory."""
+    primary = {
+        (read.query_name, read.is_read2): decide(read)
+        for read in reads
+        if read.is_paired and not read.is_secondary
+    }
+    expected = []
+    for read in reads:
+        decision = decide(read)
+        other = primary.get((read.query_name, not read.is_read2))
+        if (
+            read.is_paired
+            and not read.is_secondary
+            and decision is ReadDecision.KEEP
+            and other is not None
+        ):
+            decision = other
+        expected.append((str(read.query_name), read.flag, decision))
+    return expected
+
+
+@pytest.mark.parametrize("buffer_size", [1, 7, 10_000])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_decide_mates(
+    buffer_size: int,
+    seed: int,
+) -> None:
+    """Test that the decisions match deciding with all mates in memory."""
+    reads = make_reads(seed)
+    decided = [
+        (str(read.query_name), read.flag, decision)
+        for read, decision in decide_mates(
+            reads,
+            decide,
+            HEADER,
+            buffer_size=buffer_size,
+        )
+    ]
+
+    assert decided == expected_decisions(reads)
+
+
+class RecordingPendingPairs(PendingPairs):
+
+    """Pending pairs that record the most pairs held at once."""
+
+    most_pairs = 0
+    most_in_memory = 0
+
+    def add(
+        self,
+        read: pysam.AlignedSegment,
+        decision: ReadDecision,
+    ) -> None | str:
+        """Add a read, recording the number of pairs."""
+        name = super().add(read, decision)
+        cls = type(self)
+        cls.most_pairs = max(cls.most_pairs, len(self))
+        cls.most_in_memory = max(cls.most_in_memory, len(self.pairs))
+        return name
+
+
+@pytest.mark.parametrize(
+    "flag, mate_fields, most_pairs",
+    [
+        (pysam.FPAIRED | pysam.FREAD1, "chr2\t10", 500),
+        (pysam.FPAIRED | pysam.FMUNMAP | pysam.FREAD1, "*\t0", 1),
+        (pysam.FPAIRED | pysam.FREAD1, "=\t{mate_start}", 7),
+    ],
+    ids=["mate on a later contig", "unplaced unmapped mate", "missing nearby mate"],
+)
+def test_decide_mates_orphans(
+    flag: int,
+    mate_fields: str,
+    most_pairs: int,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that reads whose mates never follow don't accumulate in memory."""
+    monkeypatch.setattr(mates, "PendingPairs", RecordingPendingPairs)
+    monkeypatch.setattr(RecordingPendingPairs, "most_pairs", 0)
+    monkeypatch.setattr(RecordingPendingPairs, "most_in_memory", 0)
+    reads = [
+        pysam.AlignedSegment.fromstring(
+            f"orphan{i}\t{flag}\tchr1\t{1 + i * 10}\t60\t10M\t"
+            f"{mate_fields.format(mate_start=51 + i * 10)}\t0\t*\t*",
+            HEADER,
+        )
+        for i in range(500)
+    ]
+    decided = [
+        decision
+        for _, decision in decide_mates(reads, decide, HEADER, buffer_size=1)
+    ]
+
+    assert decided == [decide(read) for read in reads]
+    assert RecordingPendingPairs.most_pairs == most_pairs
+    assert RecordingPendingPairs.most_in_memory == 1
+
+
+def test_decide_mates_spilled_pairs(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that pairs spilled with their reads still decide both mates."""
+    monkeypatch.setattr(mates, "PendingPairs", RecordingPendingPairs)
+    monkeypatch.setattr(RecordingPendingPairs, "most_pairs", 0)
+    monkeypatch.setattr(RecordingPendingPairs, "most_in_memory", 0)
+    reads = [
+        pysam.AlignedSegment.fromstring(
+            f"pair{i}\t{flag}\t{contig}\t{1 + i * 10}\t60\t10M\t"
+            f"{mate_contig}\t{1 + i * 10}\t0\t*\t*",
+            HEADER,
+        )
+        for contig, mate_contig, flag in [
+            ("chr1", "chr2", pysam.FPAIRED | pysam.FREAD1),
+            ("chr2", "chr1", pysam.FPAIRED | pysam.FREAD2),
+        ]
+        for i in range(500)
+    ]
+    decided = [
+        (str(read.query_name), read.flag, decision)
+        for read, decision in decide_mates(reads, decide, HEADER, buffer_size=10)
+    ]
+
+    assert decided == expected_decisions(reads)
+    assert RecordingPendingPairs.most_pairs == 500  # noqa: PLR2004
+    assert RecordingPendingPairs.most_in_memory == 10  # noqa: PLR2004
+
+
+def test_fiveprime_filter_drop_mates(
+    tmp_path: Path,
+) -> None:
+    """Test that the mate of a discarded R1 read is discarded too."""
+    input_file = tmp_path / "input.sam"
+    input_file.write_text(
+        "@HD\tVN:1.6\tSO:coordinate\n"
+        "@SQ\tSN:chr1\tLN:1000\n"
+        "read1\t65\tchr1\t100\t60\t10S10M\t*\t0\t0\t*\t*\n"
+        "read2\t65\tchr1\t150\t60\t20M\t*\t0\t0\t*\t*\n"
+        "read2\t129\tchr1\t300\t60\t20M\t*\t0\t0\t*\t*\n"
+        "read1\t129\tchr1\t400\t60\t20M\t*\t0\t0\t*\t*\n",
+    )
+    output_file = tmp_path / "output.sam"
+    discarded_file = tmp_path / "discarded.sam"
+
+    fiveprime_filter(
+        input_file,
+        output_file,
+        "sam",
+        discarded_outfile=discarded_file,
+        drop_mates=True,
+        mate_buffer_size=1,
+    )
+
+    def read_records(path: Path) -> list[tuple[str, int]]:
+        with pysam.AlignmentFile(str(path)) as f:
+            return [(str(read.query_name), read.flag) for read in f]
+
+    assert read_records(output_file) == [("read2", 65), ("read2", 129)]
+    assert read_records(discarded_file) == [("read1", 65), ("read1", 129)]
@@ -0,0 +1,117 @@
+"""Test filtering reads with worker processes and pipeline threads."""
+
+from array import array
+from functools import partial
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam import read_filter
+from isatoolkit2.sam.fiveprime_filter import fiveprime_decision
+from isatoolkit2.sam.mapping_filter import alt_sup_decision
+from isatoolkit2.sam.read_filter import filter_reads
+
+SAM_HEADER = "@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:1000\n"
+
+SAM_READS = "".join(
+    f"read{i}\t{flag}\tchr1\t{100 + i}\t60\t{cigar}\t*\t0\t0\t*\t*{tags}\n"
+    for i, (flag, cigar, tags) in enumerate(
+        [
+            (64, "10M", ""),
+            (80, "4M6S", ""),
+            (128, "6S4M", "\tXA:Z:*"),
+            (68, "10M", ""),
+            (64, "6S4M", "\tSA:Z:*"),
+            (144, "10M", ""),
+            (64, "2S8M", ""),
+        ]
+        * 5,
+    )
+)
+
+
+def read_records(path: Path) -> tuple[str, list[str]]:
+    """Read the header and records of a SAM/BAM file."""
+    with pysam.AlignmentFile(str(path)) as f:
+        return str(f.header), [read.to_string() for read in f]
+
+
+@pytest.mark.parametrize(
+    "decide",
+    [
+        partial(fiveprime_decision, max_softclip=5),
+        partial(alt_sup_decision, filter_alt=True, filter_sup=True),
+    ],
+    ids=["fiveprime filter", "mapping filter"],
+)
+@pytest.mark.parametrize(
+    "output_mode",
+    ["w", "wb", "wbu"],
+    ids=["sam", "bam", "uncompressed bam"],
+)
+def test_filter_reads_concurrency(
+    decide: partial,
+    output_mode: str,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that filtering with workers or threads gives the same output."""
+    input_file = tmp_path / "input.sam"
+    input_file.write_text(SAM_HEADER + SAM_READS)
+
+    # Use small batches so that the outputs are made of many parts
+    monkeypatch.setattr(read_filter, "BATCH_SIZE", 4)
+
+    outputs = {}
+    for workers, threads in [(1, 1), (1, 2), (3, 1)]:
+        outfile = tmp_path / f"output_{workers}_{threads}.bam"
+        discarded_outfile = tmp_path / f"discarded_{workers}_{threads}.bam"
+        counts = filter_reads(
+            input_file,
+            outfile,
+            output_mode,  # type: ignore[arg-type]
+            decide,
+            discarded_outfile=discarded_outfile,
+            workers=workers,
+            threads=threads,
+        )
+        outputs[workers, threads] = (
+            counts,
+            read_records(outfile),
+            read_records(discarded_outfile),
+        )
+
+    assert outputs[1, 1] == outputs[1, 2] == outputs[3, 1]
+    assert outputs[1, 1][1][0] == SAM_HEADER
+
+
+def test_filter_reads_tag_types(
+    tmp_path: Path,
+) -> None:
+    """Test that reads filtered by workers keep the types of their tags."""
+    header = pysam.AlignmentHeader.from_text(SAM_HEADER)
+    input_file = tmp_path / "input.bam"
+    with pysam.AlignmentFile(str(input_file), "wb", header=header) as f:
+        for line in SAM_READS.splitlines():
+            read = pysam.AlignedSegment.fromstring(line, header)
+            read.set_tag("XF", 0.123456789, "f")
+            read.set_tag("XI", 5, "I")
+            read.set_tag("XB", array("h", [1, 2]))
+            f.write(read)
+
+    tags = {}
+    for workers in (1, 2):
+        outfile = tmp_path / f"output_{workers}.bam"
+        filter_reads(
+            input_file,
+            outfile,
+            "wb",
+            partial(fiveprime_decision, max_softclip=5),
+            workers=workers,
+        )
+        with pysam.AlignmentFile(str(outfile)) as f:
+            tags[workers] = [read.get_tags(with_value_type=True) for read in f]
+
+    assert tags[1]
+    assert tags[1] == tags[2]
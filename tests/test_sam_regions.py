@@ -0,0 +1,139 @@
+"""Test restricting SAM commands to regions."""
+
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam.count import count_sites
+from isatoolkit2.sam.mapping_filter import alt_sup_filtering
+
+# Reads in the test input
+NUM_READS = 3000
+
+# Length of the contigs of the test input
+CONTIG_LENGTH = 10_000
+
+
+def write_sorted_bam(
+    path: Path,
+    *,
+    index: bool,
+) -> list[tuple[str, int, int, str]]:
+    """Write a coordinate sorted BAM file, returning the reads' coordinates."""
+    header = {
+        "HD": {"VN": "1.6", "SO": "coordinate"},
+        "SQ": [{"SN": name, "LN": CONTIG_LENGTH} for name in ("chr1", "chr2")],
+    }
+    reads = sorted(
+        (i % 2, (i * 7919) % (CONTIG_LENGTH - 100), f"read{i}", 16 if i % 3 else 0)
+        for i in range(NUM_READS)
+    )
+    coordinates = []
+    with pysam.AlignmentFile(str(path), "wb", header=header) as handle:
+        for reference_id, start, name, flag in reads:
+            read = pysam.AlignedSegment(handle.header)
+            read.query_name = name
+            read.flag = flag | 64
+            read.reference_id = reference_id
+            read.reference_start = start
+            read.cigarstring = "50M"
+            read.query_sequence = "A" * 50
+            read.mapping_quality = 60
+            handle.write(read)
+            coordinates.append((f"chr{reference_id + 1}", start, start + 50, name))
+    if index:
+        pysam.index(str(path))
+    return coordinates
+
+
+@pytest.mark.parametrize(
+    "regions, targets",
+    [
+        (["chr1:1,001-2,000"], ""),
+        (["chr1:1001-2000", "chr1:1500-2500", "chr1:2520-3000"], ""),
+        (["chr2", "chr1:9000"], ""),
+        ([], "chr2\t100\t200\nchr1\t4000\t4030\nchr1\t4060\t4100\n"),
+        (["chr1:1-10"], "chr2\t5000\t5001\n"),
+    ],
+    ids=[
+        "one region",
+        "overlapping and close regions",
+        "whole contig and open end",
+        "targets",
+        "regions and targets",
+    ],
+)
+@pytest.mark.parametrize("index", [True, False], ids=["indexed", "streamed"])
+def test_count_regions(
+    regions: list[str],
+    targets: str,
+    index: bool,  # noqa: FBT001
+    tmp_path: Path,
+) -> None:
+    """Test that only reads overlapping the regions are counted, once each."""
+    input_path = tmp_path / "input.bam"
+    write_sorted_bam(input_path, index=index)
+    targets_path = None
+    if targets:
+        targets_path = tmp_path / "targets.bed"
+        targets_path.write_text(targets)
+
+    counts = count_sites(input_path, regions=regions, targets=targets_path)
+    all_counts = count_sites(input_path)
+
+    # The same sites, in the same order, as filtering all counted reads
+    full_counts = count_sites(
+        input_path,
+        regions=[f"chr1:1-{CONTIG_LENGTH}", f"chr2:1-{CONTIG_LENGTH}"],
+    )
+    assert full_counts.integration_sites == all_counts.integration_sites
+    assert counts.r1_total > 0
+    assert counts.r1_total < all_counts.r1_total
+    assert list(counts.integration_sites) == [
+        site
+        for site in all_counts.integration_sites
+        if site in counts.integration_sites
+    ]
+
+
+@pytest.mark.parametrize("index", [True, False], ids=["indexed", "streamed"])
+@pytest.mark.parametrize("workers", [1, 2], ids=["1 worker", "2 workers"])
+def test_filter_regions(
+    index: bool,  # noqa: FBT001
+    workers: int,
+    tmp_path: Path,
+) -> None:
+    """Test that filters only write the reads overlapping the regions."""
+    input_path = tmp_path / "input.bam"
+    coordinates = write_sorted_bam(input_path, index=index)
+    output_path = tmp_path / "output.bam"
+    regions = ["chr1:2001-2100", "chr1:2050-2200", "chr2:101-150"]
+
+    alt_sup_filtering(
+        input_path,
+        output_path,
+        "bam",
+        workers=workers,
+        regions=regions,
+    )
+
+    with pysam.AlignmentFile(str(output_path)) as handle:
+        names = [read.query_name for read in handle]
+    expected = [
+        name
+        for chrom, start, end, name in coordinates
+        if (chrom == "chr1" and start < 2200 and end > 2000)  # noqa: PLR2004
+        or (chrom == "chr2" and start < 150 and end > 100)  # noqa: PLR2004
+    ]
+    assert names == expected
+
+
+def test_missing_contig(
+    tmp_path: Path,
+) -> None:
+    """Test that regions on contigs missing from the header are rejected."""
+    input_path = tmp_path / "input.bam"
+    write_sorted_bam(input_path, index=True)
+    with pytest.raises(ValueError, match="chr3"):
+        count_sites(input_path, regions=["chr3:1-100"])
@@ -0,0 +1,84 @@
+"""Test saturation curves counted in one pass."""
+
+from io import StringIO
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam.count import count_integration_sites, count_sites
+
+# Reads in the test input, more than sites so the curve saturates
+NUM_READS = 3000
+NUM_SITES = 400
+
+
+def write_reads(
+    path: Path,
+) -> None:
+    """Write R1 and R2 reads, with many R1 reads per site."""
+    header = {"HD": {"VN": "1.6"}, "SQ": [{"SN": "chr1", "LN": 100_000}]}
+    with pysam.AlignmentFile(str(path), "wb", header=header) as handle:
+        for i in range(NUM_READS):
+            read = pysam.AlignedSegment(handle.header)
+            read.query_name = f"read{i}"
+            read.flag = 128 if i % 5 == 0 else 64
+            read.reference_id = 0
+            read.reference_start = 1 + (i * 7919) % NUM_SITES * 10
+            read.cigarstring = "5M"
+            read.query_sequence = "AGCTT"
+            read.mapping_quality = 60
+            handle.write(read)
+
+
+@pytest.mark.parametrize(
+    "subsample, seed, points",
+    [(None, 0, 5), (None, 11, 4), (0.5, 3, 5)],
+    ids=["all reads", "other seed", "subsample"],
+)
+def test_saturation(
+    subsample: None | float,
+    seed: int,
+    points: int,
+    tmp_path: Path,
+) -> None:
+    """Test that each depth matches counting a subsample of that depth."""
+    input_path = tmp_path / "input.bam"
+    write_reads(input_path)
+    saturation = tmp_path / "saturation.tsv"
+
+    count_integration_sites(
+        input_path,
+        StringIO(),
+        subsample=subsample,
+        seed=seed,
+        saturation=saturation,
+        saturation_points=points,
+    )
+    lines = saturation.read_text().splitlines()
+    assert lines[0] == "fraction\tr1_reads\tunique_sites"
+    assert len(lines) == points + 1
+
+    for k, line in enumerate(lines[1:], start=1):
+        fraction = k / points
+        counts = count_sites(
+            input_path,
+            subsample=fraction * (subsample or 1.0),
+            seed=seed,
+        )
+        expected = f"{fraction:.4g}\t{counts.r1_total}\t{len(counts.integration_sites)}"
+        assert line == expected
+
+
+def test_saturation_with_checkpoint(
+    tmp_path: Path,
+) -> None:
+    """Test that saturation curves and checkpoints can't be combined."""
+    input_path = tmp_path / "input.bam"
+    write_reads(input_path)
+    with pytest.raises(ValueError, match="checkpoints"):
+        count_sites(
+            input_path,
+            checkpoint=tmp_path / "count.ckpt",
+            saturation_points=5,
+        )
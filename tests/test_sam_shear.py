@@ -0,0 +1,114 @@
+"""Test counting distinct shear sites from the mate fields of R1 reads."""
+
+from io import StringIO
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam.count import count_integration_sites
+from isatoolkit2.sam.shear import shear_position
+
+HEADER = "@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:1000\n@SQ\tSN:chr2\tLN:1000\n"
+
+SAM = (
+    HEADER
+    + "read1\t97\tchr1\t100\t60\t5M\t=\t295\t200\tAGCTT\t*\n"
+    + "read2\t97\tchr1\t100\t60\t5M\t=\t295\t200\tAGCTT\t*\n"
+    + "read3\t97\tchr1\t100\t60\t5M\t=\t245\t150\tAGCTT\t*\n"
+    + "read4\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+    + "read5\t81\tchr1\t100\t60\t5M\t=\t51\t-54\tAGCTT\t*\n"
+    + "read6\t97\tchr2\t100\t60\t5M\tchr1\t500\t0\tAGCTT\t*\n"
+)
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("r\t97\tchr1\t100\t60\t5M\t=\t295\t200\tAGCTT\t*", 298),
+        ("r\t81\tchr1\t100\t60\t5M\t=\t51\t-54\tAGCTT\t*", 50),
+        ("r\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*", None),
+        ("r\t73\tchr1\t100\t60\t5M\t=\t100\t0\tAGCTT\t*", None),
+        ("r\t97\tchr1\t100\t60\t5M\tchr2\t300\t0\tAGCTT\t*", None),
+        ("r\t97\tchr1\t100\t60\t5M\t=\t51\t-54\tAGCTT\t*", None),
+    ],
+    ids=[
+        "forward",
+        "reverse",
+        "unpaired",
+        "mate unmapped",
+        "mate on another chromosome",
+        "forward with negative TLEN",
+    ],
+)
+def test_shear_position(
+    line: str,
+    expected: None | int,
+) -> None:
+    """Test that the mate 5' position is taken from the mate fields."""
+    header = pysam.AlignmentHeader.from_text(HEADER)
+    assert shear_position(pysam.AlignedSegment.fromstring(line, header)) == expected
+
+
+@pytest.mark.parametrize(
+    "exclude, expected_sites, expected_shear_sites",
+    [
+        (
+            None,
+            (
+                "chr1\t99\t99\t.\t4\t+\n"
+                "chr1\t103\t103\t.\t1\t-\n"
+                "chr2\t99\t99\t.\t1\t+\n"
+            ),
+            "chr1\t99\t99\t.\t2\t+\nchr1\t103\t103\t.\t1\t-\n",
+        ),
+        (
+            "chr1\t103\t200\n",
+            "chr1\t99\t99\t.\t4\t+\nchr2\t99\t99\t.\t1\t+\n",
+            "chr1\t99\t99\t.\t2\t+\n",
+        ),
+    ],
+    ids=["all sites", "excluded site"],
+)
+def test_sam_count_shear_sites(
+    exclude: None | str,
+    expected_sites: str,
+    expected_shear_sites: str,
+    tmp_path: Path,
+) -> None:
+    """Test that distinct shear sites are counted in the same pass as reads."""
+    input_sam_path = tmp_path / "input.sam"
+    input_sam_path.write_text(SAM)
+    exclude_path = None
+    if exclude is not None:
+        exclude_path = tmp_path / "exclude.bed"
+        exclude_path.write_text(exclude)
+    shear_sites_path = tmp_path / "shear_sites.bed"
+
+    output_bed_file = StringIO()
+    counts = count_integration_sites(
+        input_sam_path,
+        output_bed_file,
+        exclude=exclude_path,
+        shear_sites=shear_sites_path,
+    )
+
+    assert output_bed_file.getvalue() == expected_sites
+    assert shear_sites_path.read_text() == expected_shear_sites
+    assert counts.shear_sites is not None
+    assert (counts.shear_sites.pairs, counts.shear_sites.unpaired) == (4, 2)
+
+
+def test_sam_count_shear_sites_checkpoint(
+    tmp_path: Path,
+) -> None:
+    """Test that shear site counting is rejected with checkpoints."""
+    input_sam_path = tmp_path / "input.sam"
+    input_sam_path.write_text(HEADER)
+    with pytest.raises(ValueError, match="not supported with checkpoints"):
+        count_integration_sites(
+            input_sam_path,
+            StringIO(),
+            checkpoint=tmp_path / "checkpoint",
+            shear_sites=tmp_path / "shear_sites.bed",
+        )
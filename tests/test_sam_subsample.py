@@ -0,0 +1,118 @@
+"""Test subsampling reads by query name."""
+
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam.count import count_sites
+from isatoolkit2.sam.fiveprime_filter import fiveprime_filter
+from isatoolkit2.sam.subsample import ReadSubsampler
+
+# Read pairs in the test input
+NUM_PAIRS = 2000
+
+
+def write_pairs(
+    path: Path,
+) -> None:
+    """Write both mates of read pairs, as in a name grouped file."""
+    header = {"HD": {"VN": "1.6"}, "SQ": [{"SN": "chr1", "LN": 100_000}]}
+    with pysam.AlignmentFile(str(path), "wb", header=header) as handle:
+        for i in range(NUM_PAIRS):
+            for flag in (67, 147):
+                read = pysam.AlignedSegment(handle.header)
+                read.query_name = f"A00123:45:HXXXX:1:1101:{i}:{i * 7}"
+                read.flag = flag
+                read.reference_id = 0
+                read.reference_start = 1 + i * 13
+                read.cigarstring = "5M"
+                read.query_sequence = "AGCTT"
+                read.mapping_quality = 60
+                handle.write(read)
+
+
+def read_names(
+    path: Path,
+) -> list[str]:
+    """Get the query names of the reads in a file."""
+    with pysam.AlignmentFile(str(path)) as handle:
+        return [read.query_name or "" for read in handle]
+
+
+@pytest.mark.parametrize(
+    "fraction, seed",
+    [(0.1, 0), (0.5, 0), (0.5, 7), (1.0, 0)],
+    ids=["10%", "50%", "50% other seed", "all"],
+)
+def test_subsample_filter(
+    fraction: float,
+    seed: int,
+    tmp_path: Path,
+) -> None:
+    """Test that subsampling keeps pairs together, reproducibly."""
+    input_path = tmp_path / "input.bam"
+    write_pairs(input_path)
+
+    outputs = []
+    for workers, threads in ((1, 1), (1, 2), (2, 1)):
+        output_path = tmp_path / f"output-{workers}-{threads}.bam"
+        fiveprime_filter(
+            input_path,
+            output_path,
+            "bam",
+            workers=workers,
+            threads=threads,
+            subsample=fraction,
+            seed=seed,
+        )
+        outputs.append(read_names(output_path))
+
+    # The same reads are kept with any number of workers or threads
+    assert outputs[0] == outputs[1] == outputs[2]
+
+    # Both mates of each kept pair are kept
+    names = outputs[0]
+    assert all(names.count(name) == 2 for name in names)  # noqa: PLR2004
+    kept_pairs = len(names) / 2
+    assert kept_pairs == pytest.approx(fraction * NUM_PAIRS, rel=0.15)
+
+    # The kept reads are the ones in the subsample
+    subsampler = ReadSubsampler(fraction, seed)
+    assert set(names) == {
+        name
+        for name in read_names(input_path)
+        if subsampler.hash(name) < subsampler.threshold
+    }
+
+
+def test_subsample_count(
+    tmp_path: Path,
+) -> None:
+    """Test that counting a subsample only counts the R1 reads in it."""
+    input_path = tmp_path / "input.bam"
+    write_pairs(input_path)
+
+    counts = count_sites(input_path, subsample=0.25, seed=3)
+    other_seed = count_sites(input_path, subsample=0.25, seed=4)
+    subsampler = ReadSubsampler(0.25, 3)
+
+    assert counts.r1_total == sum(
+        subsampler.hash(name) < subsampler.threshold
+        for name in read_names(input_path)[::2]
+    )
+    assert counts.integration_sites != other_seed.integration_sites
+
+
+@pytest.mark.parametrize(
+    "fraction, seed",
+    [(0, 0), (1.5, 0), (0.5, -1)],
+    ids=["zero", "above one", "negative seed"],
+)
+def test_subsample_invalid(
+    fraction: float,
+    seed: int,
+) -> None:
+    """Test that invalid fractions and seeds are rejected."""
+    with pytest.raises(ValueError, match="Subsample"):
+        ReadSubsampler(fraction, seed)
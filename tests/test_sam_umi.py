@@ -0,0 +1,213 @@
+"""Test UMI-deduplicated counting of integration sites."""
+
+from array import array
+from io import StringIO
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam.count import count_integration_sites
+from isatoolkit2.sam.distinct import DISTINCT_ARRAY_SIZE
+from isatoolkit2.sam.umi import (
+    UmiCounts,
+    decode_umi,
+    encode_umi,
+    umi_clusters,
+)
+
+HEADER = "@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:1000\n"
+
+
+@pytest.mark.parametrize(
+    "umi, expected",
+    [
+        ("ACGT", "ACGT"),
+        ("acgt", "ACGT"),
+        ("AAAA", "AAAA"),
+        ("ACGT-TTAA", "ACGTTTAA"),
+        ("T" * 31, "T" * 31),
+        ("ACNT", None),
+        ("AC1T", None),
+        ("", None),
+        ("A" * 32, None),
+    ],
+    ids=[
+        "bases",
+        "lowercase",
+        "leading A",
+        "dual UMI",
+        "longest",
+        "N",
+        "digit",
+        "empty",
+        "too long",
+    ],
+)
+def test_encode_umi(
+    umi: str,
+    expected: None | str,
+) -> None:
+    """Test that UMIs are packed losslessly, and invalid UMIs rejected."""
+    packed = encode_umi(umi)
+    if expected is None:
+        assert packed is None
+    else:
+        assert packed is not None
+        assert decode_umi(packed) == expected
+
+
+def test_encode_umi_lengths() -> None:
+    """Test that UMIs of different lengths don't collide."""
+    assert encode_umi("A") != encode_umi("AA")
+
+
+@pytest.mark.parametrize(
+    "umis, expected",
+    [
+        (["ACGT"], 1),
+        (["ACGT", "ACGA"], 1),
+        (["ACGT", "TGCA"], 2),
+        (["AAAA", "AAAT", "AATT", "ATTT"], 1),
+        (["AAAA", "TTTT", "AAAT", "TTTA", "GGGG"], 3),
+    ],
+    ids=["single", "one apart", "far apart", "chained", "several clusters"],
+)
+def test_umi_clusters(
+    umis: list[str],
+    expected: int,
+) -> None:
+    """Test that UMIs one base apart are counted as one cluster."""
+    packed = [encode_umi(umi) for umi in umis]
+    assert umi_clusters(umi for umi in packed if umi is not None) == expected
+    assert None not in packed
+
+
+def _read(
+    name: str,
+    umi_tag: None | str = None,
+) -> pysam.AlignedSegment:
+    """Make an unmapped read with a name, and a UMI tag if given."""
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    if umi_tag is not None:
+        read.set_tag("RX", umi_tag)
+    return read
+
+
+@pytest.mark.parametrize(
+    "umis, read, expected",
+    [
+        (UmiCounts(), _read("read1_ACGT"), "ACGT"),
+        (UmiCounts(), _read("read1:ACGT"), None),
+        (UmiCounts(separator=":"), _read("read1:ACGT"), "ACGT"),
+        (UmiCounts(), _read("ACGT"), None),
+        (UmiCounts(), _read("read1_ACNT"), None),
+        (UmiCounts(tag="RX"), _read("read1_ACGT", "TTTT"), "TTTT"),
+        (UmiCounts(tag="RX"), _read("read1_ACGT"), None),
+    ],
+    ids=[
+        "name",
+        "other separator",
+        "custom separator",
+        "name without UMI",
+        "invalid UMI",
+        "tag",
+        "missing tag",
+    ],
+)
+def test_read_umi(
+    umis: UmiCounts,
+    read: pysam.AlignedSegment,
+    expected: None | str,
+) -> None:
+    """Test that UMIs are read from tags or the end of query names."""
+    packed = umis.umi(read)
+    assert (decode_umi(packed) if packed is not None else None) == expected
+
+
+def test_site_umis_storage() -> None:
+    """Test that site UMIs grow from an integer to an array to a set."""
+    umis = UmiCounts(tag="RX")
+    site = ("chr1", 99, "+")
+    bases = "ACGT"
+    umi_names = [
+        "".join(bases[(i >> shift) & 3] for shift in range(0, 12, 2))
+        for i in range(DISTINCT_ARRAY_SIZE + 1)
+    ]
+
+    assert umis.add(site, _read("read", umi_names[0]))
+    assert isinstance(umis.sites[site], int)
+    assert umis.add(site, _read("read", umi_names[0]))
+    assert isinstance(umis.sites[site], int)
+    for umi in umi_names[1:DISTINCT_ARRAY_SIZE]:
+        assert umis.add(site, _read("read", umi))
+    site_umis = umis.sites[site]
+    assert isinstance(site_umis, array)
+    assert list(site_umis) == sorted(site_umis)
+    assert umis.add(site, _read("read", umi_names[-1]))
+    assert isinstance(umis.sites[site], set)
+
+    assert not umis.add(site, _read("read"))
+    assert dict(umis.counts()) == {site: DISTINCT_ARRAY_SIZE + 1}
+    assert umis.reads == DISTINCT_ARRAY_SIZE + 2
+    assert umis.invalid == 1
+
+
+@pytest.mark.parametrize(
+    "options, expected",
+    [
+        (
+            {"umi_from_name": True},
+            "chr1\t99\t99\t.\t3\t+\nchr1\t103\t103\t.\t1\t-\n",
+        ),
+        (
+            {"umi_from_name": True, "collapse_umis": True},
+            "chr1\t99\t99\t.\t2\t+\nchr1\t103\t103\t.\t1\t-\n",
+        ),
+        (
+            {"umi_tag": "RX"},
+            "chr1\t99\t99\t.\t1\t+\n",
+        ),
+        (
+            {},
+            "chr1\t99\t99\t.\t5\t+\nchr1\t103\t103\t.\t2\t-\n",
+        ),
+    ],
+    ids=["distinct UMIs", "collapsed UMIs", "UMI tag", "reads"],
+)
+def test_sam_count_umis(
+    options: dict[str, str | bool],
+    expected: str,
+    tmp_path: Path,
+) -> None:
+    """Test that sites are counted by distinct UMIs instead of reads."""
+    input_sam_path = tmp_path / "input.sam"
+    input_sam_path.write_text(
+        HEADER
+        + "read1_AAAA\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\tRX:Z:GGGG\n"
+        + "read2_AAAA\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\tRX:Z:GGGG\n"
+        + "read3_AAAT\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        + "read4_CCCC\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        + "read5_NNNN\t64\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        + "read6_AAAA\t80\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n"
+        + "read7_AAAA\t80\tchr1\t100\t60\t5M\t*\t0\t0\tAGCTT\t*\n",
+    )
+    output_bed_file = StringIO()
+    count_integration_sites(input_sam_path, output_bed_file, **options)  # type: ignore[arg-type]
+    assert output_bed_file.getvalue() == expected
+
+
+def test_sam_count_umis_checkpoint(
+    tmp_path: Path,
+) -> None:
+    """Test that UMI counting is rejected with checkpoints."""
+    input_sam_path = tmp_path / "input.sam"
+    input_sam_path.write_text(HEADER)
+    with pytest.raises(ValueError, match="not supported with checkpoints"):
+        count_integration_sites(
+            input_sam_path,
+            StringIO(),
+            checkpoint=tmp_path / "checkpoint",
+            umi_from_name=True,
+        )
@@ -0,0 +1,143 @@
+"""Test the SAM/BAM/CRAM utilities."""
+
+import hashlib
+from pathlib import Path
+
+import pysam
+import pytest
+
+from isatoolkit2.sam.sam_utils import (
+    get_output_mode,
+    open_alignment_file,
+    populate_reference_cache,
+    reference_cache_path,
+)
+
+REFERENCE_SEQUENCE = "ACGTTGCAAC" * 100
+
+SAM_DATA = (
+    "@HD\tVN:1.6\tSO:coordinate\n"
+    "@SQ\tSN:chr1\tLN:1000\n"
+    f"read1\t64\tchr1\t100\t60\t10M\t*\t0\t0\t{REFERENCE_SEQUENCE[99:109]}\t*\n"
+    f"read2\t80\tchr1\t200\t60\t3S7M\t*\t0\t0\tTTT{REFERENCE_SEQUENCE[199:206]}\t*\n"
+)
+
+
+@pytest.fixture
+def reference(tmp_path: Path) -> Path:
+    """Create a reference FASTA file, with lower case bases."""
+    reference = tmp_path / "reference.fa"
+    reference.write_text(
+        ">chr1\n"
+        + "\n".join(
+            REFERENCE_SEQUENCE[i : i + 60].lower()
+            for i in range(0, len(REFERENCE_SEQUENCE), 60)
+        )
+        + "\n",
+    )
+    return reference
+
+
+@pytest.mark.parametrize(
+    "output_format, uncompressed, expected_mode",
+    [
+        ("sam", False, "w"),
+        ("bam", False, "wb"),
+        ("bam", True, "wbu"),
+        ("cram", False, "wc"),
+    ],
+    ids=["sam", "bam", "uncompressed bam", "cram"],
+)
+def test_get_output_mode(
+    output_format: str,
+    expected_mode: str,
+    *,
+    uncompressed: bool,
+) -> None:
+    """Test the output modes of the output formats."""
+    assert (
+        get_output_mode(output_format, uncompressed=uncompressed)  # type: ignore[arg-type]
+        == expected_mode
+    )
+
+
+def test_cram_round_trip(
+    reference: Path,
+    tmp_path: Path,
+) -> None:
+    """Test writing and reading a CRAM file with a reference FASTA."""
+    input_file = tmp_path / "input.sam"
+    input_file.write_text(SAM_DATA)
+    cram_file = tmp_path / "output.cram"
+
+    with (
+        open_alignment_file(input_file) as infile_handle,
+        open_alignment_file(
+            cram_file,
+            "wc",
+            reference=reference,
+            template=infile_handle,
+        ) as outfile_handle,
+    ):
+        for read in infile_handle:
+            outfile_handle.write(read)
+
+    with open_alignment_file(cram_file, reference=reference) as f:
+        reads = [
+            (
+                read.query_name,
+                read.reference_start,
+                read.cigarstring,
+                read.query_sequence,
+            )
+            for read in f
+        ]
+    assert reads == [
+        ("read1", 99, "10M", REFERENCE_SEQUENCE[99:109]),
+        ("read2", 199, "3S7M", f"TTT{REFERENCE_SEQUENCE[199:206]}"),
+    ]
+
+
+def test_populate_reference_cache(
+    reference: Path,
+    tmp_path: Path,
+) -> None:
+    """Test that sequences are cached under the MD5 of their upper case bases."""
+    cache_dir = tmp_path / "cache"
+    populate_reference_cache(reference, cache_dir)
+
+    md5 = hashlib.md5(REFERENCE_SEQUENCE.encode()).hexdigest()  # noqa: S324
+    cached = reference_cache_path(cache_dir, md5)
+    assert cached.read_text() == REFERENCE_SEQUENCE
+    assert cached.relative_to(cache_dir).parts == (md5[:2], md5[2:4], md5[4:])
+
+    # A populated reference is skipped
+    cached.unlink()
+    populate_reference_cache(reference, cache_dir)
+    assert not cached.exists()
+
+
+def test_md5_matches_cram_header(
+    reference: Path,
+    tmp_path: Path,
+) -> None:
+    """Test that cached sequences are named by the M5 tag written by htslib."""
+    input_file = tmp_path / "input.sam"
+    input_file.write_text(SAM_DATA)
+    cram_file = tmp_path / "output.cram"
+    with (
+        pysam.AlignmentFile(str(input_file)) as infile_handle,
+        pysam.AlignmentFile(
+            str(cram_file),
+            "wc",
+            template=infile_handle,
+            reference_filename=str(reference),
+        ),
+    ):
+        pass
+
+    cache_dir = tmp_path / "cache"
+    populate_reference_cache(reference, cache_dir)
+    with pysam.AlignmentFile(str(cram_file), reference_filename=str(reference)) as f:
+        md5 = f.header.to_dict()["SQ"][0]["M5"]
+    assert reference_cache_path(cache_dir, md5).exists()
@@ -0,0 +1,84 @@
+"""Test the warm daemon and its client."""
+
+import subprocess
+import sys
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from isatoolkit2.serve import serve
+
+BED = "chr2\t100\t100\t.\t3\t+\nchr1\t5\t5\t.\t1\t-\n"
+SORTED_BED = "chr1\t5\t5\t.\t1\t-\nchr2\t100\t100\t.\t3\t+\n"
+
+
+@pytest.fixture
+def socket_path(tmp_path: Path) -> Iterator[Path]:
+    """Start a daemon in a subprocess, stopping it after the test."""
+    socket_path = tmp_path / "trace.sock"
+    daemon = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-m", "isatoolkit2.main", "serve", "-s", str(socket_path)],
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            if socket_path.exists():
+                break
+            time.sleep(0.1)
+        yield socket_path
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    assert not socket_path.exists()
+
+
+def submit(
+    socket_path: Path,
+    args: list[str],
+    cwd: Path,
+    stdin: str = "",
+) -> subprocess.CompletedProcess[str]:
+    """Run a command with the trace-submit client."""
+    return subprocess.run(  # noqa: S603
+        [sys.executable, "-m", "isatoolkit2.serve", "-s", str(socket_path), *args],
+        input=stdin,
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+        check=False,
+    )
+
+
+@pytest.mark.parametrize(
+    "args, expected_stdout, expected_exit_code",
+    [
+        (["bed", "sort", "-i", "input.bed"], SORTED_BED, 0),
+        (["bed", "sort"], SORTED_BED, 0),
+        (["bed", "sort", "-i", "missing.bed"], "", 2),
+    ],
+    ids=["relative input path", "stdin", "usage error"],
+)
+def test_submit(
+    args: list[str],
+    expected_stdout: str,
+    expected_exit_code: int,
+    socket_path: Path,
+    tmp_path: Path,
+) -> None:
+    """Test that submitted commands use the client's directory and streams."""
+    (tmp_path / "input.bed").write_text(BED)
+
+    result = submit(socket_path, args, tmp_path, stdin=BED)
+
+    assert result.returncode == expected_exit_code
+    assert result.stdout == expected_stdout
+
+
+def test_already_serving(
+    socket_path: Path,
+) -> None:
+    """Test that a second daemon doesn't take over a listening socket."""
+    with pytest.raises(ValueError, match="already listening"):
+        serve(socket_path)